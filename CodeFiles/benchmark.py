@@ -0,0 +1,214 @@
+from parse_file import *
+from stage_timer import *
+import datetime
+import json
+import subprocess
+import sys
+import tempfile
+
+
+# Times each stage of the classification pipeline on synthetic (Counts_In_Silico.py) and replayed (Counts_Replay.py) counts files.
+# Every input is run in its own process so its peak memory is its own, and the results are saved as JSON along with the commit
+# they were run on so that runs of two commits can be compared with -compare
+
+CODE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_DIRECTORY = os.path.join(CODE_DIRECTORY, '..', 'SequenceGenerator')
+WORK_DIRECTORY = os.path.join(CODE_DIRECTORY, '..', 'DataFiles', 'Benchmarks')
+SIZES = [10000, 100000, 1000000, 10000000]
+INPUT_KINDS = ['synthetic', 'replay']
+SYNTHETIC_PAYLOAD_SIZE = 2865
+REPLAY_SOURCE = os.path.join(CODE_DIRECTORY, '..', 'DataFiles', 'Inputs', 'OXB_Data', 'tiling', 'bc1020.tile.zmw.counts')
+REPLAY_PAYLOAD_SIZE = 1872
+STAGES = ['read', 'tilelines', 'lex', 'parse', 'bin', 'tsv', 'counts_files', 'plot']
+
+
+# runs every stage of parse_file.py on one input, the same way main() does but one stage at a time.
+# The tilelines stage only makes TileLine objects: their Tile objects are made the first time they're needed, so that time falls in the parse stage
+# for the full payload checks of expected species and in the bin stage for the full payload proportions. Results from before this have a tiles stage
+# instead, which made every Tile and isn't compared with -compare.
+# The lex stage tokenizes every tile pattern on its own; the parse stage is VectorSubParser.run, which lexes again as it parses
+def benchmark_file(input_file, payload_size, output_directory, group_categories=None):
+    Tile.expected_payload_size = payload_size
+    file_parser = FileParser('')
+    timer = StageTimer()
+
+    timer.start('read')
+    with open(input_file, 'r') as f:
+        lines = [line for line in f if line.strip()]
+
+    timer.start('tilelines')
+    tile_lines = []
+    for line in lines:
+        if ' U ' in line:
+            formatted_lines = file_parser.format_U_line(line)
+        elif ' x 2' in line:
+            formatted_lines = [file_parser.format_x_2_line(line)]
+        else:
+            formatted_lines = [line]
+        for formatted_line in formatted_lines:
+            tile_line = file_parser.make_tileline(formatted_line)
+            if tile_line is not None:
+                tile_lines.append(tile_line)
+
+    tile_pattern_count = len(tile_lines)  # bin_tilelines empties the list
+
+    timer.start('lex')
+    for tile_line in tile_lines:
+        file_parser.parser.lexer.tokenize(' '.join([tile for tile in tile_line.raw_data.split() if 'poly' not in tile]))
+
+    timer.start('parse')
+    for tile_line in tile_lines:
+        file_parser.parser.run(tile_line)
+    file_parser.unbinned_tilelines = tile_lines
+
+    timer.start('bin')
+    if group_categories:
+        file_parser.group_categories(get_category_groups(group_categories))
+    file_parser.bin_tilelines()
+
+    timer.start('tsv')
+    output_file = os.path.join(output_directory, os.path.basename(input_file).split('.')[0] + '.subparsed.tsv')
+    file_parser.write_to_file(output_file)
+
+    timer.start('counts_files')
+    for bin in file_parser.bins_list:
+        file_parser.write_bin(os.path.join(output_directory, f'{os.path.basename(input_file).split(".")[0]}.{bin.name}.tile.zmw.counts'), bin)
+
+    timer.start('plot')
+    GraphWriter(output_file)
+    plt.close('all')
+
+    stages = timer.report(len(lines))
+    return {'input_file': os.path.abspath(input_file), 'payload_size': payload_size, 'lines': len(lines), 'tile_patterns': tile_pattern_count,
+            'reversed_parses': file_parser.parser.reversed_parse_count, 'stages': stages, 'total_seconds': timer.total_seconds(),
+            'lines_per_second': len(lines) / timer.total_seconds(), 'peak_rss_mb': StageTimer.get_peak_rss_mb()}
+
+
+# runs benchmark_file in a new process so that peak memory isn't carried over from earlier inputs
+def benchmark_file_in_subprocess(input_file, payload_size, group_categories=None):
+    with tempfile.TemporaryDirectory() as output_directory:
+        command = [sys.executable, os.path.abspath(__file__), '-single_input', input_file, '-payload_size', str(payload_size), '-output_directory', output_directory]
+        if group_categories:
+            command += ['-group_categories', group_categories]
+        completed = subprocess.run(command, capture_output=True, text=True, cwd=CODE_DIRECTORY)
+    if completed.returncode != 0:
+        raise ValueError(f'benchmarking {input_file} failed:\n{completed.stderr}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+# makes the input file of the given kind and number of lines, reusing it if it was made by an earlier run.
+# Replayed files are whole multiples of the source file, so they have about as many lines as asked for
+def get_input_file(kind, size, input_directory, workers):
+    sample_name = f'{kind}_{size}'
+    input_file = os.path.join(input_directory, f'{sample_name}.tile.zmw.counts')
+    if os.path.isfile(input_file):
+        return input_file
+    if kind == 'synthetic':
+        command = ['Counts_In_Silico.py', '-lines', str(size)]
+    else:
+        with open(REPLAY_SOURCE, 'r') as f:
+            source_lines = sum([1 for line in f if line.strip()])
+        command = ['Counts_Replay.py', '-input_file', os.path.abspath(REPLAY_SOURCE), '-scale', str(max(1, round(size / source_lines)))]
+    command += ['-output_directory', os.path.abspath(input_directory), '-sample_name', sample_name, '-workers', str(workers)]
+    subprocess.run([sys.executable] + command, check=True, capture_output=True, cwd=GENERATOR_DIRECTORY)
+    return input_file
+
+
+def get_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=CODE_DIRECTORY).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, cwd=CODE_DIRECTORY).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def format_result(result):
+    stage_rates = ' '.join([f'{stage}={result["stages"][stage]["seconds"]:.2f}s' for stage in STAGES if stage in result['stages']])
+    return f'{os.path.basename(result["input_file"])}: {result["lines"]} lines, {result["lines_per_second"]:.0f} lines/s, peak {result["peak_rss_mb"]:.0f} MB | {stage_rates}'
+
+
+# prints, for every input in both benchmark files, how much faster (>1) or slower (<1) each stage ran in the new file than in the old
+def compare_benchmarks(old_benchmark_file, new_benchmark_file):
+    with open(old_benchmark_file, 'r') as f:
+        old_benchmark = json.load(f)
+    with open(new_benchmark_file, 'r') as f:
+        new_benchmark = json.load(f)
+    print(f'speedup of {new_benchmark["commit"][:10]} over {old_benchmark["commit"][:10]}')
+    old_results = {os.path.basename(result['input_file']): result for result in old_benchmark['results']}
+    for new_result in new_benchmark['results']:
+        old_result = old_results.get(os.path.basename(new_result['input_file']))
+        if old_result is None:
+            continue
+        speedups = [f'{stage}={old_result["stages"][stage]["seconds"] / new_result["stages"][stage]["seconds"]:.2f}x' for stage in STAGES
+                    if stage in old_result['stages'] and stage in new_result['stages'] and new_result['stages'][stage]['seconds']]
+        print(f'{os.path.basename(new_result["input_file"])}: total={old_result["total_seconds"] / new_result["total_seconds"]:.2f}x '
+              f'peak memory={new_result["peak_rss_mb"] / old_result["peak_rss_mb"]:.2f} of old | {" ".join(speedups)}')
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='VectorSubparserBenchmark',
+                                    description='Times each stage of the vector subparser on synthetic and replayed counts files of increasing size')
+    parser.add_argument('-sizes', type=int, nargs='+', default=SIZES,
+                        help=f'the numbers of lines in the generated input files. The default is {SIZES}')
+    parser.add_argument('-kinds', choices=INPUT_KINDS, nargs='+', default=INPUT_KINDS,
+                        help='the kinds of generated input files, synthetic (Counts_In_Silico.py) and/or replayed from bc1020 (Counts_Replay.py). The default is both')
+    parser.add_argument('-input_files', type=str, nargs='+', default=[],
+                        help='counts files to benchmark instead of generated ones, all with the payload size given by -payload_size')
+    parser.add_argument('-payload_size', type=int, default=None,
+                        help='the expected payload size of the files given by -input_files')
+    parser.add_argument('-group_categories', choices=['five', 'six', 'two'], default=None,
+                        help='group categories as parse_file.py does, so the bin stage includes grouping')
+    parser.add_argument('-work_directory', type=str, default=WORK_DIRECTORY,
+                        help=f'the directory that generated inputs are kept in and the results are written to. The default is {WORK_DIRECTORY}')
+    parser.add_argument('-output_file', type=str, default=None,
+                        help='the JSON file to write the results to. The default is benchmark_<commit>.json in the work directory')
+    parser.add_argument('-workers', type=int, default=4,
+                        help='the number of processes used to generate inputs. The default is 4')
+    parser.add_argument('-compare', type=str, nargs=2, default=None, metavar=('OLD_JSON', 'NEW_JSON'),
+                        help='compare two benchmark result files instead of running a benchmark')
+    # used by benchmark_file_in_subprocess to run a single input
+    parser.add_argument('-single_input', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('-output_directory', type=str, default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    arguments = GetArguments().parse_args()
+    if arguments.compare:
+        compare_benchmarks(*arguments.compare)
+        return
+    if arguments.single_input:
+        print(json.dumps(benchmark_file(arguments.single_input, arguments.payload_size, arguments.output_directory, arguments.group_categories)))
+        return
+
+    # getting the inputs as (file, payload size) pairs
+    if arguments.input_files:
+        if arguments.payload_size is None: raise ValueError('-payload_size is required with -input_files')
+        inputs = [(input_file, arguments.payload_size) for input_file in arguments.input_files]
+    else:
+        input_directory = os.path.join(arguments.work_directory, 'inputs')
+        os.makedirs(input_directory, exist_ok=True)
+        inputs = []
+        for kind in arguments.kinds:
+            for size in arguments.sizes:
+                print(f'getting {kind} input with {size} lines')
+                inputs.append((get_input_file(kind, size, input_directory, arguments.workers), SYNTHETIC_PAYLOAD_SIZE if kind == 'synthetic' else REPLAY_PAYLOAD_SIZE))
+
+    commit, dirty = get_commit()
+    results = []
+    for input_file, payload_size in inputs:
+        results.append(benchmark_file_in_subprocess(input_file, payload_size, arguments.group_categories))
+        print(format_result(results[-1]))
+
+    output_file = arguments.output_file
+    if output_file is None:
+        os.makedirs(arguments.work_directory, exist_ok=True)
+        output_file = os.path.join(arguments.work_directory, f'benchmark_{commit[:10]}.json')
+    with open(output_file, 'w') as f:
+        json.dump({'commit': commit, 'uncommitted_changes': dirty, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': sys.version.split()[0], 'results': results}, f, indent=2)
+    print(f'results written to {output_file}')
+
+if __name__ == '__main__':
+    main()
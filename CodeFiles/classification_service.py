@@ -0,0 +1,208 @@
+from classifier import *
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+import threading
+import time
+
+
+# Runs the vector subparser as a long lived local service, so that per-sample runs don't pay for starting Python, importing pandas and
+# seaborn, and building the PLY lexer and parser tables every time. Each worker process builds its parsers once and keeps them, along with
+# their parse caches, for every request it handles. Requests are JSON POSTs to /classify naming a counts file, or giving its lines, along with
+# the same options as parse_file.py; the response is the category summary of the *.subparsed.tsv file. Nothing is written to disk.
+# GET /metrics gives request latency and throughput, and GET /health reports that the service is up
+
+PORT = 8765
+WORKERS = 4
+# the latency percentiles in /metrics are taken over this many of the most recent requests
+LATENCY_WINDOW = 1000
+REQUEST_DEFAULTS = {'input_file': None, 'lines': None, 'payload_size': None, 'coordinate_buffer': 6, 'group_categories': None,
+                    'require_full_payloads': True, 'noncanonical_analysis': False, 'parse_homopolymers': False, 'untileable_sequences': False}
+
+
+# worker-side parsers, one for each parse_homopolymers setting, built once per process by warm_parsers
+_worker_parsers = {}
+
+
+def warm_parsers():
+    for parse_homopolymers in [False, True]:
+        _worker_parsers[parse_homopolymers] = VectorSubParser(VectorLexer(), parse_homopolymers=parse_homopolymers)
+
+
+# the request options with defaults filled in; unknown options and a missing payload size or input raise a ValueError
+def get_request_options(request):
+    unknown_options = set(request) - set(REQUEST_DEFAULTS)
+    if unknown_options:
+        raise ValueError(f'unknown request options: {sorted(unknown_options)}')
+    options = dict(REQUEST_DEFAULTS, **request)
+    if options['payload_size'] is None:
+        raise ValueError('payload_size is required')
+    if (options['input_file'] is None) == (options['lines'] is None):
+        raise ValueError('exactly one of input_file or lines is required')
+    if options['group_categories'] not in [None, 'five', 'six', 'two']:
+        raise ValueError(f'group_categories must be five, six or two, not {options["group_categories"]}')
+    return options
+
+
+# classifies one request in a worker process with classify(), reusing the worker's parser for the request's parse_homopolymers setting
+def classify_request(request):
+    options = get_request_options(request)
+    if not _worker_parsers:
+        warm_parsers()
+    result = classify(options['input_file'] if options['input_file'] is not None else options['lines'], options['payload_size'], 
+                      coordinate_buffer=options['coordinate_buffer'], group_categories=options['group_categories'], 
+                      require_full_payloads=options['require_full_payloads'], noncanonical_analysis=options['noncanonical_analysis'], 
+                      untileable_sequences=options['untileable_sequences'], parser=_worker_parsers[options['parse_homopolymers']])
+    return {'categories': result.get_summaries(), 'lines': sum(result.counters['lines'].values()), 'counters': result.counters}
+
+
+# request counts, latencies and line throughput across every request the service has handled. Updated from the server's request threads
+class ServiceMetrics:
+    def __init__(self, latency_window=LATENCY_WINDOW):
+        self.start_time = time.time()
+        self.request_count = 0
+        self.error_count = 0
+        self.line_count = 0
+        self.busy_seconds = 0.0
+        self.latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds, lines=0, error=False):
+        with self._lock:
+            self.request_count += 1
+            self.error_count += int(error)
+            self.line_count += lines
+            self.busy_seconds += seconds
+            self.latencies.append(seconds)
+
+    # the latency at the given percentile (0 to 100) of the recent requests, by the nearest rank
+    def get_latency_percentile(self, percentile):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[max(0, int(round(percentile / 100 * len(latencies))) - 1)]
+
+    def report(self):
+        with self._lock:
+            uptime = time.time() - self.start_time
+            return {'uptime_seconds': uptime, 'requests': self.request_count, 'errors': self.error_count, 'lines': self.line_count,
+                    'requests_per_second': self.request_count / uptime if uptime else None,
+                    'lines_per_second': self.line_count / uptime if uptime else None,
+                    'lines_per_busy_second': self.line_count / self.busy_seconds if self.busy_seconds else None,
+                    'latency_seconds': {'p50': self.get_latency_percentile(50), 'p95': self.get_latency_percentile(95),
+                                        'max': max(self.latencies) if self.latencies else None}}
+
+
+# handles the HTTP requests; the worker pool and metrics are attributes of the server
+class ClassificationRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'workers': self.server.workers})
+        elif self.path == '/metrics':
+            self.send_json(200, self.server.metrics.report())
+        else:
+            self.send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/classify':
+            self.send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        start_time = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if type(request) is not dict:
+                raise ValueError('the request must be a JSON object')
+            result = self.server.pool.submit(classify_request, request).result()
+        except (ValueError, FileNotFoundError) as error:
+            self.server.metrics.add(time.perf_counter() - start_time, error=True)
+            self.send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            self.server.metrics.add(time.perf_counter() - start_time, error=True)
+            self.send_json(500, {'error': f'{type(error).__name__}: {error}'})
+            return
+        result['seconds'] = time.perf_counter() - start_time
+        self.server.metrics.add(result['seconds'], lines=result['lines'])
+        self.send_json(200, result)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # only errors are logged, so the service's output isn't flooded by every request
+    def log_message(self, format, *args):
+        return
+
+    # Unix socket clients have no address, which BaseHTTPRequestHandler expects to log
+    def address_string(self):
+        return str(self.client_address) if self.client_address else 'unix socket'
+
+
+class ClassificationHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class ClassificationUnixServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+# makes the server on localhost:<port>, or on the Unix socket <socket_path> if given, with a pool of <workers> processes whose parsers are already built.
+# The server is returned unstarted; serve_forever() runs it, and shutdown_service() stops it and its workers
+def make_service(port=PORT, socket_path=None, workers=WORKERS):
+    if workers < 1: raise ValueError('the worker count must be at least 1')
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ClassificationUnixServer(socket_path, ClassificationRequestHandler)
+    else:
+        server = ClassificationHTTPServer(('127.0.0.1', port), ClassificationRequestHandler)
+    server.pool = ProcessPoolExecutor(workers, initializer=warm_parsers)
+    # building the parsers in every worker now instead of on the first requests
+    [future.result() for future in [server.pool.submit(time.sleep, 0.1) for _ in range(workers)]]
+    server.workers = workers
+    server.metrics = ServiceMetrics()
+    server.socket_path = socket_path
+    return server
+
+
+def shutdown_service(server):
+    server.shutdown()
+    server.server_close()
+    server.pool.shutdown()
+    if server.socket_path is not None and os.path.exists(server.socket_path):
+        os.remove(server.socket_path)
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='VectorSubparserService',
+                                    description='Runs the vector subparser as a local service that classifies counts files sent to it, keeping its parsers built between requests')
+    parser.add_argument('-port', type=int, default=PORT,
+                        help=f'the localhost port to listen on. The default is {PORT}')
+    parser.add_argument('-socket', type=str, default=None,
+                        help='listen on this Unix socket path instead of a localhost port')
+    parser.add_argument('-workers', type=int, default=WORKERS,
+                        help=f'the number of processes classifying requests, and so the number of requests run at once. The default is {WORKERS}')
+    return parser
+
+
+def main():
+    arguments = GetArguments().parse_args()
+    server = make_service(arguments.port, arguments.socket, arguments.workers)
+    print(f'listening on {arguments.socket if arguments.socket else f"http://127.0.0.1:{arguments.port}"} with {arguments.workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        if arguments.socket is not None and os.path.exists(arguments.socket):
+            os.remove(arguments.socket)
+
+if __name__ == '__main__':
+    main()
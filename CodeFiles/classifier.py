@@ -0,0 +1,159 @@
+from parse_file import *
+from contextlib import contextmanager
+import threading
+
+
+# Python API for classifying a counts file, or any iterable of its lines, in memory, e.g. from a notebook:
+#     result = classify('bc1020.tile.zmw.counts', payload_size=1872, group_categories='five')
+#     result.summary_frame()  # one row per category, as in the *.subparsed.tsv file
+#     result.pattern_frame()  # one row per tile pattern
+# Nothing is written unless result.write() is called. The settings that parse_file.py keeps in class variables are only changed
+# while classifying and writing, so results with different payload sizes can be made and kept side by side
+
+# held while the class variables are changed, so classify calls from different threads, e.g. those of a threaded server, run one at a time
+# rather than with each other's settings. Reentrant so classify can be called inside classification_settings
+SETTINGS_LOCK = threading.RLock()
+
+
+# sets the class variables used during classification and restores them afterwards. Tile.symbol_usage is set by the first +/- tile read, so it starts as given.
+# Tile lines keep the payload size and coordinate buffer they're made with, so their tiles made later, e.g. by pattern_frame, don't use the restored ones
+@contextmanager
+def classification_settings(payload_size, coordinate_buffer=6, require_full_payloads=True, symbol_usage=False, top_k=None):
+    check_options(coordinate_buffer, top_k)
+    with SETTINGS_LOCK:
+        saved_settings = (Tile.expected_payload_size, Tile.coordinate_buffer, Tile.symbol_usage, VectorSubParser.expected_species_have_only_full_payloads, TileLineBin.top_k)
+        Tile.expected_payload_size = payload_size
+        Tile.coordinate_buffer = coordinate_buffer
+        Tile.symbol_usage = symbol_usage
+        VectorSubParser.expected_species_have_only_full_payloads = require_full_payloads
+        TileLineBin.top_k = top_k
+        try:
+            yield
+        finally:
+            Tile.expected_payload_size, Tile.coordinate_buffer, Tile.symbol_usage, VectorSubParser.expected_species_have_only_full_payloads, TileLineBin.top_k = saved_settings
+
+
+# the classified and binned tile patterns of one sample, with the settings they were classified with (as in parse_file.get_aggregate_settings)
+# and whether its tiles had +/- orientations
+class ClassificationResult:
+    def __init__(self, file_parser, sample_name, settings, symbol_usage=False):
+        self.file_parser = file_parser
+        self.sample_name = sample_name
+        self.settings = settings
+        self.symbol_usage = symbol_usage
+        self.counters = file_parser.get_counters()
+
+    def get_summaries(self):
+        return self.file_parser.get_bin_summaries()
+
+    def summary_frame(self):
+        return pd.DataFrame(self.get_summaries(), columns=['category', 'sequences', 'proportion', 'patterns', 'full_proportion'])
+
+    # the columns of each category's tile pattern rows in the *.subparsed.tsv file, with the tile pattern as it was in the input.
+    # With top_k, each category's tile patterns not kept are one row, as in the *.subparsed.tsv file, so that the counts still add up to the summary's
+    def pattern_frame(self):
+        rows = []
+        for bin in self.file_parser.bins_list:
+            for tileline in bin:
+                rows.append((tileline.category, tileline.count, tileline.repeat_count, tileline.proportion, tileline.linear_status, tileline.irregular_itrs,
+                             tileline.contains_polymer, tileline.contains_full_payload, tileline.tokenized, tileline.tile_pattern))
+            if bin.tail_tileline_count:
+                rows.append((bin.name, bin.tail_sequence_count, None, bin.tail_sequence_count / bin.sequence_count, None, None, None, None, None,
+                             f'remaining {bin.tail_pattern_count} patterns'))
+        return pd.DataFrame(rows, columns=['category', 'count', 'repeat_count', 'category_proportion', 'linearity', 'irregular_itrs', 'contains_polymer',
+                                           'contains_full_payload', 'tokenized', 'tile_pattern'])
+
+    # the tile patterns and sequences with each noncanonical tile name, whether or not they were classified
+    def noncanonical_frame(self):
+        return pd.DataFrame(self.file_parser.get_noncanonical_summaries(), columns=['tile_name', 'patterns', 'sequences', 'proportion'])
+
+    # the result as a serializable partial aggregate that can be merged with those of other cells or shards of the same library by merge_aggregates
+    def to_aggregate(self):
+        return self.file_parser.to_aggregate([self.sample_name], self.settings)
+
+    # writes the same files parse_file.py does to <output_directory>/<sample_name>/ and returns the path of the *.subparsed.tsv file
+    def write(self, output_directory, bin_to_counts_files=True, plot=True):
+        output_path = os.path.join(output_directory, self.sample_name)
+        os.makedirs(output_path, exist_ok=True)
+        output_file = os.path.join(output_path, self.sample_name + '.subparsed.tsv')
+        with classification_settings(self.settings['payload_size'], self.settings['coordinate_buffer'], self.settings['require_full_payloads'], self.symbol_usage):
+            self.file_parser.write_to_file(output_file)
+            self.file_parser.write_noncanonical(os.path.join(output_path, self.sample_name + '.noncanonical.tsv'))
+            if bin_to_counts_files:
+                bins_output_path = os.path.join(output_path, 'categories')
+                os.makedirs(bins_output_path, exist_ok=True)
+                for bin in self.file_parser.bins_list:
+                    self.file_parser.write_bin(os.path.join(bins_output_path, f'{self.sample_name}.{bin.name}.tile.zmw.counts'), bin)
+        if plot:
+            GraphWriter(output_file)
+            plt.close('all')
+        return output_file
+
+
+# a FileParser with the tile lines of a counts file path, or an iterable of counts file lines, classified by parser but not binned,
+# or with bin_while_reading, binned as they're read with their categories grouped by category_groups (see FileParser). Run inside classification_settings
+def read_tile_lines(path_or_lines, parser, noncanonical_analysis=False, untileable_sequences=False, raise_error_on_low_fulls=False, bin_while_reading=False,
+                    category_groups=None):
+    is_path = isinstance(path_or_lines, (str, os.PathLike))
+    file_parser = FileParser('', raise_error_on_low_fulls=raise_error_on_low_fulls, parser=parser, noncanonical_analysis=noncanonical_analysis,
+                             bin_while_reading=bin_while_reading, category_groups=category_groups)
+    if is_path:
+        with open_input(path_or_lines) as f:
+            file_parser.process_lines(f)
+    else:
+        file_parser.process_lines(path_or_lines)
+    if len(file_parser.unbinned_tilelines) == 0 and len(file_parser.bins_list) == 0:
+        raise ValueError(f'no valid vector tile patterns were found in {path_or_lines if is_path else "the given lines"}; make sure that it is a valid vector counts file')
+    if untileable_sequences:
+        add_untileable_sequence_bin(file_parser, path_or_lines)
+    return file_parser
+
+
+# checks that a counts file path exists, or that untileable_sequences isn't asked for with lines, and returns the sample name if it wasn't given.
+# Standard input (-) and named pipes are read as they're written, and need a sample name
+def check_input(path_or_lines, untileable_sequences=False, sample_name=None):
+    is_path = isinstance(path_or_lines, (str, os.PathLike))
+    if is_path and is_stream_input(path_or_lines):
+        if sample_name is None:
+            raise ValueError('a sample name is required to read standard input or a named pipe')
+    elif is_path and not os.path.isfile(path_or_lines):
+        raise FileNotFoundError(f'{path_or_lines} does not exist')
+    if untileable_sequences and not is_path:
+        raise ValueError('untileable_sequences requires a counts file path, since the count is read from its summary file')
+    if sample_name is None:
+        sample_name = os.path.basename(path_or_lines).split('.')[0] if is_path else 'sample'
+    return sample_name
+
+
+# classifies a counts file path, or an iterable of counts file lines (which is read one line at a time), with the same options as parse_file.py.
+# With top_k, only the top_k tile patterns of each category are kept, see TileLineBin.top_k, and tile patterns are binned as they're read so the rest aren't kept in memory
+# noncanonical_rules is a NoncanonicalRules object, by default the rules in NONCANONICAL_RULES_FILE.
+# An existing VectorSubParser can be given as parser to reuse its parse cache, in which case parse_homopolymers and noncanonical_rules are its own settings
+def classify(path_or_lines, payload_size, coordinate_buffer=6, group_categories=None, require_full_payloads=True, noncanonical_analysis=False,
+             parse_homopolymers=False, untileable_sequences=False, raise_error_on_low_fulls=False, sample_name=None, noncanonical_rules=None, top_k=None, parser=None):
+    sample_name = check_input(path_or_lines, untileable_sequences, sample_name)
+    with classification_settings(payload_size, coordinate_buffer, require_full_payloads, top_k=top_k):
+        if parser is None:
+            parser = VectorSubParser(VectorLexer(noncanonical_rules), require_full_payloads_in_expected=require_full_payloads, parse_homopolymers=parse_homopolymers)
+        category_groups = get_category_groups(group_categories)
+        file_parser = read_tile_lines(path_or_lines, parser, noncanonical_analysis, untileable_sequences, raise_error_on_low_fulls, bin_while_reading=top_k is not None,
+                                      category_groups=category_groups)
+        # with top_k, only the untileable sequences tileline is left to group
+        if category_groups and file_parser.unbinned_tilelines:
+            file_parser.group_categories(category_groups)
+        file_parser.bin_tilelines()
+        symbol_usage = Tile.symbol_usage
+    settings = {'payload_size': payload_size, 'coordinate_buffer': coordinate_buffer, 'group_categories': group_categories, 'require_full_payloads': require_full_payloads,
+                'noncanonical_analysis': noncanonical_analysis, 'parse_homopolymers': parser.parse_homopolymers, 'untileable_sequences': untileable_sequences}
+    return ClassificationResult(file_parser, sample_name, settings, symbol_usage)
+
+
+# makes a ClassificationResult from an aggregate, e.g. one merged from several SMRT cells by merge_aggregates, without classifying anything again
+def get_aggregate_result(aggregate, sample_name, raise_error_on_low_fulls=False):
+    settings = aggregate['settings']
+    with classification_settings(settings['payload_size'], settings['coordinate_buffer'], settings['require_full_payloads']):
+        file_parser = FileParser.from_aggregate(aggregate, raise_error_on_low_fulls=raise_error_on_low_fulls)
+        symbol_usage = Tile.symbol_usage
+    result = ClassificationResult(file_parser, sample_name, settings, symbol_usage)
+    result.counters = aggregate['counters']
+    return result
@@ -0,0 +1,34 @@
+from classifier import *
+
+
+# Combines the *.aggregate.json files that parse_file.py writes with -aggregate, e.g. one for each SMRT cell a library was sequenced on,
+# into one sample without classifying any tile patterns again. The merged aggregate is written along with the same output files parse_file.py writes,
+# with proportions calculated from the merged counts
+
+
+def merge_aggregate_files(input_files, output_directory, sample_name, bin_to_counts_files=True, plot=True):
+    aggregate = merge_aggregates([read_aggregate(input_file) for input_file in input_files])
+    result = get_aggregate_result(aggregate, sample_name)
+    output_file = result.write(output_directory, bin_to_counts_files=bin_to_counts_files, plot=plot)
+    write_aggregate(aggregate, os.path.join(os.path.dirname(output_file), sample_name + '.aggregate.json'))
+    return output_file
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='VectorSubparserMerge',
+                                    description='Merges the *.aggregate.json files of the same library written by parse_file.py -aggregate, and writes the outputs of the merged sample')
+    parser.add_argument('-input_files', required=True, type=str, nargs='+',
+                        help='the *.aggregate.json files to merge. They must have been classified with the same settings')
+    parser.add_argument('-output_directory', required=True, type=str,
+                        help='the directory to place the output files in')
+    parser.add_argument('-sample_name', required=True, type=str,
+                        help='the name of the merged sample, used for its output directory and file names')
+    parser.add_argument('-bin_to_counts_files', default=True, action='store_false',
+                        help='these are all output by default. If this flag is raised, no counts files will be generated')
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = GetArguments().parse_args()
+    output_file = merge_aggregate_files(arguments.input_files, arguments.output_directory, arguments.sample_name, bin_to_counts_files=arguments.bin_to_counts_files)
+    print(f'merged {len(arguments.input_files)} aggregates into {output_file}')
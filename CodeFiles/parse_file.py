@@ -1,7 +1,15 @@
 from vector_subparser import *
 from tile_classes import *
+from stage_timer import *
 import argparse
+import cProfile
+import json
 import os
+import re
+import stat
+import sys
+import tracemalloc
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -9,44 +17,116 @@ import seaborn as sns
 
 VG_TILES = ['Payload', 'ITR-FLIP', 'poly'] # tiles considered canonical
 NONCANON_ANALYSIS = False # whether or not to do subparsing on noncanonical tiles, i.e. tiles with names not in the VG_TILES list
+# the version of the aggregates written by -aggregate; aggregates of other versions can't be merged
+AGGREGATE_VERSION = 2
+# the categories counted as full species by check_for_low_fulls, and the lowest proportion of sequences they can have
+FULL_CATEGORIES = ['full', 'expected_selfprime', 'expected']
+FULL_SPECIES_THRESHOLD = 0.5
+# the write buffer size of each category counts file written by CategoryWriters
+CATEGORY_WRITE_BUFFER_SIZE = 1 << 20
+# the end coordinate of a payload tile, in a counts file tile pattern or a .feats file feature
+PAYLOAD_END_REGEX = re.compile(r'Payload[^\[\s]*\[\d+-(\d+)\]')
+# -infer_payload_size warns when fewer payload tiles than this end within the coordinate buffer of the inferred payload size
+PAYLOAD_SIZE_CONFIDENCE_WARNING = 0.5
 
 
 class FileParser:
     # processes the file, and stores the resulting data as a single list of all the tilelines objects.
     # These are stored as a list so that the categories can be modified using the modify_categories function prior to 
     # storing the TileLine objects into Bin objects, which are made with names based on those categories
-    def __init__(self, input_file, require_full_payloads_in_expected=True, raise_error_on_low_fulls=False, debug=False, parse_homopolymers=False):
-        self.parser = VectorSubParser(VectorLexer(), require_full_payloads_in_expected=require_full_payloads_in_expected, debug=debug, parse_homopolymers=parse_homopolymers)
+    # An existing VectorSubParser can be passed in as parser to reuse its parse cache, in which case its own settings are used instead of
+    # require_full_payloads_in_expected, debug, parse_homopolymers, tracer and noncanonical_rules. noncanonical_analysis defaults to the module's NONCANON_ANALYSIS
+    # If category_writers (a CategoryWriters object) is given, each line is written to its category's counts file as soon as it's classified,
+    # after which the tileline's raw_data is dropped to save memory unless keep_raw_data is True
+    # With a memory_budget, or with bin_while_reading, tilelines are binned as soon as they're classified instead of being kept in unbinned_tilelines, with their
+    # categories grouped by category_groups rather than group_categories. Each bin then keeps at most memory_budget of them in memory (see TileLineBin.spill),
+    # or with TileLineBin.top_k, only its top_k
+    # If low_fulls_gate (a LowFullsGate object) is given, it's checked after every line, so a sample that can't have enough full species stops early
+    # With collapse_patterns, tilelines are collapsed into equivalence classes (see get_collapse_key) as they're read, and one tileline of each class
+    # is classified once every line has been read, so low_fulls_gate can't stop it early
+    def __init__(self, input_file, require_full_payloads_in_expected=True, raise_error_on_low_fulls=False, debug=False, parse_homopolymers=False, tracer=None, parser=None,
+                 noncanonical_analysis=None, noncanonical_rules=None, category_writers=None, keep_raw_data=True, memory_budget=None, category_groups=None,
+                 low_fulls_gate=None, collapse_patterns=False, bin_while_reading=False):
+        check_options(top_k=TileLineBin.top_k, memory_budget=memory_budget, low_fulls_gate=low_fulls_gate, collapse_patterns=collapse_patterns,
+                      stream_input=is_stream_input(input_file) if input_file else False)
+        if parser is None:
+            parser = VectorSubParser(VectorLexer(noncanonical_rules), require_full_payloads_in_expected=require_full_payloads_in_expected, debug=debug, parse_homopolymers=parse_homopolymers, 
+                                     tracer=tracer)
+        self.parser = parser
         self.bins_list = list()
         self.unbinned_tilelines = list()
         self.raise_error_on_low_fulls = raise_error_on_low_fulls
-        if not os.path.isfile(input_file): 
+        self.noncanonical_analysis = NONCANON_ANALYSIS if noncanonical_analysis is None else noncanonical_analysis
+        self.category_writers = category_writers
+        self.keep_raw_data = keep_raw_data
+        self.memory_budget = memory_budget
+        self.bin_while_reading = bin_while_reading or memory_budget is not None
+        self.category_groups = category_groups
+        # with a memory budget, the order the last tileline of each category was binned in, see add_to_bin
+        self.binned_tileline_count = 0
+        self.last_binned = dict()
+        self.low_fulls_gate = low_fulls_gate
+        self.collapse_patterns = collapse_patterns
+        # the first tileline, summed count and summed input proportion of each equivalence class, by its key
+        self.pattern_classes = dict()
+        self.collapsed_count = 0
+        # counters reported by the -profile option
+        self.line_kind_counts = {'normal': 0, 'U': 0, 'x 2': 0}
+        self.noncanonical_count = 0
+        # noncanonical accounting, made whether or not noncanonical tile patterns are skipped: the sequence count of every tile pattern,
+        # and the tile patterns and sequences with each noncanonical tile name. A tile pattern with two noncanonical tile names is counted for both
+        self.input_sequence_count = 0
+        self.noncanonical_pattern_count = 0
+        self.noncanonical_sequence_count = 0
+        self.noncanonical_tile_counts = dict()
+        if not os.path.isfile(input_file) and not is_stream_input(input_file):
             return
-        with open(input_file, 'r') as f:
-            while True:
-                tile_line = f.readline()
-
-                if not tile_line.strip(): tile_line = f.readline()  # skip blank lines
-                if not tile_line: break  # EOF
-
-                if ' U ' in tile_line and ' x 2' in tile_line:
-                    raise ValueError(f'a tile line ({tile_line}) had an x_2 and U, this should not happen. Recheck tiling.')
-                elif ' U ' in tile_line:
-                    [self.unbinned_tilelines.append(line) for line in self.process_U_line(tile_line) if line is not None]
-                elif ' x 2' in tile_line:
-                    self.unbinned_tilelines.append(self.process_x_2_line(tile_line))
-                else:
-                    self.unbinned_tilelines.append(self.process_line(tile_line))
-                
-                # remove the added tileline if it was None
-                if len(self.unbinned_tilelines) > 0 and self.unbinned_tilelines[len(self.unbinned_tilelines)-1] is None:
-                    del self.unbinned_tilelines[len(self.unbinned_tilelines)-1]
+        with open_input(input_file) as f:
+            self.process_lines(f)
         # raise error if no AAV genome-only tilelines were found in the input file
-        if len(self.unbinned_tilelines) == 0:
+        if len(self.unbinned_tilelines) == 0 and len(self.bins_list) == 0:
             raise ValueError(f'no valid vector tile patterns were found in {input_file}; make sure that it is a valid vector counts file\n non-vector counts files (plasmid, etc.) will raise this error')
+
+    # classifies each line of a counts file, given as any iterable of lines, adding the resulting tilelines with add_tileline
+    def process_lines(self, lines):
+        for tile_line in lines:
+            if not tile_line.strip(): continue  # skip blank lines
+
+            if ' U ' in tile_line and ' x 2' in tile_line:
+                raise ValueError(f'a tile line ({tile_line}) had an x_2 and U, this should not happen. Recheck tiling.')
+            elif ' U ' in tile_line:
+                self.line_kind_counts['U'] += 1
+                [self.add_tileline(line) for line in self.process_U_line(tile_line)]
+            elif ' x 2' in tile_line:
+                self.line_kind_counts['x 2'] += 1
+                self.add_tileline(self.process_x_2_line(tile_line))
+            else:
+                self.line_kind_counts['normal'] += 1
+                self.add_tileline(self.process_line(tile_line))
+            if self.low_fulls_gate is not None:
+                self.low_fulls_gate.check(self.input_sequence_count)
+        if self.pattern_classes:
+            self.classify_pattern_classes()
+
+    # keeps a classified tileline in unbinned_tilelines, or bins it right away if binning while reading. Skipped (None) tilelines aren't added
+    def add_tileline(self, tileline):
+        if tileline is None:
+            return
+        if self.low_fulls_gate is not None:
+            self.low_fulls_gate.add(tileline)
+        if not self.bin_while_reading:
+            self.unbinned_tilelines.append(tileline)
+            return
+        if self.category_groups:
+            tileline.category = self.category_groups.get(tileline.category, 'other')
+        self.add_to_bin(tileline)
     
     # formats U lines to be run as two seperate normal lines by the process_line function
     def process_U_line(self, data):
+        return [self.process_line(line) for line in self.format_U_line(data)]
+
+    # splits a U line into two normal lines, each with half of the count
+    def format_U_line(self, data):
         split_data = data.split(' U ')
         U_left = split_data[0].split()
         U_right = split_data[1].split()
@@ -54,23 +134,99 @@ class FileParser:
         U_left[0] = split_count  # replace original count with split count for left
         U_right.insert(0, split_count)  # insert split count to right
         U_right.insert(1, '0')
-        return [self.process_line(' '.join(U_left)), 
-                self.process_line(' '.join(U_right))]
+        return [' '.join(U_left), ' '.join(U_right)]
 
     # formats x 2 lines to be run by the process_line function
     def process_x_2_line(self, data):
+        return self.process_line(self.format_x_2_line(data))
+
+    def format_x_2_line(self, data):
         i = data.find(' x 2')
-        return self.process_line(data[:i])
+        return data[:i]
 
-    # generates a Tileline object for each line, and categorizes it using a VectorSubParser object
+    # generates a Tileline object for each line, and categorizes it using a VectorSubParser object.
+    # With collapse_patterns it's added to its equivalence class instead, and classified by classify_pattern_classes
     def process_line(self, line):
-        tile_line = TileLine(line)
-        # if noncanonical analysis is disabled skip lines that have any tile that isn't canonical 
-        if not NONCANON_ANALYSIS and any([tile.name.split('_')[0] not in VG_TILES and 'poly' not in tile.name for tile in tile_line]):
-                return
+        tile_line = self.make_tileline(line)
+        if tile_line is None:
+            return
+        if self.collapse_patterns:
+            self.add_to_pattern_class(tile_line)
+            return
+        return self.classify_tileline(tile_line)
+
+    def classify_tileline(self, tile_line):
         self.parser.run(tile_line)  # !! This is where the vector_subparser module is run
+        if self.category_writers is not None:
+            self.category_writers.write(tile_line.category, tile_line.raw_data)
+            if not self.keep_raw_data:
+                tile_line.raw_data = None
         return tile_line
 
+    # the key of a tileline's equivalence class for collapse_patterns: the name, orientation, and coordinates of each tile, bucketed so that tiles in
+    # the same bucket are within Tile.coordinate_buffer of each other, along with whether each payload tile is full and whether there are homopolymer
+    # tiles, which are otherwise left out unless they're parsed. Tilelines with the same key have the same category, repeat count, tokens and flags,
+    # since parsing depends only on tile names, and the coordinate checks only on payload orientations and whether payloads are full
+    def get_collapse_key(self, tileline):
+        bucket_size = Tile.coordinate_buffer + 1
+        key = ['poly' in tileline.tile_pattern]
+        for tile in tileline.get_tiles():
+            if 'poly' in tile.name and not self.parser.parse_homopolymers:
+                continue
+            key.append((tile.name, tile.orientation, tile.coordinate_start // bucket_size, 
+                        tile.coordinate_end // bucket_size if tile.coordinate_end is not None else None, 'Payload' in tile.name and tile.is_full))
+        return tuple(key)
+
+    def add_to_pattern_class(self, tileline):
+        key = self.get_collapse_key(tileline)
+        proportion = float(tileline.raw_data.split()[1])
+        if key in self.pattern_classes:
+            self.pattern_classes[key][1] += tileline.count
+            self.pattern_classes[key][2] += proportion
+            self.collapsed_count += 1
+        else:
+            self.pattern_classes[key] = [tileline, tileline.count, proportion]
+
+    # classifies the first tileline read of each equivalence class, which for tiler output has the highest count, with the summed count of the class
+    def classify_pattern_classes(self):
+        for tileline, count, proportion in self.pattern_classes.values():
+            printed_count = int(count) if count == int(count) else count
+            tileline.raw_data = f'{printed_count} {proportion:.7f} {tileline.tile_pattern}'
+            tileline.count = count
+            self.add_tileline(self.classify_tileline(tileline))
+        self.pattern_classes = dict()
+
+    # generates the Tileline object for a line, or None if it is skipped for being noncanonical.
+    # Tile names are read from the line's text first, so noncanonical lines are counted and skipped without making any Tile objects
+    def make_tileline(self, line):
+        data = line.split()
+        count = float(data[0])
+        self.input_sequence_count += count
+        noncanonical_tile_names = get_noncanonical_tile_names(data[2:])
+        if noncanonical_tile_names:
+            self.add_noncanonical_tile_names(noncanonical_tile_names, count)
+            # if noncanonical analysis is disabled skip lines that have any tile that isn't canonical 
+            if not self.noncanonical_analysis:
+                self.noncanonical_count += 1
+                return
+        return TileLine(line)
+
+    def add_noncanonical_tile_names(self, noncanonical_tile_names, count):
+        self.noncanonical_pattern_count += 1
+        self.noncanonical_sequence_count += count
+        for tile_name in noncanonical_tile_names:
+            tile_counts = self.noncanonical_tile_counts.setdefault(tile_name, [0, 0])
+            tile_counts[0] += 1
+            tile_counts[1] += count
+
+    # the counters of this FileParser and its VectorSubParser, for the -profile report
+    def get_counters(self):
+        return {'lines': dict(self.line_kind_counts), 'noncanonical_tile_patterns_skipped': self.noncanonical_count, 
+                'noncanonical_tile_patterns': self.noncanonical_pattern_count, 'noncanonical_sequences': self.noncanonical_sequence_count, 
+                'tile_patterns_collapsed': self.collapsed_count, 'parser_calls': self.parser.parse_count, 'reversed_parses': self.parser.reversed_parse_count, 
+                'parse_errors': self.parser.error_count, 'parse_cache_hits': self.parser.cache_hit_count, 
+                'repeat_patterns_counted': self.parser.repeat_pattern_count, 'noncanonical_rule_matches': self.parser.noncanonical_rule_count}
+
     def group_categories(self, modification_dictionary):
         if len(self.unbinned_tilelines) == 0:
             raise ValueError('modify_categories must be called before bin_tilelines, otherwise tilelines are already binned')
@@ -83,15 +239,26 @@ class FileParser:
 
     def bin_tilelines(self):
         for i in range(len(self.unbinned_tilelines)-1, -1, -1): # item removal during iteration requires backwards iteration
-            for bin in self.bins_list:
-                if self.unbinned_tilelines[i].category == bin.name:
-                    bin.add_tileline(self.unbinned_tilelines.pop(i))
-                    break
-            else:
-                self.bins_list.append(TileLineBin(self.unbinned_tilelines.pop(i)))
+            self.add_to_bin(self.unbinned_tilelines.pop(i))
+        if self.bin_while_reading:
+            self.bins_list.sort(key=lambda x: self.last_binned[x.name], reverse=True)
         self.sort()
         self.calculate_bin_proportions()
 
+    # adds a tileline to the bin of its category, making the bin if it's the first
+    def add_to_bin(self, tileline):
+        for bin in self.bins_list:
+            if tileline.category == bin.name:
+                bin.add_tileline(tileline)
+                break
+        else:
+            self.bins_list.append(TileLineBin(tileline, self.memory_budget, self.bin_while_reading))
+        # bin_tilelines adds tilelines in reverse input order, making the bins in order of their categories' last tilelines. Binned while reading they're
+        # added in input order, so that order is kept to put them in the same order before sorting, which bins with equal sequence counts stay in
+        if self.bin_while_reading:
+            self.binned_tileline_count += 1
+            self.last_binned[tileline.category] = self.binned_tileline_count
+
     def calculate_bin_proportions(self):
         count_sum = sum([bin.sequence_count for bin in self.bins_list])
         for bin in self.bins_list:
@@ -106,20 +273,22 @@ class FileParser:
         self.bins_list.sort(key=lambda x: x.sequence_count, reverse=True)
 
     def check_for_low_fulls(self):
-        full_categories = ['full', 'expected_selfprime', 'expected']
         all_fulls_proportion = 0
         for bin in self.bins_list:
-            if bin.name in full_categories:
+            if bin.name in FULL_CATEGORIES:
                 all_fulls_proportion += bin.proportion
-        if all_fulls_proportion < 0.5:
+        if all_fulls_proportion < FULL_SPECIES_THRESHOLD:
             raise ValueError('\n The amount of full sequences (within the full bin by default; within expected_selfprime and expected bins with "-m all") is below 50%. \
-                              \n Double-check that the expected payload size is correct, or silence this error by running this command with the "-silence_raise_error_on_low_fulls" flag')
+                              \n Double-check that the expected payload size is correct (payload_sweep.py compares several payload sizes without parsing the input again), \
+                              or silence this error by running this command with the "-silence_raise_error_on_low_fulls" flag')
 
     def write_to_file(self, output_file):
         with open(output_file, 'w') as f:
-            f.write(str(self))
+            for output_string in self.get_output_strings():
+                f.write(output_string)
 
-    def __str__(self):
+    # the text of the output file in pieces, so that bins with spilled runs (see TileLineBin.spill) are written without being made into one string
+    def get_output_strings(self):
         r_string = ''
         # write summary data, similar to the format of Serena's Vector_Subclassification script
         r_string += 'Bin\tSequences\tProportion\tPatterns\tPercent Full\n'
@@ -127,13 +296,61 @@ class FileParser:
             r_string += f'{bin.name}\t{bin.sequence_count}\t{bin.proportion}\t{bin.pattern_count}\t{bin.full_proportion * 100}%\n'
         # write totals
         r_string += f'Totals\t{sum([bin.sequence_count for bin in self.bins_list])}\t{sum([bin.proportion for bin in self.bins_list])}\t{sum([bin.pattern_count for bin in self.bins_list])}\n\n\n'
+        yield r_string
         # write data content
-        r_string += '\n\n\n'.join([str(bin) for bin in self.bins_list])
-        return r_string
+        for i, bin in enumerate(self.bins_list):
+            if i > 0:
+                yield '\n\n\n'
+            for j, line in enumerate(bin.get_output_lines()):
+                yield line if j == 0 else '\n' + line
+
+    def __str__(self):
+        return ''.join(self.get_output_strings())
     
+    # the summary rows of the output file (one per bin) as a list of dictionaries
+    def get_bin_summaries(self):
+        return [{'category': bin.name, 'sequences': bin.sequence_count, 'proportion': bin.proportion, 'patterns': bin.pattern_count, 
+                 'full_proportion': bin.full_proportion} for bin in self.bins_list]
+
+    # the noncanonical tile names, most sequences first, with the tile patterns and sequences containing them and the proportion of all input sequences those are
+    def get_noncanonical_summaries(self):
+        tile_counts = sorted(self.noncanonical_tile_counts.items(), key=lambda x: x[1][1], reverse=True)
+        return [{'tile_name': tile_name, 'patterns': patterns, 'sequences': sequences, 
+                 'proportion': sequences / self.input_sequence_count if self.input_sequence_count else 0} for tile_name, (patterns, sequences) in tile_counts]
+
+    # writes the noncanonical tile names followed by the totals, where each tile pattern is counted once
+    def write_noncanonical(self, output_file):
+        with open(output_file, 'w') as f:
+            f.write('Tile Name\tTile Patterns\tSequences\tProportion of Input Sequences\n')
+            for summary in self.get_noncanonical_summaries():
+                f.write(f'{summary["tile_name"]}\t{summary["patterns"]}\t{summary["sequences"]}\t{summary["proportion"]}\n')
+            total_proportion = self.noncanonical_sequence_count / self.input_sequence_count if self.input_sequence_count else 0
+            f.write(f'Totals\t{self.noncanonical_pattern_count}\t{self.noncanonical_sequence_count}\t{total_proportion}\n')
+
+    # the binned results as a serializable partial aggregate (see merge_aggregates), along with the samples and settings they came from
+    def to_aggregate(self, samples, settings):
+        return {'aggregate_version': AGGREGATE_VERSION, 'samples': list(samples), 'settings': dict(settings), 'counters': self.get_counters(),
+                'noncanonical': {'input_sequences': self.input_sequence_count, 'patterns': self.noncanonical_pattern_count, 
+                                 'sequences': self.noncanonical_sequence_count, 'tiles': {tile_name: list(tile_counts) for tile_name, tile_counts in self.noncanonical_tile_counts.items()}},
+                'bins': {bin.name: bin.to_aggregate() for bin in self.bins_list}}
+
+    # makes a FileParser with the bins of an aggregate, with proportions calculated for the aggregate's totals. Nothing is classified again
+    def from_aggregate(aggregate, raise_error_on_low_fulls=False):
+        file_parser = FileParser('', raise_error_on_low_fulls=raise_error_on_low_fulls)
+        noncanonical = aggregate['noncanonical']
+        file_parser.input_sequence_count = noncanonical['input_sequences']
+        file_parser.noncanonical_pattern_count = noncanonical['patterns']
+        file_parser.noncanonical_sequence_count = noncanonical['sequences']
+        file_parser.noncanonical_tile_counts = {tile_name: list(tile_counts) for tile_name, tile_counts in noncanonical['tiles'].items()}
+        total_sequences = sum([bin_aggregate['sequences'] for bin_aggregate in aggregate['bins'].values()])
+        file_parser.bins_list = [TileLineBin.from_aggregate(name, bin_aggregate, total_sequences) for name, bin_aggregate in sorted(aggregate['bins'].items())]
+        file_parser.sort()
+        file_parser.calculate_bin_proportions()
+        return file_parser
+
     def write_bin(self, output_file, bin_to_write):
         with open(output_file, 'w') as f:
-            for line in bin_to_write.tile_line_list:
+            for line in bin_to_write:
                 f.write(f'{line.raw_data}\n')
 
 
@@ -143,11 +360,18 @@ def GetArguments():
                                     epilog='contact d.rouleau@oxb.com for more help')
     # Required Arguments
     parser.add_argument('-input_file', required=True, type=str,
-                        help='the tile.counts file(s) to be run. These are run individually since the expected payload sizes often vary from file to file')
+                        help='the tile.counts file(s) to be run. These are run individually since the expected payload sizes often vary from file to file. \
+                            Use - to read standard input, or give a named pipe (FIFO), to classify lines as the tiler writes them; -sample_name is then required')
+    parser.add_argument('-sample_name', type=str, default=None,
+                        help='the name of the output directory and files. The default is the input file name without its extensions. With standard input or \
+                            a named pipe, -untileable_sequences looks for the summary file with this root filename next to the pipe, or in the working directory for -')
     parser.add_argument('-output_directory', required=True, type=str,
                         help='the directory to place the output files in')
-    parser.add_argument('-payload_size', required=True, type=int,
-                        help='the expected size of the payload in the run')
+    parser.add_argument('-payload_size', type=int, default=None,
+                        help='the expected size of the payload in the run. Required unless -infer_payload_size is used')
+    parser.add_argument('-infer_payload_size', default=False, action='store_true',
+                        help="infer the payload size from the most common end coordinate of the payload tiles, read from the tiler's .feats file with the same root filename \
+                            if there is one and otherwise from the input file, and report how many payload tiles end within the coordinate buffer of it before classifying")
     # Optional Arguments
     parser.add_argument('-group_categories', choices=['five', 'six', 'two'], default=None,
                         help='''Optionally group the vector subparser's 17 initial categories.
@@ -165,7 +389,9 @@ def GetArguments():
                         help='these are all output by default. If this flag is raised, no counts files will be generated\n \
                         Using the "modification_dictionary argument will change bin names, so the output here is changed by the -group_categories flag option\n \
                         IMPORTANT: the proportions displayed in the output file for each tile pattern are taken directly from the input file, they are NOT \
-                        the recalculated proportions displayed in the *.subparsed.tsv file')
+                        the recalculated proportions displayed in the *.subparsed.tsv file\n \
+                        Lines are written as they are classified and each file is sorted from highest to lowest count when it is finished, as in the \
+                        *.subparsed.tsv file. With -memory_budget the files are not sorted, so their lines are in input order')
     parser.add_argument('-dont_require_full_payloads', default=True, action='store_false',
                         help='flag to determine whether or not only tile patterns with payloads size +/- the coordinate buffer\n \
                         should be included in the expected and expected self priming sub bins (the full bin using default categories) \
@@ -174,18 +400,208 @@ def GetArguments():
                         help='modify the range coordinates must be relative to the expected payload size when considered as "full". The default is 6')
     parser.add_argument('-raise_error_on_low_fulls', default=False, action='store_true',
                         help='use this flag to raise an error when the proportion of sequences within full species\n bins (full, or expected and expected_selfprime depending on output categories option) is below 0.5')
+    parser.add_argument('-collapse_patterns', default=False, action='store_true',
+                         help='before classifying, collapse tile patterns that differ only by coordinates within the coordinate buffer of each other, or only in ignored \
+                            homopolymer tiles, into one row with their summed count, classified once. Categories and full payload proportions are unchanged; \
+                            each row shows the first (highest count) tile pattern collapsed into it')
+    parser.add_argument('-low_fulls_gate', choices=['abort', 'warn'], default=None,
+                         help='while classifying, bound the proportion of sequences in full species categories using the number of tiled sequences in the summary file \
+                            with the same root filename, and stop with an error (abort) or print a warning (warn) as soon as it can no longer reach 0.5')
     parser.add_argument('-untileable_sequences', default=False, action='store_true',
                          help='if this flag is raised, then untileable sequences will be included in the output calculations and graphs. \
                             the count of untileable sequences will be sourced from the summary file with the same root filename.')
-    parser.add_argument('-noncanonical_analysis', default=False, action='store_true',
-                         help='if this flag is raised, noncanonical tiles will be considered by the subparser. This is to enable extending of the subparser grammar. As of now, all tile patterns with tiles outside of polyX, ITR or Payload will be classified as other')
+    parser.add_argument('-noncanonical_analysis', '-n', default=False, action='store_true',
+                         help='if this flag is raised, noncanonical tiles will be considered by the subparser. This is to enable extending of the subparser grammar. As of now, all tile patterns with tiles outside of polyX, ITR or Payload will be classified as other. \
+                            Either way, the tile patterns and sequences with each noncanonical tile name are counted in a *.noncanonical.tsv file next to the *.subparsed.tsv file')
+    parser.add_argument('-noncanonical_rules', type=str, default=NONCANONICAL_RULES_FILE,
+                         help=f'with -noncanonical_analysis, the JSON file of rules classifying tile patterns by the noncanonical tiles in them (see the README). The default is {os.path.basename(NONCANONICAL_RULES_FILE)}, which classifies RepCap-containing tile patterns')
+    parser.add_argument('-parse_cache', type=str, default=None,
+                         help='a JSON file of classified tile patterns to start with, e.g. written by quick_qc.py, if it exists. The tile patterns classified by this run are \
+                            written back to it. It must have been made with the same -noncanonical_rules and --parse_homopolymers settings')
     parser.add_argument('-debug', default=False, action='store_true',
                          help='if this flag is raised, detailed debug information will be printed to stdout by the vector_subparser module. Additionally, a parser.out file giving CFG information will be placed in the directory of the vector_subparser.py file')
     parser.add_argument('--parse_homopolymers', default=False, action='store_true',
                          help='if this flag is raised, homopolymer tiles will NOT be ignored completely by the subparser. The default is to ignore them')
+    parser.add_argument('-trace', default=False, action='store_true',
+                         help='if this flag is raised, the parse derivations of selected tile patterns are written to a *.trace.txt file next to the *.subparsed.tsv file. \
+                            Unlike -debug, nothing is printed and unselected tile patterns are parsed at full speed, so it can be used on full size inputs')
+    parser.add_argument('-trace_sample_rate', type=float, default=1.0,
+                         help='with -trace, the proportion of tile patterns to trace. The default is 1 (every tile pattern)')
+    parser.add_argument('-trace_categories', type=str, nargs='+', default=None,
+                         help='with -trace, only keep traces of tile patterns classified into these categories (before grouping), e.g. other')
+    parser.add_argument('-trace_pattern', type=str, default=None,
+                         help='with -trace, only trace tile patterns matching this regular expression')
+    parser.add_argument('-trace_max', type=int, default=1000,
+                         help='with -trace, the number of traces kept; only the most recent ones are written. The default is 1000')
+    parser.add_argument('-top_k', type=int, default=None,
+                         help='only keep the K tile patterns with the highest counts in each category, followed by one row totalling the remaining patterns. \
+                            Tile patterns are binned as they are classified, so only K of each category are kept in memory. \
+                            Category totals and proportions are still calculated from every tile pattern, and the category counts files still have every tile pattern')
+    parser.add_argument('-memory_budget', type=int, default=None,
+                         help='the most tile patterns each category keeps in memory. Tile patterns are binned as they are classified, and once a category has more \
+                            than this many they are sorted and spilled to a temporary run file (in $TMPDIR), which are merged back in order when the output is written. \
+                            Totals and proportions are exact. For very large or diverse inputs, e.g. with -noncanonical_analysis')
+    parser.add_argument('-aggregate', default=False, action='store_true',
+                         help='if this flag is raised, the classified tile patterns are also written to a *.aggregate.json file next to the *.subparsed.tsv file. \
+                            Aggregates of the same library (e.g. from several SMRT cells) can be combined without classifying them again by merge_aggregates.py')
+    parser.add_argument('-profile', '--profile', default=False, action='store_true',
+                         help='if this flag is raised, the wall time and peak memory of each stage and counts of the lines, parses and parse cache hits are written to a *.profile.json file next to the *.subparsed.tsv file')
+    parser.add_argument('-profile_dump', choices=['cprofile', 'tracemalloc'], default=None,
+                         help='with -profile, also profile the classification of the tile patterns (reading the input file and parsing) with cProfile, written to a *.classify.prof file, \
+                            or trace its memory allocations with tracemalloc, written to a *.classify.tracemalloc.txt file')
     return parser
 
 
+# Writes the lines of each category to <sample_name>.<category>.tile.zmw.counts in output_directory as they're classified, through one buffered file
+# per category opened when its first line is written. With category_groups, categories are renamed as FileParser.group_categories does so the files
+# match the grouped bins. Lines are written in the order they were classified in; with sort_lines, each file is sorted when it's closed into the order
+# FileParser.write_bin writes its bin in, highest count first with ties the last read first, which needs the lines of the largest category in memory
+class CategoryWriters:
+    def __init__(self, output_directory, sample_name, category_groups=None, buffer_size=CATEGORY_WRITE_BUFFER_SIZE, sort_lines=True):
+        self.output_directory = output_directory
+        self.sample_name = sample_name
+        self.category_groups = category_groups
+        self.buffer_size = buffer_size
+        self.sort_lines = sort_lines
+        self.files = dict()
+
+    def write(self, category, line):
+        if self.category_groups:
+            category = self.category_groups.get(category, 'other')
+        if category not in self.files:
+            self.files[category] = open(os.path.join(self.output_directory, f'{self.sample_name}.{category}.tile.zmw.counts'), 'w', buffering=self.buffer_size)
+        self.files[category].write(f'{line}\n')
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+            if self.sort_lines:
+                CategoryWriters.sort_file(f.name)
+        self.files = dict()
+
+    # closes and removes every file written, e.g. when classification stops early, so that partly written files aren't mistaken for outputs
+    def remove(self):
+        for f in self.files.values():
+            f.close()
+            os.remove(f.name)
+        self.files = dict()
+
+    # sorts a counts file by count, highest first. Lines are reversed first so that the sort, which is stable, puts tied lines in the reverse of their order
+    def sort_file(counts_file):
+        with open(counts_file, 'r') as f:
+            lines = f.readlines()[::-1]
+        lines.sort(key=lambda line: float(line.split(maxsplit=1)[0]), reverse=True)
+        with open(counts_file, 'w') as f:
+            f.writelines(lines)
+
+
+# Bounds the proportion of sequences in full species categories that check_for_low_fulls will find, while the input is being classified.
+# The tiler's .summary file gives the number of tiled sequences, which the sequences of the counts file can't add up to more than, so the sequences
+# not read yet are at most that less those read so far. The final proportion is then between none and all of them being full species, and once
+# even all of them can't bring it to FULL_SPECIES_THRESHOLD, check raises a ValueError, or with abort=False prints a warning once and carries on.
+# Counts files are sorted from highest to lowest count, so most sequences are read, and the bounds close in, within the first lines.
+# Sequences skipped as noncanonical don't count towards the proportion; untileable sequences, when they're binned, count as not full
+class LowFullsGate:
+    def __init__(self, tiled_sequences, category_groups=None, untileable_sequences=0, abort=True):
+        self.tiled_sequences = tiled_sequences
+        self.category_groups = category_groups
+        self.abort = abort
+        self.full_sequences = 0
+        self.classified_sequences = untileable_sequences
+        self.flagged = False
+
+    def add(self, tileline):
+        category = self.category_groups.get(tileline.category, 'other') if self.category_groups else tileline.category
+        self.classified_sequences += tileline.count
+        if category in FULL_CATEGORIES:
+            self.full_sequences += tileline.count
+
+    # the lowest and highest proportion of full species possible after read_sequences of the counts file (FileParser.input_sequence_count)
+    def get_bounds(self, read_sequences):
+        remaining_sequences = max(0, self.tiled_sequences - read_sequences)
+        if self.classified_sequences + remaining_sequences == 0:
+            return 0, 1
+        return self.full_sequences / (self.classified_sequences + remaining_sequences), \
+               (self.full_sequences + remaining_sequences) / (self.classified_sequences + remaining_sequences)
+
+    def check(self, read_sequences):
+        if self.flagged:
+            return
+        highest_proportion = self.get_bounds(read_sequences)[1]
+        if highest_proportion >= FULL_SPECIES_THRESHOLD:
+            return
+        message = f'after {read_sequences:.0f} of at most {self.tiled_sequences:.0f} sequences, at most {highest_proportion:.2%} of sequences can be in the full species categories \
+({", ".join(FULL_CATEGORIES)}), below {FULL_SPECIES_THRESHOLD:.0%}. Double-check that the expected payload size is correct (see payload_sweep.py)'
+        if self.abort:
+            raise ValueError(f'stopped early: {message}')
+        print(f'Warning: {message}')
+        self.flagged = True
+
+
+# Combines partial aggregates (FileParser.to_aggregate) of the same library, e.g. from several SMRT cells or shards of a counts file, into one.
+# Counts of the same tile pattern in the same category are added and their line counts combined, as are category totals, full payload counts 
+# and counters, so merging is associative and the aggregates can be merged in any order. Aggregates classified with different settings raise a ValueError
+def merge_aggregates(aggregates):
+    if not aggregates:
+        raise ValueError('at least one aggregate is needed to merge')
+    for aggregate in aggregates:
+        if aggregate.get('aggregate_version') != AGGREGATE_VERSION:
+            raise ValueError(f'aggregate version {aggregate.get("aggregate_version")} of {aggregate.get("samples")} is not supported, only version {AGGREGATE_VERSION} is')
+        if aggregate['settings'] != aggregates[0]['settings']:
+            raise ValueError(f'{aggregate["samples"]} was classified with settings {aggregate["settings"]}, which differ from the settings of {aggregates[0]["samples"]}: {aggregates[0]["settings"]}')
+    merged = {'aggregate_version': AGGREGATE_VERSION, 'samples': [], 'settings': dict(aggregates[0]['settings']), 'counters': dict(),
+              'noncanonical': {'input_sequences': 0, 'patterns': 0, 'sequences': 0, 'tiles': dict()}, 'bins': dict()}
+    for aggregate in aggregates:
+        merged['samples'] += aggregate['samples']
+        add_counters(merged['counters'], aggregate['counters'])
+        for key in ['input_sequences', 'patterns', 'sequences']:
+            merged['noncanonical'][key] += aggregate['noncanonical'][key]
+        for tile_name, (patterns, sequences) in aggregate['noncanonical']['tiles'].items():
+            tile_counts = merged['noncanonical']['tiles'].setdefault(tile_name, [0, 0])
+            tile_counts[0] += patterns
+            tile_counts[1] += sequences
+        for name, bin_aggregate in aggregate['bins'].items():
+            merged_bin = merged['bins'].setdefault(name, {'sequences': 0, 'full_sequences': 0, 'patterns': dict()})
+            merged_bin['sequences'] += bin_aggregate['sequences']
+            merged_bin['full_sequences'] += bin_aggregate['full_sequences']
+            for tile_pattern, pattern in bin_aggregate['patterns'].items():
+                if tile_pattern in merged_bin['patterns']:
+                    merged_bin['patterns'][tile_pattern][0] += pattern[0]
+                    merged_bin['patterns'][tile_pattern][1] = sorted(merged_bin['patterns'][tile_pattern][1] + pattern[1], reverse=True)
+                else:
+                    merged_bin['patterns'][tile_pattern] = [pattern[0], list(pattern[1])] + list(pattern[2:])
+    return merged
+
+
+# adds the numbers in counters to those in total_counters, including those in nested dictionaries
+def add_counters(total_counters, counters):
+    for key, value in counters.items():
+        if type(value) is dict:
+            add_counters(total_counters.setdefault(key, dict()), value)
+        else:
+            total_counters[key] = total_counters.get(key, 0) + value
+
+
+def write_aggregate(aggregate, output_file):
+    with open(output_file, 'w') as f:
+        json.dump(aggregate, f)
+
+
+def read_aggregate(input_file):
+    with open(input_file, 'r') as f:
+        return json.load(f)
+
+
+# the names of the tiles that are noncanonical, i.e. with names not in the VG_TILES list and not homopolymers, read from the tile strings of a line
+def get_noncanonical_tile_names(tiles):
+    tile_names = set()
+    for tile in tiles:
+        tile_name = tile.split('[', 1)[0]
+        if tile_name.split('_')[0] not in VG_TILES and 'poly' not in tile_name:
+            tile_names.add(tile_name)
+    return tile_names
+
+
 # group initial set of TileLine categories from the subparser into an equal or lesser set of category labels, based on the groups in the category_groups dictionary 
 # picked below. The option is set via user arguments, and the default is the five groups resulting from category_group_set == None
 def get_category_groups(category_group_set):
@@ -211,14 +627,54 @@ def get_category_groups(category_group_set):
     return category_groups
 
 
-def add_untileable_sequence_bin(file_parser_obj, input_file):
-    # getting summary file
+# raises a ValueError if an option is out of range or can't be used with another. FileParser, classification_settings and main() all check their
+# options here, so the command line and the Python API accept the same combinations
+def check_options(coordinate_buffer=0, top_k=None, memory_budget=None, low_fulls_gate=None, collapse_patterns=False, aggregate=False, stream_input=False,
+                  infer_payload_size=False):
+    if coordinate_buffer < 0: raise ValueError('the coordinate buffer must be greater than 0')
+    if top_k is not None and top_k < 1: raise ValueError('top_k must be at least 1')
+    if top_k is not None and aggregate: raise ValueError('an aggregate needs every tile pattern, so it cannot be made with top_k')
+    if memory_budget is not None and memory_budget < 1: raise ValueError('the memory budget must be at least 1')
+    if low_fulls_gate and collapse_patterns: raise ValueError('collapse_patterns classifies tile patterns after reading every line, so it cannot be used with a low fulls gate')
+    if stream_input and infer_payload_size: raise ValueError('inferring the payload size reads the input file before classifying it, so it cannot be done with standard input or a named pipe')
+    if stream_input and low_fulls_gate: raise ValueError('a low fulls gate reads the summary file before classifying, so it cannot be used with standard input or a named pipe')
+
+
+# whether an input file is read as it's written by the tiler rather than once it's finished: - for standard input, or a named pipe (FIFO)
+def is_stream_input(input_file):
+    return input_file == '-' or (os.path.exists(input_file) and stat.S_ISFIFO(os.stat(input_file).st_mode))
+
+
+# opens an input file for reading, with - for standard input, which is left open when the returned file is closed.
+# Lines read from a named pipe or standard input are returned as soon as the tiler writes them
+def open_input(input_file):
+    if input_file == '-':
+        return open(sys.stdin.fileno(), 'r', closefd=False)
+    return open(input_file, 'r')
+
+
+# the tiler's summary file with the same root filename as the input file, or None if there isn't one
+def get_summary_file(input_file):
     file_directory = os.path.dirname(input_file)
-    for file in os.listdir(file_directory):
+    for file in os.listdir(file_directory if file_directory else '.'):
         if os.path.basename(input_file).split('.')[0] == file.split('.')[0] and '.summary' in file:
-            summary_file = os.path.join(file_directory, file)
-            break
-    else:
+            return os.path.join(file_directory, file)
+    return None
+
+
+# the number of tiled sequences in a summary file, or None if it doesn't have it
+def get_tiled_sequence_count(summary_file):
+    with open(summary_file, 'r') as f:
+        for line in f:
+            if line.startswith('Total sequence code count'):
+                return float(line.split('=')[1])
+    return None
+
+
+def add_untileable_sequence_bin(file_parser_obj, input_file):
+    # getting summary file
+    summary_file = get_summary_file(input_file)
+    if summary_file is None:
         print(f'Warning: no summary file found for {input_file}; running without adding untileable sequences to counts')
         return
     # getting untileable sequence count from summary file
@@ -237,6 +693,68 @@ def add_untileable_sequence_bin(file_parser_obj, input_file):
     untileable_sequence_tileline = TileLine(f'{untileable_sequences} 0')
     untileable_sequence_tileline.category = 'untileable_sequences'
     file_parser_obj.unbinned_tilelines.append(untileable_sequence_tileline)
+    return untileable_sequence_tileline
+
+
+# the path of the tiler output file with the same root filename as input_file and the given extension (e.g. '.feats'), or None if there isn't one
+def get_tiler_file(input_file, extension):
+    tiler_file = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0] + extension)
+    return tiler_file if os.path.isfile(tiler_file) else None
+
+
+# the count weighted histogram of payload tile end coordinates, indexed by coordinate, and the file it was read from.
+# The tiler's .feats file lists every tile with its count, so it's used when there is one. Otherwise each payload tile in the input file is weighted
+# by its line's count, which counts both halves of a U line at the full count
+def get_payload_end_histogram(input_file):
+    ends, weights = [], []
+    feats_file = get_tiler_file(input_file, '.feats')
+    if feats_file:
+        with open(feats_file, 'r') as f:
+            for line in f:
+                data = line.split()
+                match = PAYLOAD_END_REGEX.match(data[0]) if len(data) == 2 else None
+                if match:
+                    ends.append(int(match.group(1)))
+                    weights.append(float(data[1]))
+    if not ends:
+        feats_file = None
+        with open(input_file, 'r') as f:
+            for line in f:
+                data = line.split(maxsplit=2)
+                if len(data) < 3: continue
+                for end in PAYLOAD_END_REGEX.findall(data[2]):
+                    ends.append(int(end))
+                    weights.append(float(data[0]))
+    if not ends:
+        raise ValueError(f'no payload tiles were found in {input_file}, so the payload size cannot be inferred')
+    return np.bincount(ends, weights=weights), feats_file if feats_file else input_file
+
+
+# the payload size of a counts file inferred from the most common payload tile end coordinate, as the length of a full payload is its end coordinate.
+# The confidence is the proportion of payload tiles ending within the coordinate buffer of it, and the runner up is the most common end outside of that
+def infer_payload_size(input_file, coordinate_buffer=6):
+    histogram, source = get_payload_end_histogram(input_file)
+    payload_tiles = histogram.sum()
+    payload_size = int(np.argmax(histogram))
+    near_payload_size = slice(max(0, payload_size - coordinate_buffer), payload_size + coordinate_buffer + 1)
+    inference = {'payload_size': payload_size, 'source': source, 'payload_tiles': payload_tiles, 'confidence': histogram[near_payload_size].sum() / payload_tiles,
+                 'runner_up': None, 'runner_up_confidence': 0.0}
+    histogram[near_payload_size] = 0
+    if histogram.any():
+        runner_up = int(np.argmax(histogram))
+        inference['runner_up'] = runner_up
+        inference['runner_up_confidence'] = histogram[max(0, runner_up - coordinate_buffer):runner_up + coordinate_buffer + 1].sum() / payload_tiles
+    return inference
+
+
+def format_payload_size_inference(inference):
+    message = f'inferred a payload size of {inference["payload_size"]} from {os.path.basename(inference["source"])}: {inference["confidence"]:.1%} of ' \
+              f'{inference["payload_tiles"]:.0f} payload tiles end within the coordinate buffer of it'
+    if inference['runner_up'] is not None:
+        message += f'; the next most common end, {inference["runner_up"]}, has {inference["runner_up_confidence"]:.1%}'
+    if inference['confidence'] < PAYLOAD_SIZE_CONFIDENCE_WARNING:
+        message += f'\nWarning: the inferred payload size is uncertain, check it before using these results'
+    return message
 
 
 def GraphWriter(output_file):
@@ -296,60 +814,178 @@ def main():
     # setting argument variables based on user args
     INPUT_FILE = arguments.input_file
     OUTPUT_DIRECTORY = arguments.output_directory
-    EXPECTED_PAYLOAD_SIZE = arguments.payload_size
     MOD_DICTIONARY = get_category_groups(arguments.group_categories)
-    global NONCANON_ANALYSIS
-    NONCANON_ANALYSIS = arguments.noncanonical_analysis
+    if arguments.payload_size is None and not arguments.infer_payload_size: raise ValueError('-payload_size is required unless -infer_payload_size is used')
+    if arguments.payload_size is not None and arguments.infer_payload_size: raise ValueError('use either -payload_size or -infer_payload_size, not both')
+
+    # checking the options together before anything is read. Standard input and named pipes are read as they're written, so they can only be read once
+    # and their summary file may not be written yet
+    stream_input = is_stream_input(INPUT_FILE)
+    check_options(arguments.coordinate_buffer, arguments.top_k, arguments.memory_budget, arguments.low_fulls_gate, arguments.collapse_patterns, arguments.aggregate,
+                  stream_input, arguments.infer_payload_size)
 
     # setting class variables 
-    if arguments.coordinate_buffer < 0: raise ValueError('the coordinate buffer must be greater than 0')
     Tile.coordinate_buffer = arguments.coordinate_buffer
-    Tile.expected_payload_size = EXPECTED_PAYLOAD_SIZE
+    TileLineBin.top_k = arguments.top_k
 
     # checking for valid files and reformatting file names
-    if not os.path.exists(INPUT_FILE):
+    if stream_input:
+        if arguments.sample_name is None: raise ValueError('-sample_name is required to read standard input or a named pipe')
+    elif not os.path.exists(INPUT_FILE):
         raise FileNotFoundError(f'{INPUT_FILE} does not exist')
     input_file = os.path.basename(INPUT_FILE)
-    if '.counts' not in str(input_file):  # only run .counts files
+    if not stream_input and '.counts' not in str(input_file):  # only run .counts files
         raise FileNotFoundError(f'the input file {input_file} is not supported. It must be a counts file')
+    # the path the summary file is looked for by; a streamed input's is found by the sample name
+    summary_input_file = os.path.join(os.path.dirname(INPUT_FILE), arguments.sample_name) if stream_input else INPUT_FILE
+    if arguments.infer_payload_size:
+        inference = infer_payload_size(INPUT_FILE, arguments.coordinate_buffer)
+        print(format_payload_size_inference(inference))
+        arguments.payload_size = inference['payload_size']
+    EXPECTED_PAYLOAD_SIZE = arguments.payload_size
+    Tile.expected_payload_size = EXPECTED_PAYLOAD_SIZE
     
     # create output directory if it doesn't already exist
     extensions = -3 if 'zmw' in INPUT_FILE else -2
-    output_path = os.path.join(OUTPUT_DIRECTORY, '.'.join(input_file.split('.')[:extensions]))
+    output_name = arguments.sample_name if arguments.sample_name else '.'.join(input_file.split('.')[:extensions])
+    sample_name = arguments.sample_name if arguments.sample_name else input_file.split('.')[0]
+    output_path = os.path.join(OUTPUT_DIRECTORY, output_name)
     if not os.path.exists(output_path):
         os.mkdir(output_path,  mode=0o777)
-    output_file = os.path.join(output_path, '.'.join(input_file.split('.')[:extensions])) + '.subparsed.tsv'
-
-    # nearly all of the code is run in this block
-    file_parser = FileParser(INPUT_FILE, 
-                             require_full_payloads_in_expected=arguments.dont_require_full_payloads, 
-                             raise_error_on_low_fulls=arguments.raise_error_on_low_fulls,
-                             debug=arguments.debug, 
-                             parse_homopolymers = arguments.parse_homopolymers)
-    
-    # optionally add untileable sequence count as an empty bin
-    if arguments.untileable_sequences:
-        add_untileable_sequence_bin(file_parser, INPUT_FILE)
-
-	# group categories if that is being done per user arg
-    if MOD_DICTIONARY:
-        file_parser.group_categories(MOD_DICTIONARY)
-
-	# finalize data by placing all tileline objects with the same category field into separate bin objects then calculate bin-based data and write to file
-    TileLine.tokens = file_parser.parser.tokens # makes it so the condensed tilelines written to the output file don't include tokens not in the parser's grammar
-    file_parser.bin_tilelines()
-    file_parser.write_to_file(output_file)
-
-    # output desired bins to counts file for more analysis ------------------------------------------------------------------- #
+    output_file = os.path.join(output_path, output_name) + '.subparsed.tsv'
+    output_root = os.path.splitext(os.path.splitext(output_file)[0])[0]
+    timer = StageTimer()
+    tracer = None
+    if arguments.trace:
+        tracer = DerivationTracer(max_traces=arguments.trace_max, sample_rate=arguments.trace_sample_rate, 
+                                  categories=arguments.trace_categories, pattern_regex=arguments.trace_pattern)
+
+    # category counts files are written as the lines are classified
     bins_output_path = os.path.join(output_path, 'categories')
     if not os.path.exists(bins_output_path):
         os.mkdir(bins_output_path, mode=0o777)
-    if arguments.bin_to_counts_files:
-        for bin in file_parser.bins_list:
-            file_parser.write_bin(os.path.join(bins_output_path, f'{input_file.split(".")[0]}.{bin.name}.tile.zmw.counts'), bin)
+    category_writers = CategoryWriters(bins_output_path, sample_name, MOD_DICTIONARY, sort_lines=arguments.memory_budget is None) if arguments.bin_to_counts_files else None
+
+    # the category counts files are removed if the run stops before they're finished, e.g. by -low_fulls_gate, so partial files aren't left as outputs
+    try:
+        # nearly all of the code is run in this block
+        timer.start('classify')
+        if arguments.profile and arguments.profile_dump == 'cprofile':
+            classify_profile = cProfile.Profile()
+            classify_profile.enable()
+        elif arguments.profile and arguments.profile_dump == 'tracemalloc':
+            tracemalloc.start()
+        parser = VectorSubParser(VectorLexer(NoncanonicalRules(arguments.noncanonical_rules)), 
+                                 require_full_payloads_in_expected=arguments.dont_require_full_payloads, 
+                                 debug=arguments.debug, 
+                                 parse_homopolymers=arguments.parse_homopolymers, 
+                                 tracer=tracer)
+        if arguments.parse_cache and os.path.isfile(arguments.parse_cache):
+            parser.read_parse_cache(arguments.parse_cache)
+        low_fulls_gate = get_low_fulls_gate(summary_input_file, MOD_DICTIONARY, arguments.untileable_sequences, arguments.low_fulls_gate == 'abort') if arguments.low_fulls_gate else None
+        file_parser = FileParser(INPUT_FILE, 
+                                 raise_error_on_low_fulls=arguments.raise_error_on_low_fulls,
+                                 parser=parser,
+                                 noncanonical_analysis=arguments.noncanonical_analysis,
+                                 category_writers=category_writers,
+                                 keep_raw_data=False,
+                                 memory_budget=arguments.memory_budget,
+                                 bin_while_reading=arguments.top_k is not None,
+                                 category_groups=MOD_DICTIONARY,
+                                 low_fulls_gate=low_fulls_gate,
+                                 collapse_patterns=arguments.collapse_patterns)
+        if tracer:
+            tracer.write(output_root + '.trace.txt')
+        if arguments.parse_cache:
+            parser.write_parse_cache(arguments.parse_cache)
+        if arguments.profile and arguments.profile_dump == 'cprofile':
+            classify_profile.disable()
+            classify_profile.dump_stats(output_root + '.classify.prof')
+        elif arguments.profile and arguments.profile_dump == 'tracemalloc':
+            write_tracemalloc_snapshot(tracemalloc.take_snapshot(), output_root + '.classify.tracemalloc.txt')
+            tracemalloc.stop()
+    
+        # optionally add untileable sequence count as an empty bin
+        if arguments.untileable_sequences:
+            untileable_sequence_tileline = add_untileable_sequence_bin(file_parser, summary_input_file)
+            # the untileable sequences tileline has no tiles, so its truth value (TileLine.__len__) is False
+            if category_writers is not None and untileable_sequence_tileline is not None:
+                category_writers.write(untileable_sequence_tileline.category, untileable_sequence_tileline.raw_data)
+
+    	# group categories if that is being done per user arg
+        timer.start('bin')
+        # with -memory_budget or -top_k, only the untileable sequences tileline is left to group
+        if MOD_DICTIONARY and file_parser.unbinned_tilelines:
+            file_parser.group_categories(MOD_DICTIONARY)
+
+    	# finalize data by placing all tileline objects with the same category field into separate bin objects then calculate bin-based data and write to file
+        TileLine.tokens = file_parser.parser.tokens # makes it so the condensed tilelines written to the output file don't include tokens not in the parser's grammar
+        file_parser.bin_tilelines()
+        timer.start('tsv')
+        file_parser.write_to_file(output_file)
+        file_parser.write_noncanonical(output_root + '.noncanonical.tsv')
+        if arguments.aggregate:
+            write_aggregate(file_parser.to_aggregate([sample_name], get_aggregate_settings(arguments)), output_root + '.aggregate.json')
+
+        # finish writing the category counts files for more analysis --------------------------------------------------------- #
+        timer.start('counts_files')
+        if category_writers is not None:
+            category_writers.close()
+    except BaseException:
+        if category_writers is not None:
+            category_writers.remove()
+        raise
 
     # graphing
+    timer.start('plot')
     GraphWriter(output_file)
+    timer.stop()
+
+    if arguments.profile:
+        write_profile(output_root + '.profile.json', INPUT_FILE, timer, file_parser)
+
+
+# the LowFullsGate of an input file, from the tiled (and with untileable_sequences, untileable) sequence counts of its summary file, 
+# or None if there's no summary file to get them from
+def get_low_fulls_gate(input_file, category_groups=None, untileable_sequences=False, abort=True):
+    summary_file = get_summary_file(input_file)
+    tiled_sequences = get_tiled_sequence_count(summary_file) if summary_file is not None else None
+    if tiled_sequences is None:
+        print(f'Warning: no tiled sequence count found in a summary file for {input_file}; running without -low_fulls_gate')
+        return None
+    untileable_sequence_count = 0
+    if untileable_sequences:
+        with open(summary_file, 'r') as f:
+            for line in f:
+                if 'Unaccounted sequences number' in line:
+                    untileable_sequence_count = float(line.split()[3])
+                    break
+    return LowFullsGate(tiled_sequences, category_groups, untileable_sequence_count, abort)
+
+
+# the settings that change classification results, which aggregates must share to be merged
+def get_aggregate_settings(arguments):
+    return {'payload_size': arguments.payload_size, 'coordinate_buffer': arguments.coordinate_buffer, 'group_categories': arguments.group_categories,
+            'require_full_payloads': arguments.dont_require_full_payloads, 'noncanonical_analysis': arguments.noncanonical_analysis, 
+            'parse_homopolymers': arguments.parse_homopolymers, 'untileable_sequences': arguments.untileable_sequences}
+
+
+# writes the -profile report: the time and peak memory of each stage of main() and the FileParser's counters
+def write_profile(profile_file, input_file, timer, file_parser):
+    counters = file_parser.get_counters()
+    lines = sum(counters['lines'].values())
+    with open(profile_file, 'w') as f:
+        json.dump({'input_file': input_file, 'lines': lines, 'total_seconds': timer.total_seconds(), 'peak_rss_mb': StageTimer.get_peak_rss_mb(),
+                   'stages': timer.report(lines), 'counters': counters}, f, indent=2)
+
+
+# writes the lines of code that allocated the most memory still held at the end of classification
+def write_tracemalloc_snapshot(snapshot, output_file, top_lines=30):
+    statistics = snapshot.statistics('lineno')
+    with open(output_file, 'w') as f:
+        f.write(f'total memory held: {sum([statistic.size for statistic in statistics]) / 1024 ** 2:.1f} MB\n')
+        for statistic in statistics[:top_lines]:
+            f.write(f'{statistic}\n')
 
 if __name__ == '__main__':
     main()
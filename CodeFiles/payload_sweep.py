@@ -0,0 +1,139 @@
+from classifier import *
+import numpy as np
+import time
+
+
+# Classifies a counts file once, then finds the category proportions it would have with each combination of several payload sizes and coordinate
+# buffers without parsing it again, e.g. when the -raise_error_on_low_fulls error fires or the construct's payload size isn't known for sure.
+# Only whether payload tiles are full depends on those settings, which decides whether expected species stay expected (see check_expected)
+# and the proportion of each category with a full payload. So the tile patterns are parsed with check_expected off, and the payload tile
+# coordinates of every tile line are compared with every payload size of each coordinate buffer at once with numpy
+
+SWEEP_COLUMNS = ['payload_size', 'coordinate_buffer', 'category', 'sequences', 'proportion', 'patterns', 'full_proportion']
+
+
+# the arrays that the sweep is calculated from: the category code, count and whether it has tiles of every tile line, and the tile line index and
+# coordinates of every payload tile, in tile line order. Single coordinate payload tiles are never full, so they're marked in has_end
+def get_sweep_arrays(tilelines, categories):
+    category_codes = np.array([categories.index(tileline.category) for tileline in tilelines], dtype=np.int64)
+    counts = np.array([tileline.count for tileline in tilelines], dtype=np.float64)
+    has_tiles = np.array([bool(tileline.tile_pattern) for tileline in tilelines])
+    payload_tiles = [(i, tile.coordinate_start, tile.coordinate_end) for i, tileline in enumerate(tilelines) for tile in tileline.get_tiles('Payload')]
+    line_indices = np.array([i for i, _, _ in payload_tiles], dtype=np.int64)
+    starts = np.array([start for _, start, _ in payload_tiles], dtype=np.int64)
+    has_end = np.array([end is not None for _, _, end in payload_tiles], dtype=bool)
+    ends = np.array([end if end is not None else 0 for _, _, end in payload_tiles], dtype=np.int64)
+    return category_codes, counts, has_tiles, line_indices, starts, has_end, ends
+
+
+# the number of full payload tiles of every tile line for each payload size, as a (payload sizes, tile lines) array.
+# A payload tile is full when both of its ends are within the coordinate buffer of 1 and the payload size, as in Tile.set_is_full
+def get_full_payload_counts(line_count, line_indices, starts, has_end, ends, payload_sizes, coordinate_buffer):
+    full_payload_counts = np.zeros((len(payload_sizes), line_count), dtype=np.int64)
+    if len(line_indices) == 0:
+        return full_payload_counts
+    is_full = (np.abs(starts - 1) <= coordinate_buffer) & has_end & (np.abs(ends[None, :] - payload_sizes[:, None]) <= coordinate_buffer)
+    # payload tiles are in tile line order, so each tile line's are summed by reduceat from its first
+    first_tiles = np.flatnonzero(np.r_[True, line_indices[1:] != line_indices[:-1]])
+    full_payload_counts[:, line_indices[first_tiles]] = np.add.reduceat(is_full.astype(np.int64), first_tiles, axis=1)
+    return full_payload_counts
+
+
+# the sweep table of tile lines classified with check_expected off, with one row for each category of each payload size and coordinate buffer.
+# Categories are in order of their sequences in each, as in the *.subparsed.tsv file
+def sweep_tilelines(tilelines, payload_sizes, coordinate_buffers, require_full_payloads=True, category_groups=None):
+    categories = sorted(set([tileline.category for tileline in tilelines]) | {'irregular_payload'})
+    category_codes, counts, has_tiles, line_indices, starts, has_end, ends = get_sweep_arrays(tilelines, categories)
+    payload_sizes = np.array(payload_sizes, dtype=np.int64)
+    payload_counts = np.bincount(line_indices, minlength=len(tilelines))
+    is_expected_species = np.isin(category_codes, [categories.index(category) for category in EXPECTED_SPECIES if category in categories])
+    # the code of each category after grouping, and the grouped category names
+    if category_groups:
+        output_categories = sorted(set([category_groups.get(category, 'other') for category in categories]))
+        output_codes = np.array([output_categories.index(category_groups.get(category, 'other')) for category in categories], dtype=np.int64)
+    else:
+        output_categories = categories
+        output_codes = np.arange(len(categories))
+    total_sequences = counts.sum()
+    # every payload size's categories are counted in one bincount by offsetting its category codes
+    offsets = (np.arange(len(payload_sizes)) * len(output_categories))[:, None]
+    bincount_size = len(payload_sizes) * len(output_categories)
+    rows = []
+    for coordinate_buffer in coordinate_buffers:
+        full_payload_counts = get_full_payload_counts(len(tilelines), line_indices, starts, has_end, ends, payload_sizes, coordinate_buffer)
+        final_codes = np.broadcast_to(category_codes, full_payload_counts.shape)
+        if require_full_payloads:
+            final_codes = np.where(is_expected_species & (full_payload_counts < payload_counts), categories.index('irregular_payload'), final_codes)
+        grouped_codes = (output_codes[final_codes] + offsets).ravel()
+        sequences = np.bincount(grouped_codes, weights=np.tile(counts, len(payload_sizes)), minlength=bincount_size).reshape(len(payload_sizes), -1)
+        full_sequences = np.bincount(grouped_codes, weights=(counts * (full_payload_counts > 0)).ravel(), minlength=bincount_size).reshape(len(payload_sizes), -1)
+        patterns = np.bincount(grouped_codes, weights=np.tile(has_tiles, len(payload_sizes)), minlength=bincount_size).reshape(len(payload_sizes), -1)
+        for i, payload_size in enumerate(payload_sizes):
+            for j in sorted(np.flatnonzero(sequences[i]), key=lambda j: sequences[i][j], reverse=True):
+                rows.append((int(payload_size), coordinate_buffer, output_categories[j], sequences[i][j], sequences[i][j] / total_sequences, int(patterns[i][j]),
+                             full_sequences[i][j] / sequences[i][j]))
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+
+# classifies a counts file path, or an iterable of counts file lines, once and returns its sweep table over every combination of the payload sizes
+# and coordinate buffers. The other options are the same as classify()'s
+def sweep(path_or_lines, payload_sizes, coordinate_buffers=[6], group_categories=None, require_full_payloads=True, noncanonical_analysis=False,
+          parse_homopolymers=False, untileable_sequences=False, noncanonical_rules=None):
+    if not payload_sizes or not coordinate_buffers: raise ValueError('at least one payload size and coordinate buffer are needed')
+    if min(coordinate_buffers) < 0: raise ValueError('the coordinate buffer must be greater than 0')
+    check_input(path_or_lines, untileable_sequences)
+    # the payload size and coordinate buffer are only used by check_expected and full payload checks, which aren't run here
+    with classification_settings(payload_sizes[0], coordinate_buffers[0], require_full_payloads=False):
+        parser = VectorSubParser(VectorLexer(noncanonical_rules), require_full_payloads_in_expected=False, parse_homopolymers=parse_homopolymers)
+        file_parser = read_tile_lines(path_or_lines, parser, noncanonical_analysis, untileable_sequences)
+        return sweep_tilelines(file_parser.unbinned_tilelines, payload_sizes, coordinate_buffers, require_full_payloads, get_category_groups(group_categories))
+
+
+# the proportion of sequences in full species categories (see FileParser.check_for_low_fulls) for each payload size and coordinate buffer of a sweep table
+def get_full_species_proportions(sweep_table):
+    full_species = sweep_table[sweep_table['category'].isin(FULL_CATEGORIES)]
+    proportions = full_species.groupby(['payload_size', 'coordinate_buffer'])['proportion'].sum()
+    return proportions.reindex(sweep_table.set_index(['payload_size', 'coordinate_buffer']).index.unique(), fill_value=0)
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='VectorSubparserSweep',
+                                    description='Classifies a counts file once and writes its category proportions for every combination of several payload sizes and coordinate buffers')
+    parser.add_argument('-input_file', required=True, type=str,
+                        help='the *.tile.zmw.counts file to classify')
+    parser.add_argument('-output_directory', required=True, type=str,
+                        help='the directory to write the <sample>.sweep.tsv file to')
+    parser.add_argument('-payload_sizes', required=True, type=int, nargs='+',
+                        help='the expected payload sizes to try, e.g. $(seq 1800 10 1900)')
+    parser.add_argument('-coordinate_buffers', type=int, nargs='+', default=[6],
+                        help='the coordinate buffers to try with each payload size. The default is 6')
+    parser.add_argument('-group_categories', choices=['five', 'six', 'two'], default=None,
+                        help='group the categories as parse_file.py does')
+    parser.add_argument('-dont_require_full_payloads', default=True, action='store_false',
+                        help='as in parse_file.py, allow partial payloads in the expected and expected_selfprime categories')
+    parser.add_argument('-untileable_sequences', default=False, action='store_true',
+                        help='include untileable sequences, counted from the summary file with the same root filename, as parse_file.py does')
+    parser.add_argument('-noncanonical_analysis', '-n', default=False, action='store_true',
+                        help='classify tile patterns with noncanonical tiles as parse_file.py does')
+    parser.add_argument('-noncanonical_rules', type=str, default=NONCANONICAL_RULES_FILE,
+                        help=f'with -noncanonical_analysis, the JSON file of noncanonical rules. The default is {os.path.basename(NONCANONICAL_RULES_FILE)}')
+    parser.add_argument('--parse_homopolymers', default=False, action='store_true',
+                        help='do not ignore homopolymer tiles, as in parse_file.py')
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = GetArguments().parse_args()
+    start_time = time.time()
+    sweep_table = sweep(arguments.input_file, arguments.payload_sizes, arguments.coordinate_buffers, arguments.group_categories, arguments.dont_require_full_payloads,
+                        arguments.noncanonical_analysis, arguments.parse_homopolymers, arguments.untileable_sequences, NoncanonicalRules(arguments.noncanonical_rules))
+    os.makedirs(arguments.output_directory, exist_ok=True)
+    output_file = os.path.join(arguments.output_directory, os.path.basename(arguments.input_file).split('.')[0] + '.sweep.tsv')
+    sweep_table.to_csv(output_file, sep='\t', index=False)
+    full_species_proportions = get_full_species_proportions(sweep_table)
+    print('proportion of sequences in full species categories:')
+    for (payload_size, coordinate_buffer), proportion in full_species_proportions.items():
+        print(f'payload size {payload_size}, coordinate buffer {coordinate_buffer}: {proportion:.4f}')
+    payload_size, coordinate_buffer = full_species_proportions.idxmax()
+    print(f'highest with payload size {payload_size} and coordinate buffer {coordinate_buffer}; sweep written to {output_file}')
+    print(f'run time: {time.time() - start_time} seconds')
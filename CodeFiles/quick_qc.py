@@ -0,0 +1,181 @@
+from classifier import *
+from statistics import NormalDist
+import time
+
+
+# Estimates the category proportions of a counts file for a quick go/no-go check, classifying only some of its tile patterns.
+# Either a count weighted random sample of tile patterns is classified, which is the same as classifying randomly drawn sequences,
+# and each category's proportion is given with a Wilson score confidence interval, or the tile patterns with the highest counts that
+# cover a fraction of the sequences are classified, and each category's proportion is bounded by the sequences left unclassified.
+# The tile patterns classified can be written to a parse cache file, which a later full run of parse_file.py starts with (-parse_cache)
+
+QUICK_COLUMNS = ['category', 'proportion', 'lower', 'upper', 'patterns']
+# the number of sequences drawn by default
+SAMPLE_SIZE = 2000
+
+
+# the tilelines of a counts file path, or an iterable of its lines, as FileParser.process_lines makes them but not classified.
+# Noncanonical tile patterns are skipped unless the file_parser does noncanonical analysis, so the totals are those of a full run
+def read_unclassified_tilelines(path_or_lines, file_parser):
+    if isinstance(path_or_lines, (str, os.PathLike)):
+        with open(path_or_lines, 'r') as f:
+            return read_unclassified_tilelines(f, file_parser)
+    tilelines = []
+    for line in path_or_lines:
+        if not line.strip(): continue
+        if ' U ' in line:
+            formatted_lines = file_parser.format_U_line(line)
+        elif ' x 2' in line:
+            formatted_lines = [file_parser.format_x_2_line(line)]
+        else:
+            formatted_lines = [line]
+        tilelines += [tileline for tileline in [file_parser.make_tileline(formatted_line) for formatted_line in formatted_lines] if tileline is not None]
+    return tilelines
+
+
+# every category a tile pattern can be classified as, grouped as FileParser.group_categories does. Categories that no classified tile pattern was in
+# are still in the quick table, since a category missing from the sample could still be in the sequences not classified
+def get_known_categories(parser, noncanonical_analysis=False, category_groups=None):
+    categories = CATEGORIES + (parser.lexer.noncanonical_rules.categories if noncanonical_analysis else [])
+    if category_groups:
+        categories = [category_groups.get(category, 'other') for category in categories]
+    return list(dict.fromkeys(categories))
+
+
+# the Wilson score interval of a proportion of n draws, which stays within 0 and 1 and isn't empty when a category is never or always drawn
+def wilson_interval(proportion, n, z):
+    center = (proportion + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    half_width = z / (1 + z ** 2 / n) * (proportion * (1 - proportion) / n + z ** 2 / (4 * n ** 2)) ** 0.5
+    return max(0, center - half_width), min(1, center + half_width)
+
+
+# classifies the tilelines drawn sample_size times with probability proportional to their counts, each once however many times it's drawn.
+# Returns the quick table and the (proportion, lower, upper) of full species, with Wilson intervals at the z score given.
+# Each of categories (see get_known_categories) that wasn't drawn has a row with a proportion of 0
+def estimate_from_sample(tilelines, parser, sample_size, z, seed=0, category_groups=None, categories=[]):
+    counts = np.array([tileline.count for tileline in tilelines])
+    drawn_indices, draw_counts = np.unique(np.random.default_rng(seed).choice(len(tilelines), size=sample_size, p=counts / counts.sum()), return_counts=True)
+    category_draws = dict()
+    category_patterns = dict()
+    for i, draws in zip(drawn_indices, draw_counts):
+        category = classify_tileline(tilelines[i], parser, category_groups)
+        category_draws[category] = category_draws.get(category, 0) + int(draws)
+        category_patterns[category] = category_patterns.get(category, 0) + 1
+    rows = [(category, draws / sample_size, *wilson_interval(draws / sample_size, sample_size, z), category_patterns[category])
+            for category, draws in sorted(category_draws.items(), key=lambda x: x[1], reverse=True)]
+    rows += [(category, 0.0, *wilson_interval(0, sample_size, z), 0) for category in categories if category not in category_draws]
+    full_proportion = sum([draws for category, draws in category_draws.items() if category in FULL_CATEGORIES]) / sample_size
+    return pd.DataFrame(rows, columns=QUICK_COLUMNS), (full_proportion, *wilson_interval(full_proportion, sample_size, z))
+
+
+# classifies the tilelines with the highest counts until they have top_coverage of the sequences. Each category's proportion is estimated from the
+# classified sequences, and bounded below by it having none of the unclassified sequences and above by it having all of them.
+# Returns the quick table and the (proportion, lower, upper) of full species. Each of categories (see get_known_categories) that wasn't classified
+# has a row with a proportion of 0, bounded above by the unclassified sequences
+def estimate_from_top_patterns(tilelines, parser, top_coverage, category_groups=None, categories=[]):
+    total_sequences = sum([tileline.count for tileline in tilelines])
+    category_sequences = dict()
+    category_patterns = dict()
+    covered_sequences = 0
+    for tileline in sorted(tilelines, key=lambda x: x.count, reverse=True):
+        if covered_sequences >= top_coverage * total_sequences:
+            break
+        category = classify_tileline(tileline, parser, category_groups)
+        category_sequences[category] = category_sequences.get(category, 0) + tileline.count
+        category_patterns[category] = category_patterns.get(category, 0) + 1
+        covered_sequences += tileline.count
+    remaining_sequences = total_sequences - covered_sequences
+    rows = [(category, sequences / covered_sequences, sequences / total_sequences, (sequences + remaining_sequences) / total_sequences, category_patterns[category])
+            for category, sequences in sorted(category_sequences.items(), key=lambda x: x[1], reverse=True)]
+    rows += [(category, 0.0, 0.0, remaining_sequences / total_sequences, 0) for category in categories if category not in category_sequences]
+    full_sequences = sum([sequences for category, sequences in category_sequences.items() if category in FULL_CATEGORIES])
+    return pd.DataFrame(rows, columns=QUICK_COLUMNS), (full_sequences / covered_sequences, full_sequences / total_sequences, (full_sequences + remaining_sequences) / total_sequences)
+
+
+# the category of a classified tileline, grouped as FileParser.group_categories does
+def classify_tileline(tileline, parser, category_groups=None):
+    parser.run(tileline)
+    if category_groups:
+        return category_groups.get(tileline.category, 'other')
+    return tileline.category
+
+
+# estimates the category proportions of a counts file path, or an iterable of counts file lines, from a sample of sample_size sequences, or from
+# the tile patterns covering top_coverage of the sequences if given. Returns the quick table and the (proportion, lower, upper) of full species.
+# The other options are the same as classify()'s; the tile patterns classified are kept in the parse cache of the parser, if one is given
+def quick_classify(path_or_lines, payload_size, sample_size=SAMPLE_SIZE, top_coverage=None, confidence=0.95, seed=0, coordinate_buffer=6, group_categories=None,
+                   require_full_payloads=True, noncanonical_analysis=False, parse_homopolymers=False, noncanonical_rules=None, parser=None):
+    if sample_size < 1: raise ValueError('the sample size must be at least 1')
+    if top_coverage is not None and not 0 < top_coverage <= 1: raise ValueError('the top coverage must be greater than 0 and at most 1')
+    if not 0 < confidence < 1: raise ValueError('the confidence must be between 0 and 1')
+    check_input(path_or_lines)
+    with classification_settings(payload_size, coordinate_buffer, require_full_payloads):
+        if parser is None:
+            parser = VectorSubParser(VectorLexer(noncanonical_rules), require_full_payloads_in_expected=require_full_payloads, parse_homopolymers=parse_homopolymers)
+        file_parser = FileParser('', parser=parser, noncanonical_analysis=noncanonical_analysis)
+        tilelines = read_unclassified_tilelines(path_or_lines, file_parser)
+        if len(tilelines) == 0:
+            raise ValueError(f'no valid vector tile patterns were found in {path_or_lines if isinstance(path_or_lines, (str, os.PathLike)) else "the given lines"}')
+        category_groups = get_category_groups(group_categories)
+        categories = get_known_categories(parser, file_parser.noncanonical_analysis, category_groups)
+        if top_coverage is None:
+            return estimate_from_sample(tilelines, parser, sample_size, NormalDist().inv_cdf(0.5 + confidence / 2), seed, category_groups, categories)
+        return estimate_from_top_patterns(tilelines, parser, top_coverage, category_groups, categories)
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='VectorSubparserQuickQC',
+                                    description='Estimates the category proportions of a counts file from a sample of its tile patterns, for a quick check before a full run')
+    parser.add_argument('-input_file', required=True, type=str,
+                        help='the *.tile.zmw.counts file to check')
+    parser.add_argument('-output_directory', required=True, type=str,
+                        help='the directory to write the <sample>.quick.tsv file to')
+    parser.add_argument('-payload_size', required=True, type=int,
+                        help='the expected payload size, as in parse_file.py')
+    parser.add_argument('-sample_size', type=int, default=SAMPLE_SIZE,
+                        help=f'the number of sequences drawn, classifying the tile pattern of each. The default is {SAMPLE_SIZE}')
+    parser.add_argument('-top_coverage', type=float, default=None,
+                        help='instead of sampling, classify the tile patterns with the highest counts covering this fraction of the sequences, e.g. 0.9, \
+                            and bound each proportion by the sequences left unclassified')
+    parser.add_argument('-confidence', type=float, default=0.95,
+                        help='the confidence level of the intervals of sampled proportions. The default is 0.95')
+    parser.add_argument('-seed', type=int, default=0,
+                        help='the random seed of the sample. The default is 0')
+    parser.add_argument('-parse_cache', type=str, default=None,
+                        help='a JSON file to write the classified tile patterns to, which parse_file.py -parse_cache starts with. If it exists, it is read first')
+    parser.add_argument('-coordinate_buffer', type=int, default=6,
+                        help='as in parse_file.py. The default is 6')
+    parser.add_argument('-group_categories', choices=['five', 'six', 'two'], default=None,
+                        help='group the categories as parse_file.py does')
+    parser.add_argument('-dont_require_full_payloads', default=True, action='store_false',
+                        help='as in parse_file.py, allow partial payloads in the expected and expected_selfprime categories')
+    parser.add_argument('-noncanonical_analysis', '-n', default=False, action='store_true',
+                        help='classify tile patterns with noncanonical tiles as parse_file.py does')
+    parser.add_argument('-noncanonical_rules', type=str, default=NONCANONICAL_RULES_FILE,
+                        help=f'with -noncanonical_analysis, the JSON file of noncanonical rules. The default is {os.path.basename(NONCANONICAL_RULES_FILE)}')
+    parser.add_argument('--parse_homopolymers', default=False, action='store_true',
+                        help='do not ignore homopolymer tiles, as in parse_file.py')
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = GetArguments().parse_args()
+    start_time = time.time()
+    parser = VectorSubParser(VectorLexer(NoncanonicalRules(arguments.noncanonical_rules)), require_full_payloads_in_expected=arguments.dont_require_full_payloads,
+                             parse_homopolymers=arguments.parse_homopolymers)
+    if arguments.parse_cache and os.path.isfile(arguments.parse_cache):
+        parser.read_parse_cache(arguments.parse_cache)
+    quick_table, (full_proportion, full_lower, full_upper) = quick_classify(arguments.input_file, arguments.payload_size, arguments.sample_size, arguments.top_coverage,
+                                                                           arguments.confidence, arguments.seed, arguments.coordinate_buffer, arguments.group_categories,
+                                                                           arguments.dont_require_full_payloads, arguments.noncanonical_analysis, parser=parser)
+    os.makedirs(arguments.output_directory, exist_ok=True)
+    if arguments.parse_cache:
+        parser.write_parse_cache(arguments.parse_cache)
+    output_file = os.path.join(arguments.output_directory, os.path.basename(arguments.input_file).split('.')[0] + '.quick.tsv')
+    quick_table.to_csv(output_file, sep='\t', index=False)
+    print(quick_table.to_string(index=False))
+    # the same threshold as parse_file.py's -raise_error_on_low_fulls
+    verdict = 'pass' if full_lower >= 0.5 else 'fail' if full_upper < 0.5 else 'uncertain'
+    print(f'proportion of sequences in full species categories: {full_proportion:.4f} ({full_lower:.4f} to {full_upper:.4f}), {verdict} at 50%')
+    print(f'quick table written to {output_file}')
+    print(f'run time: {time.time() - start_time} seconds')
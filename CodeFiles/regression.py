@@ -0,0 +1,188 @@
+from classifier import *
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import math
+import sys
+import tempfile
+import time
+
+
+# Classifies every reference input in a manifest again, across a pool of processes, and compares the category summary and tile pattern rows of
+# each *.subparsed.tsv file written with the committed reference output, allowing for float noise. A faster engine, a cache or a grammar change
+# can then be checked against all of the reference data in one run. Reference outputs written by earlier versions of parse_file.py, with other
+# column names or the older "Key: value" pattern rows, are read as well. Each manifest case has a name, an input_file and a reference path relative
+# to the manifest, and the options classify() is called with; a {sample} in both paths makes a case of every reference matching it. A case can
+# have a known_mismatch note, in which case its differences are reported but don't fail the run, and a missing_input note on how to get its input
+
+CODE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILE = os.path.join(CODE_DIRECTORY, 'regression_manifest.json')
+WORKERS = 4
+# the relative and absolute tolerance of numbers compared, which the rounding of older reference outputs is within
+TOLERANCE = 1e-5
+# the number of differing rows of each section shown for a mismatched case
+SHOWN_DIFFERENCES = 3
+
+
+# the cases of a manifest file, with their paths made absolute and every {sample} case expanded from the references that exist
+def read_manifest(manifest_file=MANIFEST_FILE):
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_file))
+    with open(manifest_file, 'r') as f:
+        entries = json.load(f)
+    cases = []
+    for entry in entries:
+        input_file = os.path.normpath(os.path.join(manifest_directory, entry['input_file']))
+        reference = os.path.normpath(os.path.join(manifest_directory, entry['reference']))
+        case = {'name': entry['name'], 'input_file': input_file, 'reference': reference, 'options': entry.get('options', {}),
+                'known_mismatch': entry.get('known_mismatch'), 'missing_input': entry.get('missing_input')}
+        if '{sample}' not in reference:
+            cases.append(case)
+            continue
+        # the first {sample} of the reference is matched as a group and the rest must repeat it
+        sample_pattern = re.escape(reference).replace(re.escape('{sample}'), '(?P<sample>[^/]+)', 1).replace(re.escape('{sample}'), '(?P=sample)')
+        for sample_reference in sorted(glob.glob(reference.replace('{sample}', '*'))):
+            match = re.fullmatch(sample_pattern, sample_reference)
+            if match:
+                sample = match.group('sample')
+                cases.append(dict(case, name=f'{entry["name"]} {sample}', input_file=input_file.replace('{sample}', sample), reference=sample_reference))
+    return cases
+
+
+# a field of an output row as a number if it is one, ignoring a trailing %
+def read_field(field):
+    try:
+        return float(field.rstrip('%'))
+    except ValueError:
+        return field
+
+
+# the category summary rows and tile pattern rows of a *.subparsed.tsv file. Summary rows are (category, sequences, proportion, patterns, full)
+# and tile pattern rows are (category, tile pattern, count, repeats, proportion, linearity, irregular ITRs, polymer, full payload), sorted so that
+# files listing the same rows in a different order compare equal. The tokenized column is left out since its format has changed
+def read_subparsed_tsv(output_file):
+    with open(output_file, 'r') as f:
+        lines = f.read().splitlines()
+    summary_rows = []
+    pattern_rows = []
+    in_summary = True
+    for line in lines[1:]:
+        fields = line.split('\t')
+        if in_summary:
+            if not line.strip():
+                in_summary = False
+            else:
+                summary_rows.append(tuple([read_field(field) for field in fields]))
+        elif line.startswith('\tCategory: '):
+            values = dict([field.split(': ', 1) if ': ' in field else (field.rstrip(':'), '') for field in fields[1:]])
+            proportion = [value for key, value in values.items() if key.startswith('Proportion_of_')][0]
+            pattern_rows.append((values['Category'], values['Tiles'], *[read_field(value) for value in [values['Count'], values['Repeats'], proportion]],
+                                 values['Linearity'], values['Mutant_ITRs'], values['Contains_Polymer'], values['full_payloads']))
+        elif len(fields) == 10 and fields[0] != 'Subclassification':
+            category, count, repeats, proportion, linearity, irregular_itrs, polymer, full_payload, tokenized, tile_pattern = fields
+            pattern_rows.append((category, tile_pattern, *[read_field(field) for field in [count, repeats, proportion]], linearity, irregular_itrs, polymer, full_payload))
+    # the proportion isn't sorted on, so float noise can't change the order
+    return summary_rows, sorted(pattern_rows, key=lambda row: [str(field) for field in row[:4] + row[5:]])
+
+
+def fields_match(expected, actual, tolerance):
+    if type(expected) is float and type(actual) is float:
+        return math.isclose(expected, actual, rel_tol=tolerance, abs_tol=tolerance)
+    return expected == actual
+
+
+# the (row number, expected row, actual row) of every row that differs, with None for the rows missing from the shorter list
+def compare_rows(expected_rows, actual_rows, tolerance=TOLERANCE):
+    differences = []
+    for i in range(max(len(expected_rows), len(actual_rows))):
+        expected = expected_rows[i] if i < len(expected_rows) else None
+        actual = actual_rows[i] if i < len(actual_rows) else None
+        if expected is None or actual is None or len(expected) != len(actual) or not all([fields_match(e, a, tolerance) for e, a in zip(expected, actual)]):
+            differences.append((i, expected, actual))
+    return differences
+
+
+# classifies the input of a case in a temporary directory and compares what is written with its reference. The result has the case's status
+# (ok, mismatch, known mismatch, missing input or error), its run time in seconds and the differing summary and tile pattern rows
+def run_case(case, tolerance=TOLERANCE):
+    result = {'name': case['name'], 'input_file': case['input_file'], 'reference': case['reference'], 'seconds': 0.0,
+              'summary_differences': [], 'pattern_differences': [], 'note': None}
+    if not os.path.isfile(case['input_file']):
+        result.update(status='missing input', note=case['missing_input'])
+        return result
+    start_time = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory() as output_directory:
+            output_file = classify(case['input_file'], **case['options']).write(output_directory, bin_to_counts_files=False, plot=False)
+            actual_summary, actual_patterns = read_subparsed_tsv(output_file)
+        expected_summary, expected_patterns = read_subparsed_tsv(case['reference'])
+    except Exception as error:
+        result.update(status='error', seconds=time.perf_counter() - start_time, note=f'{type(error).__name__}: {error}')
+        return result
+    result['seconds'] = time.perf_counter() - start_time
+    result['summary_differences'] = compare_rows(expected_summary, actual_summary, tolerance)
+    result['pattern_differences'] = compare_rows(expected_patterns, actual_patterns, tolerance)
+    if not result['summary_differences'] and not result['pattern_differences']:
+        result['status'] = 'ok'
+    elif case['known_mismatch']:
+        result.update(status='known mismatch', note=case['known_mismatch'])
+    else:
+        result['status'] = 'mismatch'
+    return result
+
+
+# runs the cases across workers processes, returning their results in the order of the cases
+def run_cases(cases, workers=WORKERS, tolerance=TOLERANCE):
+    if workers < 1: raise ValueError('the worker count must be at least 1')
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(run_case, cases, [tolerance] * len(cases)))
+
+
+# the report lines of a case's result: its status, run time and name, then its note and first differences
+def format_result(result, shown_differences=SHOWN_DIFFERENCES):
+    lines = [f'{result["status"]:<15}{result["seconds"]:>8.2f}s  {result["name"]}']
+    if result['note']:
+        lines.append(f'    {result["note"]}')
+    for section in ['summary', 'pattern']:
+        differences = result[f'{section}_differences']
+        if differences:
+            lines.append(f'    {len(differences)} {section} rows differ')
+        for i, expected, actual in differences[:shown_differences]:
+            lines.append(f'    row {i} expected: {expected}')
+            lines.append(f'    row {i} actual:   {actual}')
+    return lines
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='VectorSubparserRegression',
+                                    description='Classifies every reference input in a manifest again and compares the results with the reference *.subparsed.tsv files')
+    parser.add_argument('-manifest', type=str, default=MANIFEST_FILE,
+                        help=f'the JSON manifest of inputs, references and options. The default is {os.path.basename(MANIFEST_FILE)}')
+    parser.add_argument('-workers', type=int, default=WORKERS,
+                        help=f'the number of processes classifying cases at once. The default is {WORKERS}')
+    parser.add_argument('-tolerance', type=float, default=TOLERANCE,
+                        help=f'the relative and absolute tolerance of numbers compared. The default is {TOLERANCE}')
+    parser.add_argument('-cases', type=str, nargs='+', default=None,
+                        help='only run the cases whose names contain one of these, e.g. OXB')
+    parser.add_argument('-output_file', type=str, default=None,
+                        help='also write every case\'s result, with all of its differing rows, to this JSON file')
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = GetArguments().parse_args()
+    start_time = time.time()
+    cases = read_manifest(arguments.manifest)
+    if arguments.cases:
+        cases = [case for case in cases if any([name in case['name'] for name in arguments.cases])]
+    if not cases:
+        raise ValueError(f'no cases of {arguments.manifest} were selected')
+    results = run_cases(cases, arguments.workers, arguments.tolerance)
+    for result in results:
+        print('\n'.join(format_result(result)))
+    statuses = [result['status'] for result in results]
+    print(', '.join([f'{statuses.count(status)} {status}' for status in ['ok', 'mismatch', 'known mismatch', 'missing input', 'error'] if status in statuses]))
+    if arguments.output_file:
+        with open(arguments.output_file, 'w') as f:
+            json.dump(results, f, indent=4)
+    print(f'run time: {time.time() - start_time} seconds')
+    if 'mismatch' in statuses or 'error' in statuses:
+        sys.exit(1)
@@ -0,0 +1,45 @@
+import resource
+import sys
+import time
+
+
+# records the wall time of each named stage of a run, and the peak resident memory of the process when each stage ends
+class StageTimer:
+    def __init__(self):
+        self.stages = dict()
+        self._current_stage = None
+        self._stage_start = None
+
+    def start(self, stage_name):
+        if self._current_stage is not None:
+            self.stop()
+        self._current_stage = stage_name
+        self._stage_start = time.perf_counter()
+
+    # ends the current stage, adding to its time if the stage was already run
+    def stop(self):
+        if self._current_stage is None:
+            return
+        elapsed = time.perf_counter() - self._stage_start
+        stage = self.stages.setdefault(self._current_stage, {'seconds': 0.0, 'peak_rss_mb': 0.0})
+        stage['seconds'] += elapsed
+        stage['peak_rss_mb'] = StageTimer.get_peak_rss_mb()
+        self._current_stage = None
+
+    def total_seconds(self):
+        return sum([stage['seconds'] for stage in self.stages.values()])
+
+    # peak resident set size of this process so far; ru_maxrss is in kilobytes on linux and bytes on macOS
+    def get_peak_rss_mb():
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+    # the stages as a dictionary, with the rate each stage processed <lines> lines at if given
+    def report(self, lines=None):
+        self.stop()
+        report = dict()
+        for stage_name, stage in self.stages.items():
+            report[stage_name] = dict(stage)
+            if lines is not None:
+                report[stage_name]['lines_per_second'] = lines / stage['seconds'] if stage['seconds'] else None
+        return report
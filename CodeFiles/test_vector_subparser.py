@@ -3,6 +3,19 @@ import os
 from vector_subparser import *
 from tile_classes import *
 from parse_file import *
+from benchmark import benchmark_file, STAGES
+from classification_service import make_service, shutdown_service, classify_request
+from classifier import classify, classification_settings, get_aggregate_result
+from merge_aggregates import merge_aggregate_files
+from payload_sweep import sweep, get_full_species_proportions
+from quick_qc import quick_classify
+from regression import read_manifest, read_subparsed_tsv, compare_rows, run_case
+from stage_timer import *
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+import unittest.mock
 
 class TestVectorSubParser(unittest.TestCase):
     def test_vector_lexer(self):
@@ -313,6 +326,74 @@ class TestVectorSubParser(unittest.TestCase):
         test_parser.run(TileLine('2 0 Payload[1-100](t) foo[200](f) Payload[1-100](t)'))
         self.assertEqual('other', test_parser._end_state)
 
+    # the category and repeat count given by the grammar alone, parsing the reverse if the pattern is other as run() does
+    def parse_without_shortcuts(self, test_parser, tile_pattern):
+        for data in [tile_pattern, ' '.join(tile_pattern.split()[::-1])]:
+            VectorSubParser._repeat_counter = 0
+            test_parser.parser.parse(data)
+            if test_parser._end_state != 'other':
+                break
+        return test_parser._end_state, VectorSubParser._repeat_counter
+
+    def test_repeat_patterns(self):
+        test_parser = VectorSubParser(VectorLexer())
+        tiles = {'I': 'ITR-FLIP[1-145](t)', 'P': 'Payload[1-100](t)'}
+        # every pattern of up to 12 tokens (adjacent ITR tiles are one token) gets the same results as the grammar
+        patterns = ['I', 'P']
+        for length in range(2, 13):
+            patterns += [pattern + token for pattern in patterns if len(pattern) == length - 1 for token in 'IP' if not (pattern[-1] == 'I' and token == 'I')]
+        for pattern in patterns:
+            tile_pattern = ' '.join([tiles[token] for token in pattern])
+            test_parser.run(tile_pattern)
+            self.assertEqual(self.parse_without_shortcuts(test_parser, tile_pattern), (test_parser._end_state, VectorSubParser._repeat_counter), pattern)
+        self.assertTrue(test_parser.repeat_pattern_count > 0)
+        self.assertEqual(('extended', 2), VectorSubParser.match_repeat_pattern('P AND I AND P AND I AND P AND I'))
+        self.assertEqual(('snapback_selfprime', 1), VectorSubParser.match_repeat_pattern('I AND P AND P AND I AND P AND P AND I'))
+        self.assertIsNone(VectorSubParser.match_repeat_pattern('P AND I AND UNKNOWN_TILE AND P AND I'))
+        self.assertIsNone(VectorSubParser.match_repeat_pattern('I AND P AND I'))
+
+    # long concatemers are classified by their repeat pattern without being parsed, so their time is proportional to their length
+    def test_repeat_pattern_stress(self):
+        test_parser = VectorSubParser(VectorLexer())
+        units = {'extended': 'Payload[1-100](t) ITR-FLIP[1-145](t)', 'truncated_snapback_selfprime': 'Payload[1-100](t) Payload[1-100](f) ITR-FLIP[1-145](t)'}
+        for unit_count in [100, 1000]:
+            for category, unit in units.items():
+                tile_line = TileLine(f'1 1 {" ".join([unit] * unit_count)}')
+                test_parser.parse_cache.clear()
+                repeat_pattern_count = test_parser.repeat_pattern_count
+                parse_count = test_parser.parse_count
+                test_parser.run(tile_line)
+                self.assertEqual(repeat_pattern_count + 1, test_parser.repeat_pattern_count)
+                self.assertEqual(parse_count, test_parser.parse_count)
+                self.assertEqual(category, tile_line.category)
+                self.assertEqual(unit_count - 1, tile_line.repeat_count)
+                tile_line = TileLine(f'1 1 {" ".join([unit] * unit_count)} Payload[1-100](t) Payload[1-100](t) Payload[1-100](t)')
+                test_parser.run(tile_line)
+                self.assertEqual('other', tile_line.category)
+
+    def test_noncanonical_rules(self):
+        test_parser = VectorSubParser(VectorLexer())
+        samples = {'RepCap[1-100](t) Backbone[1-50](f)': 'repcap_no_rAAV', 'Payload[1-100](t) RepCap[1-100](t)': 'repcap_with_payload', 
+                   'ITR-FLIP[1-145](t) RepCap_AAV2[1-100](t) ITR-FLIP[1-145](f)': 'itr_flanked_repcap', 'ITR-FLIP[1-145](t) Payload[1-100](t) RepCap[1-100](t)': 'repcap_with_itr', 
+                   'ITR-FLIP[1-145](t) RepCapX[1-100](t) ITR-FLIP[1-145](f)': 'other'}
+        for tile_pattern, category in samples.items():
+            sample = TileLine(f'2 0 {tile_pattern}')
+            test_parser.run(sample)
+            self.assertEqual(category, sample.category, tile_pattern)
+        self.assertEqual('itr_flanked_repcap', test_parser.lexer.tokenize('ITR-FLIP[1-145](t) RepCap[1-100](t) ITR-FLIP[1-145](f)'))
+        with tempfile.TemporaryDirectory() as rules_directory:
+            rules_file = os.path.join(rules_directory, 'rules.json')
+            with open(rules_file, 'w') as f:
+                json.dump([{'tile': 'Helper', 'category': 'helper_with_payload', 'with': ['Payload']}, {'tile': 'Backbone', 'category': 'backbone'}], f)
+            test_parser = VectorSubParser(VectorLexer(NoncanonicalRules(rules_file)))
+            for tile_pattern, category in {'Helper[1-9](t) Payload[1-100](t)': 'helper_with_payload', 'Helper[1-9](t) Backbone[1-9](t)': 'backbone', 
+                                           'Helper[1-9](t) ITR-FLIP[1-145](t)': 'other', 'RepCap[1-100](t)': 'other'}.items():
+                test_parser.run(tile_pattern)
+                self.assertEqual(category, test_parser._end_state, tile_pattern)
+            with open(rules_file, 'w') as f:
+                json.dump([{'tile': 'Helper', 'category': 'helper variant'}], f)
+            self.assertRaises(ValueError, NoncanonicalRules, rules_file)
+
 
 class TestTile(unittest.TestCase):
     def test_Tile_constructor(self):
@@ -417,6 +498,20 @@ class TestTileLine(unittest.TestCase):
         sample = TileLine('1 1 ITR-FLIP[1-145](t)')
         self.assertFalse(sample.contains_full_payload)
 
+    def test_lazy_tiles(self):
+        Tile.expected_payload_size = 1000
+        test_bins = FileParser('')
+        tile_lines = [test_bins.process_line('5 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)'), 
+                      test_bins.process_line('5 1 ITR-FLIP[1-145](t) Payload[1-500](t) Payload[400-1](f) ITR-FLIP[1-145](t)')]
+        self.assertEqual(['expected', 'snapback'], [tile_line.category for tile_line in tile_lines])
+        self.assertEqual([(1, 1), (0, 2)], [tile_line.full_payload_counts for tile_line in tile_lines])
+        # classifying and writing a tile line doesn't keep its tiles
+        self.assertEqual('snapback\t5.0\t0\t0\tnon_linear\tFalse\tFalse\tFalse\tI AND P AND P AND I\tITR-FLIP[1-145](t) Payload[1-500](t) Payload[400-1](f) ITR-FLIP[1-145](t)', 
+                         str(tile_lines[1]))
+        self.assertTrue(all([tile_line._tile_list is None for tile_line in tile_lines]))
+        self.assertEqual(4, len(tile_lines[1]))
+        self.assertIsNotNone(tile_lines[1]._tile_list)
+
 class TestTileBin(unittest.TestCase):
     def test_TileLineBin_constructor(self):
         # test constructor
@@ -442,6 +537,35 @@ class TestTileBin(unittest.TestCase):
         self.assertEqual(0.99778, round(sample[0].proportion, 5))
         self.assertEqual(1e-5, round(sample[1].proportion, 5))
     
+    def test_top_k(self):
+        Tile.expected_payload_size = 1000
+        counts = [5, 1, 9, 5, 2, 7, 5, 1, 3]
+        tilelines = []
+        for i, count in enumerate(counts):
+            tilelines.append(TileLine(f'{count} 1 Payload[1-{1000 if i % 2 else 10}](t) ITR-FLIP[{i + 1}-145](t)'))
+            tilelines[-1].category = 'foo'
+        all_bin = TileLineBin(tilelines[0])
+        TileLineBin.top_k = 4
+        try:
+            top_bin = TileLineBin(tilelines[0])
+            for tileline in tilelines[1:]:
+                all_bin.add_tileline(tileline)
+                top_bin.add_tileline(tileline)
+        finally:
+            TileLineBin.top_k = None
+        for sample_bin in [all_bin, top_bin]:
+            sample_bin.sort()
+            sample_bin.calculate_tileline_proportions()
+            sample_bin.calculate_full_payload_proportions()
+        # the kept tilelines are the first top_k of every tileline sorted, ties kept in the order they were added
+        self.assertEqual(all_bin.tile_line_list[:4], top_bin.tile_line_list)
+        self.assertEqual([9, 7, 5, 5], [tileline.count for tileline in top_bin])
+        self.assertEqual((all_bin.sequence_count, all_bin.pattern_count, all_bin.full_proportion), (top_bin.sequence_count, top_bin.pattern_count, top_bin.full_proportion))
+        self.assertEqual((5, 5, 12), (top_bin.tail_tileline_count, top_bin.tail_pattern_count, top_bin.tail_sequence_count))
+        self.assertEqual(str(all_bin).splitlines()[:7], str(top_bin).splitlines()[:7])
+        self.assertEqual(f'foo\t12.0\t\t{12 / 38}\t\t\t\t\t\tremaining 5 patterns', str(top_bin).splitlines()[-1])
+        self.assertRaises(ValueError, top_bin.to_aggregate)
+
     def test_calculate_full_proportions(self):
         fulls = TileLine('75 1 Payload[1-1000](t) Payload[1-1000](t)')
         fulls.category = 'foo'
@@ -566,6 +690,285 @@ class TestFileParser(unittest.TestCase):
             self.assertEqual(expected_categories_counts[bin.name], bin.sequence_count, f'test_process_file failed category sequence_count check at key: {bin.name}')
             self.assertEqual(expected_pattern_counts[bin.name], bin.pattern_count, f'test_process_file failed category pattern_count check at key: {bin.name}')
 
+    def test_counters(self):
+        test_bins = FileParser(self.test_file)
+        counters = test_bins.get_counters()
+        self.assertEqual(len(test_bins.unbinned_tilelines), counters['lines']['normal'] + 2 * counters['lines']['U'] + counters['lines']['x 2'] - counters['noncanonical_tile_patterns_skipped'])
+        self.assertEqual(len(test_bins.unbinned_tilelines), counters['parser_calls'] - counters['reversed_parses'] + counters['parse_cache_hits'] 
+                         + counters['repeat_patterns_counted'] + counters['noncanonical_rule_matches'])
+
+    def test_parse_cache(self):
+        bin_list = FileParser('')
+        Tile.expected_payload_size = 1000
+        full_tileline = bin_list.process_line('5 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)')
+        partial_tileline = bin_list.process_line('5 1 ITR-FLIP[1-100](t) Payload[1-500](t) ITR-FLIP[1-145](f)')
+        self.assertEqual(1, bin_list.parser.cache_hit_count)
+        self.assertEqual('expected', full_tileline.category)
+        # coordinate checks are still done on cached tile patterns
+        self.assertEqual('irregular_payload', partial_tileline.category)
+        self.assertEqual(full_tileline.tokenized, partial_tileline.tokenized)
+
+    def test_derivation_tracer(self):
+        tracer = DerivationTracer(max_traces=2, categories=['other'])
+        test_bins = FileParser(self.test_file, tracer=tracer)
+        self.assertEqual(len([tileline for tileline in test_bins.unbinned_tilelines if tileline.category == 'other']), tracer.traced_count)
+        self.assertEqual(2, len(tracer.traces))
+        for tile_pattern, tokenized, derivation, category, repeat_count in tracer.traces:
+            self.assertEqual('other', category)
+            self.assertTrue(derivation[-1].startswith('END_STATE <- '))
+        tracer = DerivationTracer(pattern_regex=r'U|JAKU')
+        test_bins = FileParser('', tracer=tracer)
+        test_bins.process_U_line('1 1 Payload[1-10](f) U Payload[1-10](t) ITR-FLIP[1-145](t) ITR-FLIP[1-145](f)')
+        test_bins.process_line('5 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)')
+        self.assertEqual(0, tracer.traced_count)
+        self.assertIsNone(test_bins.parser._derivation)
+        tracer = DerivationTracer(sample_rate=0.5, seed=2)
+        test_bins = FileParser(self.test_file, tracer=tracer)
+        self.assertTrue(0 < tracer.traced_count < len(test_bins.unbinned_tilelines))
+        with tempfile.TemporaryDirectory() as output_directory:
+            tracer.write(os.path.join(output_directory, 'test.trace.txt'))
+            with open(os.path.join(output_directory, 'test.trace.txt')) as f:
+                self.assertEqual(tracer.traced_count, f.read().count('\nresult: '))
+
+    def test_noncanonical_accounting(self):
+        test_bins = FileParser('')
+        self.assertIsNone(test_bins.process_line('4 1 ITR-FLIP[1-145](t) RepCap[1-900](f) Helper_E4[1-50](t) ITR-FLIP[1-145](t)'))
+        tile_lines = test_bins.process_U_line('2 1 ITR-FLIP[1-145](t) RepCap[1-900](f) U ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)')
+        self.assertIsNone(tile_lines[0])
+        self.assertEqual('expected', tile_lines[1].category)
+        self.assertEqual(2, test_bins.noncanonical_count)
+        self.assertEqual(5, test_bins.noncanonical_sequence_count)
+        self.assertEqual({'RepCap': [2, 5], 'Helper_E4': [1, 4]}, test_bins.noncanonical_tile_counts)
+        self.assertEqual([('RepCap', 5 / 6), ('Helper_E4', 4 / 6)], [(summary['tile_name'], summary['proportion']) for summary in test_bins.get_noncanonical_summaries()])
+        # noncanonical tile patterns are counted the same way when they're classified
+        test_bins = FileParser('', noncanonical_analysis=True)
+        self.assertEqual('other', test_bins.process_line('4 1 ITR-FLIP[1-145](t) Helper_E4[1-50](t) ITR-FLIP[1-145](t)').category)
+        self.assertEqual(0, test_bins.noncanonical_count)
+        self.assertEqual({'Helper_E4': [1, 4]}, test_bins.noncanonical_tile_counts)
+        with tempfile.TemporaryDirectory() as output_directory:
+            test_bins.write_noncanonical(os.path.join(output_directory, 'test.noncanonical.tsv'))
+            with open(os.path.join(output_directory, 'test.noncanonical.tsv')) as f:
+                self.assertEqual(['Helper_E4\t1\t4.0\t1.0', 'Totals\t1\t4.0\t1.0'], f.read().splitlines()[1:])
+
+    def test_aggregates(self):
+        Tile.expected_payload_size = 1000
+        settings = {'payload_size': 1000}
+        test_bins = FileParser(self.test_file)
+        test_bins.bin_tilelines()
+        with open(self.test_file, 'r') as f:
+            lines = f.readlines()
+        aggregates = []
+        for i in range(3):
+            shard_bins = FileParser('')
+            shard_bins.process_lines(lines[i::3])
+            shard_bins.bin_tilelines()
+            aggregates.append(json.loads(json.dumps(shard_bins.to_aggregate([f'shard{i}'], settings))))
+        merged = merge_aggregates([merge_aggregates(aggregates[:2]), aggregates[2]])
+        self.assertEqual(merged, merge_aggregates([aggregates[2], merge_aggregates([aggregates[1], aggregates[0]])]) | {'samples': merged['samples']})
+        self.assertEqual(['shard0', 'shard1', 'shard2'], merged['samples'])
+        self.assertEqual(sum([sum(counters['lines'].values()) for counters in [aggregate['counters'] for aggregate in aggregates]]), sum(merged['counters']['lines'].values()))
+        merged_bins = FileParser.from_aggregate(merged)
+        self.assertEqual([(bin.name, bin.sequence_count, bin.full_proportion) for bin in test_bins.bins_list], 
+                         [(bin.name, bin.sequence_count, bin.full_proportion) for bin in merged_bins.bins_list])
+        # patterns are counted once for each line they were on, as in the unmerged bins
+        self.assertEqual([bin.pattern_count for bin in test_bins.bins_list], [bin.pattern_count for bin in merged_bins.bins_list])
+        self.assertEqual(str(FileParser.from_aggregate(merge_aggregates(aggregates))), str(FileParser.from_aggregate(merge_aggregates(aggregates[::-1]))))
+        aggregates[1]['settings'] = {'payload_size': 2000}
+        self.assertRaises(ValueError, merge_aggregates, aggregates)
+
+    def test_category_writers(self):
+        test_bins = FileParser(self.test_file)
+        add_untileable_sequence_bin(test_bins, self.test_file)
+        test_bins.group_categories(get_category_groups('five'))
+        test_bins.bin_tilelines()
+        with tempfile.TemporaryDirectory() as output_directory:
+            category_writers = CategoryWriters(output_directory, 'streamed', get_category_groups('five'))
+            streamed_bins = FileParser(self.test_file, category_writers=category_writers, keep_raw_data=False)
+            untileable_sequence_tileline = add_untileable_sequence_bin(streamed_bins, self.test_file)
+            category_writers.write(untileable_sequence_tileline.category, untileable_sequence_tileline.raw_data)
+            category_writers.close()
+            self.assertTrue(all([tileline.raw_data is None for tileline in streamed_bins.unbinned_tilelines[:-1]]))
+            self.assertEqual(sorted([bin.name for bin in test_bins.bins_list]), sorted([name.split('.')[1] for name in os.listdir(output_directory)]))
+            for bin in test_bins.bins_list:
+                test_bins.write_bin(os.path.join(output_directory, f'binned.{bin.name}'), bin)
+                with open(os.path.join(output_directory, f'binned.{bin.name}')) as binned, open(os.path.join(output_directory, f'streamed.{bin.name}.tile.zmw.counts')) as streamed:
+                    # sorted when closed into the order the bins are written in, ties included
+                    self.assertEqual(binned.readlines(), streamed.readlines())
+            category_writers = CategoryWriters(output_directory, 'unsorted', sort_lines=False)
+            category_writers.write('foo', '1 1 Payload[1-10](t)')
+            category_writers.write('foo', '2 1 Payload[1-20](t)')
+            category_writers.close()
+            with open(os.path.join(output_directory, 'unsorted.foo.tile.zmw.counts')) as f:
+                self.assertEqual(['1 1 Payload[1-10](t)\n', '2 1 Payload[1-20](t)\n'], f.readlines())
+
+    def test_main_category_files(self):
+        with tempfile.TemporaryDirectory() as output_directory:
+            with unittest.mock.patch('sys.argv', ['parse_file.py', '-input_file', self.test_file, '-output_directory', output_directory, '-payload_size', '1000', 
+                                                  '-sample_name', 'AllSequences', '-untileable_sequences']):
+                main()
+            plt.close('all')
+            # the untileable sequences tileline has no tiles, but is still written with the summary file's count
+            with open(os.path.join(output_directory, 'AllSequences', 'categories', 'AllSequences.untileable_sequences.tile.zmw.counts')) as f:
+                self.assertEqual(['123.0 0\n'], f.readlines())
+
+    def test_main_removes_partial_category_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # the gate stops after the second line, once the first two lines have been written to category files
+            input_file = os.path.join(directory, 'low.tile.zmw.counts')
+            with open(input_file, 'w') as f:
+                f.write('10 1 Payload[1-10](f)\n10 1 ITR-FLIP[1-145](t) ITR-FLIP[1-145](f)\n10 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)\n')
+            with open(os.path.join(directory, 'low.summary'), 'w') as f:
+                f.write('Total sequence code count = 30\n')
+            with unittest.mock.patch('sys.argv', ['parse_file.py', '-input_file', input_file, '-output_directory', directory, '-payload_size', '1000', 
+                                                  '-sample_name', 'low', '-low_fulls_gate', 'abort']):
+                self.assertRaises(ValueError, main)
+            self.assertEqual([], os.listdir(os.path.join(directory, 'low', 'categories')))
+
+    def test_memory_budget(self):
+        test_bins = FileParser(self.test_file)
+        add_untileable_sequence_bin(test_bins, self.test_file)
+        test_bins.bin_tilelines()
+        # binned as they're classified, with at most 2 tilelines of each bin in memory
+        budget_bins = FileParser(self.test_file, memory_budget=2)
+        self.assertEqual(0, len(budget_bins.unbinned_tilelines))
+        add_untileable_sequence_bin(budget_bins, self.test_file)
+        budget_bins.bin_tilelines()
+        other_bin = [bin for bin in budget_bins.bins_list if bin.name == 'other'][0]
+        self.assertTrue(other_bin.spill_runs)
+        self.assertLessEqual(max([len(bin.tile_line_list) for bin in budget_bins.bins_list]), 2)
+        # the spilled runs are merged back into the same output, ties included
+        self.assertEqual(str(test_bins), str(budget_bins))
+        self.assertEqual([bin.full_proportion for bin in test_bins.bins_list], [bin.full_proportion for bin in budget_bins.bins_list])
+
+    def test_top_k_while_reading(self):
+        Tile.expected_payload_size = 1000
+        TileLineBin.top_k = 3
+        try:
+            test_bins = FileParser(self.test_file)
+            add_untileable_sequence_bin(test_bins, self.test_file)
+            test_bins.bin_tilelines()
+            # binned as they're classified, with only the top 3 tilelines of each bin kept, ties included
+            streamed_bins = FileParser(self.test_file, bin_while_reading=True)
+            self.assertEqual(0, len(streamed_bins.unbinned_tilelines))
+            self.assertLessEqual(max([len(bin.top_k_heap) for bin in streamed_bins.bins_list]), 3)
+            add_untileable_sequence_bin(streamed_bins, self.test_file)
+            streamed_bins.bin_tilelines()
+            # tilelines with equal counts are kept as bin_tilelines keeps them, the last read first
+            lines = [f'5 1 ITR-FLIP[1-145](t) Payload[1-{end}](t)' for end in [10, 20, 30, 40]]
+            tie_bins = FileParser('')
+            tie_bins.process_lines(lines)
+            tie_bins.bin_tilelines()
+            streamed_tie_bins = FileParser('', bin_while_reading=True)
+            streamed_tie_bins.process_lines(lines)
+            streamed_tie_bins.bin_tilelines()
+        finally:
+            TileLineBin.top_k = None
+        self.assertEqual(str(test_bins), str(streamed_bins))
+        self.assertEqual(str(tie_bins), str(streamed_tie_bins))
+        self.assertEqual(['Payload[1-40](t)', 'Payload[1-30](t)', 'Payload[1-20](t)'], [tileline.tile_pattern.split()[1] for tileline in streamed_tie_bins.bins_list[0]])
+
+    def test_low_fulls_gate(self):
+        Tile.expected_payload_size = 1000
+        # stops as soon as the sequences left can't bring full species to half, without reading the rest
+        lines = iter(['10 1 Payload[1-10](f)', '10 1 ITR-FLIP[1-145](t) ITR-FLIP[1-145](f)', '10 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)'])
+        self.assertRaises(ValueError, FileParser('', low_fulls_gate=LowFullsGate(30)).process_lines, lines)
+        self.assertEqual(1, len(list(lines)))
+        FileParser('', low_fulls_gate=LowFullsGate(30)).process_lines(['20 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)', '10 1 Payload[1-10](f)'])
+        # AllSequences.counts has 2211 tiled sequences, few of them full species
+        self.assertRaises(ValueError, FileParser, self.test_file, low_fulls_gate=LowFullsGate(2211))
+        gate = LowFullsGate(2211, abort=False)
+        test_bins = FileParser(self.test_file, low_fulls_gate=gate)
+        self.assertTrue(gate.flagged)
+        self.assertEqual(66, len(test_bins.unbinned_tilelines))
+        # once every sequence is read, both bounds are the proportion check_for_low_fulls finds
+        lower, upper = gate.get_bounds(test_bins.input_sequence_count)
+        test_bins.bin_tilelines()
+        full_proportion = sum([bin.proportion for bin in test_bins.bins_list if bin.name in FULL_CATEGORIES])
+        self.assertAlmostEqual(full_proportion, lower)
+        self.assertAlmostEqual(full_proportion, upper)
+
+    def test_check_options(self):
+        # FileParser, and so classify(), rejects the same combinations as the command line
+        self.assertRaises(ValueError, FileParser, '', low_fulls_gate=LowFullsGate(30), collapse_patterns=True)
+        self.assertRaises(ValueError, FileParser, '', memory_budget=0)
+        TileLineBin.top_k = 0
+        try:
+            self.assertRaises(ValueError, FileParser, '')
+        finally:
+            TileLineBin.top_k = None
+        self.assertRaises(ValueError, classify, self.test_file, payload_size=1000, top_k=0)
+        self.assertRaises(ValueError, classify, self.test_file, payload_size=1000, coordinate_buffer=-1)
+        self.assertRaises(ValueError, check_options, top_k=3, aggregate=True)
+        self.assertRaises(ValueError, check_options, stream_input=True, infer_payload_size=True)
+        check_options(6, top_k=3, memory_budget=10, low_fulls_gate='abort')
+        # main checks them before writing anything
+        with tempfile.TemporaryDirectory() as output_directory:
+            with unittest.mock.patch('sys.argv', ['parse_file.py', '-input_file', self.test_file, '-output_directory', output_directory, '-payload_size', '1000', 
+                                                  '-sample_name', 'AllSequences', '-low_fulls_gate', 'abort', '-collapse_patterns']):
+                self.assertRaises(ValueError, main)
+            self.assertEqual([], os.listdir(output_directory))
+
+    def test_collapse_patterns(self):
+        Tile.expected_payload_size = 1000
+        lines = ['10 0.1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)', '5 0.05 ITR-FLIP[2-146](t) Payload[1-999](f) ITR-FLIP[1-145](t)',
+                 '4 0.04 ITR-FLIP[1-145](t) Payload[1-500](f) ITR-FLIP[1-145](t)', '2 0.02 ITR-FLIP[1-145](t) polyA[1-20](t) Payload[1-1000](f) ITR-FLIP[1-145](t)',
+                 '1 0.01 ITR-FLIP[1-145](t) polyT[1-30](f) Payload[1-1000](f) ITR-FLIP[1-145](t)']
+        test_bins = FileParser('', collapse_patterns=True)
+        test_bins.process_lines(lines)
+        # coordinates within the buffer and different homopolymer tiles collapse, a partial payload doesn't
+        self.assertEqual(2, test_bins.collapsed_count)
+        self.assertEqual([15, 4, 3], [tileline.count for tileline in test_bins.unbinned_tilelines])
+        self.assertEqual(['expected', 'irregular_payload', 'expected'], [tileline.category for tileline in test_bins.unbinned_tilelines])
+        self.assertEqual('15 0.1500000 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)', test_bins.unbinned_tilelines[0].raw_data)
+        # the categories, their counts and full payload proportions are the same as without collapsing
+        collapsed_bins = FileParser(self.test_file, collapse_patterns=True)
+        collapsed_bins.bin_tilelines()
+        test_bins = FileParser(self.test_file)
+        test_bins.bin_tilelines()
+        self.assertEqual([(bin.name, bin.sequence_count, bin.full_proportion) for bin in test_bins.bins_list], 
+                         [(bin.name, bin.sequence_count, bin.full_proportion) for bin in collapsed_bins.bins_list])
+
+    def test_stream_input(self):
+        Tile.expected_payload_size = 1000
+        test_bins = FileParser(self.test_file)
+        test_bins.bin_tilelines()
+        self.assertTrue(is_stream_input('-'))
+        self.assertFalse(is_stream_input(self.test_file))
+        with tempfile.TemporaryDirectory() as input_directory:
+            pipe = os.path.join(input_directory, 'pipe')
+            os.mkfifo(pipe)
+            self.assertTrue(is_stream_input(pipe))
+            # the lines are classified as they're written to the named pipe
+            def write_pipe():
+                with open(self.test_file, 'r') as input_file, open(pipe, 'w') as f:
+                    for line in input_file:
+                        f.write(line)
+            writer = threading.Thread(target=write_pipe)
+            writer.start()
+            stream_bins = FileParser(pipe)
+            writer.join()
+            stream_bins.bin_tilelines()
+            self.assertEqual([(bin.name, bin.sequence_count, bin.full_proportion) for bin in test_bins.bins_list],
+                             [(bin.name, bin.sequence_count, bin.full_proportion) for bin in stream_bins.bins_list])
+            self.assertRaises(ValueError, classify, pipe, payload_size=1000)
+
+    def test_infer_payload_size(self):
+        inference = infer_payload_size(self.test_file)
+        self.assertEqual((1000, 500), (inference['payload_size'], inference['runner_up']))
+        self.assertEqual(self.test_file, inference['source'])
+        self.assertGreater(inference['confidence'], 0.9)
+        with tempfile.TemporaryDirectory() as input_directory:
+            input_file = os.path.join(input_directory, 'test.tile.zmw.counts')
+            with open(input_file, 'w') as f:
+                f.write('10 1 ITR-FLIP[1-145](t) Payload_scAAV[1-1000](f) ITR-FLIP[1-145](t)\n')
+            self.assertEqual(1000, infer_payload_size(input_file)['payload_size'])
+            # the tiler's .feats file is used when there is one
+            with open(os.path.join(input_directory, 'test.feats'), 'w') as f:
+                f.write('             Feature Counts\n     Payload[1-1831] 90\n    ITR-FLIP[25-141] 200\n     Payload[5-1828] 10\n   Payload[1-400] 20\n')
+            inference = infer_payload_size(input_file)
+            self.assertEqual((1831, 400, 100 / 120), (inference['payload_size'], inference['runner_up'], inference['confidence']))
+            self.assertEqual(90 / 120, infer_payload_size(input_file, coordinate_buffer=0)['confidence'])
+
     def test_abnormal_payload_name(self):
         test_tileline = '14657 0.0602935 Payload_scAAV[1-100](t) polyA[1-10](t) U ITR-FLIP[21-165](t) Payload_scAAV[1-1831](f) ITR-FLIP[25-141](t) Payload_scAAV[1-1831](t) ITR-FLIP[21-165](f)'
         parser = FileParser('', require_full_payloads_in_expected=False)
@@ -573,5 +976,269 @@ class TestFileParser(unittest.TestCase):
         self.assertEqual('payload_only', lines[0].category)
         self.assertEqual('expected_selfprime', lines[1].category)
 
+
+class TestBenchmark(unittest.TestCase):
+    test_file = f'{os.path.dirname(__file__)}/../DataFiles/Inputs/IntegrationTests/AllSequences.counts'
+
+    def test_stage_timer(self):
+        timer = StageTimer()
+        timer.start('first')
+        timer.start('second')
+        timer.stop()
+        timer.start('first')
+        report = timer.report(lines=10)
+        self.assertEqual(['first', 'second'], list(report.keys()))
+        self.assertAlmostEqual(timer.total_seconds(), report['first']['seconds'] + report['second']['seconds'])
+        self.assertTrue(report['first']['peak_rss_mb'] > 0)
+        self.assertIn('lines_per_second', report['second'])
+
+    def test_benchmark_file(self):
+        with tempfile.TemporaryDirectory() as output_directory:
+            result = benchmark_file(self.test_file, 1000, output_directory)
+            self.assertTrue(os.path.isfile(os.path.join(output_directory, 'AllSequences.subparsed.tsv')))
+            self.assertTrue(os.path.isfile(os.path.join(output_directory, 'AllSequences.subparsed.pdf')))
+        self.assertEqual(STAGES, list(result['stages'].keys()))
+        self.assertEqual(len(FileParser(self.test_file).unbinned_tilelines), result['tile_patterns'])
+        self.assertTrue(result['reversed_parses'] > 0)
+
+
+class TestClassifier(unittest.TestCase):
+    test_file = f'{os.path.dirname(__file__)}/../DataFiles/Inputs/IntegrationTests/AllSequences.counts'
+
+    def test_classify(self):
+        Tile.expected_payload_size = 1000
+        test_bins = FileParser(self.test_file)
+        test_bins.bin_tilelines()
+        Tile.expected_payload_size = 500
+        result = classify(self.test_file, payload_size=1000)
+        # class variables are restored after classifying
+        self.assertEqual(500, Tile.expected_payload_size)
+        self.assertEqual(test_bins.get_bin_summaries(), result.get_summaries())
+        self.assertEqual('AllSequences', result.sample_name)
+        summary_frame, pattern_frame = result.summary_frame(), result.pattern_frame()
+        self.assertEqual(list(summary_frame['category']), [bin.name for bin in test_bins.bins_list])
+        self.assertEqual(sum([bin.pattern_count for bin in test_bins.bins_list]), len(pattern_frame))
+        self.assertAlmostEqual(summary_frame['sequences'].sum(), pattern_frame['count'].sum())
+
+    def test_lazy_properties_after_classify(self):
+        Tile.expected_payload_size = 1000
+        with classification_settings(500):
+            test_bins = FileParser(self.test_file)
+            test_bins.bin_tilelines()
+            expected = [(tileline.linear_status, tileline.contains_full_payload, tileline.full_payload_counts, [tile.is_full for tile in tileline.tile_list])
+                        for bin in test_bins.bins_list for tileline in bin]
+        result = classify(self.test_file, payload_size=500)
+        # made after the class variables are restored, with the payload size the result was classified with
+        self.assertEqual(1000, Tile.expected_payload_size)
+        actual = [(tileline.linear_status, tileline.contains_full_payload, tileline.full_payload_counts, [tile.is_full for tile in tileline.tile_list])
+                  for bin in result.file_parser.bins_list for tileline in bin]
+        self.assertEqual(expected, actual)
+        self.assertTrue(any([full_payload_counts[0] for linear_status, contains_full_payload, full_payload_counts, is_full in actual]))
+        self.assertEqual([row[1] for row in expected], list(result.pattern_frame()['contains_full_payload']))
+
+    def test_classify_in_threads(self):
+        expected = {payload_size: classify(self.test_file, payload_size=payload_size).get_summaries() for payload_size in [500, 1000]}
+        results = dict()
+        threads = [threading.Thread(target=lambda payload_size=payload_size: results.update({payload_size: classify(self.test_file, payload_size=payload_size)}))
+                   for payload_size in [500, 1000]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # each classify call runs with its own settings, not those of the other thread
+        self.assertEqual(expected, {payload_size: result.get_summaries() for payload_size, result in results.items()})
+
+    def test_classify_lines(self):
+        lines = iter(['5 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)\n', '\n', '3 1 ITR-FLIP[1-145](t) Payload[1-900](f) ITR-FLIP[1-145](t)\n'])
+        result = classify(lines, payload_size=1000, group_categories='two')
+        self.assertEqual({'expected': 5, 'other': 3}, dict(zip(result.summary_frame()['category'], result.summary_frame()['sequences'])))
+        result = classify(['3 1 ITR-FLIP[1-145](t) Payload[1-900](f) ITR-FLIP[1-145](t)'], payload_size=900, require_full_payloads=False)
+        self.assertEqual(['expected'], list(result.summary_frame()['category']))
+        self.assertRaises(ValueError, classify, ['3 1 ITR-FLIP[1-145](t) RepCap[1-900](f) ITR-FLIP[1-145](t)'], payload_size=900)
+        self.assertEqual(['itr_flanked_repcap'], list(classify(['3 1 ITR-FLIP[1-145](t) RepCap[1-900](f) ITR-FLIP[1-145](t)'], payload_size=900, 
+                                                  noncanonical_analysis=True).summary_frame()['category']))
+        with classification_settings(100, coordinate_buffer=1):
+            self.assertEqual(100, Tile.expected_payload_size)
+        self.assertEqual(6, Tile.coordinate_buffer)
+
+    def test_classify_top_k(self):
+        result = classify(self.test_file, payload_size=1000, group_categories='five', untileable_sequences=True)
+        top_k_result = classify(self.test_file, payload_size=1000, group_categories='five', untileable_sequences=True, top_k=3)
+        # binned while reading, so that no more than top_k tilelines of a bin are kept
+        self.assertEqual(0, len(top_k_result.file_parser.unbinned_tilelines))
+        self.assertLessEqual(max([len(bin.top_k_heap) for bin in top_k_result.file_parser.bins_list]), 3)
+        self.assertEqual(list(result.summary_frame()['sequences']), list(top_k_result.summary_frame()['sequences']))
+        # each category's other tile patterns are one row, so the counts add up to the summary's
+        pattern_frame = top_k_result.pattern_frame()
+        self.assertAlmostEqual(top_k_result.summary_frame()['sequences'].sum(), pattern_frame['count'].sum())
+        for category, count in top_k_result.summary_frame()[['category', 'sequences']].itertuples(index=False):
+            self.assertAlmostEqual(count, pattern_frame[pattern_frame['category'] == category]['count'].sum())
+        self.assertTrue(pattern_frame['tile_pattern'].str.startswith('remaining ').any())
+
+    def test_write(self):
+        result = classify(self.test_file, payload_size=1000, group_categories='five')
+        with tempfile.TemporaryDirectory() as output_directory:
+            output_file = result.write(output_directory, plot=False)
+            self.assertEqual(os.path.join(output_directory, 'AllSequences', 'AllSequences.subparsed.tsv'), output_file)
+            with open(output_file, 'r') as f:
+                self.assertEqual(str(result.file_parser), f.read())
+            self.assertEqual(len(result.get_summaries()), len(os.listdir(os.path.join(output_directory, 'AllSequences', 'categories'))))
+
+    def test_merge_aggregate_files(self):
+        with tempfile.TemporaryDirectory() as output_directory:
+            with open(self.test_file, 'r') as f:
+                lines = f.readlines()
+            aggregate_files = []
+            for i in range(2):
+                aggregate_files.append(os.path.join(output_directory, f'cell{i}.aggregate.json'))
+                write_aggregate(classify(lines[i::2], payload_size=1000, group_categories='five').to_aggregate(), aggregate_files[-1])
+            output_file = merge_aggregate_files(aggregate_files, output_directory, 'merged', plot=False)
+            result = get_aggregate_result(read_aggregate(os.path.join(output_directory, 'merged', 'merged.aggregate.json')), 'merged')
+            with open(output_file, 'r') as f:
+                self.assertEqual(str(result.file_parser), f.read())
+        self.assertEqual(list(classify(self.test_file, payload_size=1000, group_categories='five').summary_frame()['sequences']), list(result.summary_frame()['sequences']))
+
+    def test_merged_shards_match_direct_run(self):
+        input_file = f'{os.path.dirname(__file__)}/../DataFiles/Inputs/OXB_Data/tiling/bc1012.tile.zmw.counts'
+        parser = VectorSubParser(VectorLexer())
+        with open(input_file, 'r') as f:
+            lines = f.readlines()
+        aggregates = [json.loads(json.dumps(classify(lines[i::3], payload_size=1831, parser=parser).to_aggregate())) for i in range(3)]
+        with tempfile.TemporaryDirectory() as output_directory:
+            direct_file = classify(input_file, payload_size=1831, parser=parser).write(output_directory, bin_to_counts_files=False, plot=False)
+            merged_file = get_aggregate_result(merge_aggregates(aggregates), 'merged').write(output_directory, bin_to_counts_files=False, plot=False)
+            # every summary and tile pattern row, including the tile pattern counts of lines with the same tile pattern
+            direct_summary, direct_patterns = read_subparsed_tsv(direct_file)
+            merged_summary, merged_patterns = read_subparsed_tsv(merged_file)
+            self.assertEqual([], compare_rows(direct_summary, merged_summary))
+            self.assertEqual([], compare_rows(direct_patterns, merged_patterns))
+            with open(direct_file, 'r') as direct, open(merged_file, 'r') as merged:
+                self.assertEqual(len(direct.readlines()), len(merged.readlines()))
+
+    def test_sweep(self):
+        sweep_table = sweep(self.test_file, [900, 1000], [0, 6], group_categories='six')
+        for payload_size in [900, 1000]:
+            for coordinate_buffer in [0, 6]:
+                summary_frame = classify(self.test_file, payload_size=payload_size, coordinate_buffer=coordinate_buffer, group_categories='six').summary_frame()
+                grid_point = sweep_table[(sweep_table['payload_size'] == payload_size) & (sweep_table['coordinate_buffer'] == coordinate_buffer)]
+                self.assertEqual(list(zip(summary_frame['category'], summary_frame['sequences'], summary_frame['patterns'])), 
+                                 list(zip(grid_point['category'], grid_point['sequences'], grid_point['patterns'])))
+                for expected, swept in zip(summary_frame['full_proportion'], grid_point['full_proportion']):
+                    self.assertAlmostEqual(expected, swept)
+        full_species_proportions = get_full_species_proportions(sweep_table)
+        self.assertEqual(1000, full_species_proportions.idxmax()[0])
+        self.assertEqual(0, full_species_proportions[(900, 6)])
+
+    def test_quick_classify(self):
+        summary_frame = classify(self.test_file, payload_size=1000, group_categories='five').summary_frame()
+        proportions = dict(zip(summary_frame['category'], summary_frame['proportion']))
+        full_proportion = sum([proportion for category, proportion in proportions.items() if category in FULL_CATEGORIES])
+        # every tile pattern classified, so the bounds are the proportions
+        parser = VectorSubParser(VectorLexer())
+        quick_table, full_species = quick_classify(self.test_file, 1000, top_coverage=1, group_categories='five', parser=parser)
+        for category, proportion, lower, upper in zip(quick_table['category'], quick_table['proportion'], quick_table['lower'], quick_table['upper']):
+            for estimate in [proportion, lower, upper]:
+                self.assertAlmostEqual(proportions.get(category, 0), estimate)
+        self.assertAlmostEqual(full_proportion, full_species[0])
+        quick_table, full_species = quick_classify(self.test_file, 1000, top_coverage=0.5, group_categories='five')
+        self.assertLessEqual(full_species[1], full_proportion)
+        self.assertGreaterEqual(full_species[2], full_proportion)
+        quick_table, full_species = quick_classify(self.test_file, 1000, sample_size=5000, group_categories='five')
+        self.assertAlmostEqual(1, quick_table['proportion'].sum())
+        self.assertTrue(full_species[1] <= full_proportion <= full_species[2])
+        # categories not classified are still given, bounded by the sequences left, and every category's bounds hold its full run proportion
+        ungrouped_frame = classify(self.test_file, payload_size=1000).summary_frame()
+        ungrouped_proportions = dict(zip(ungrouped_frame['category'], ungrouped_frame['proportion']))
+        quick_table, full_species = quick_classify(self.test_file, 1000, top_coverage=0.5)
+        self.assertEqual(set(CATEGORIES), set(quick_table['category']))
+        unclassified = quick_table[quick_table['patterns'] == 0]
+        self.assertTrue(len(unclassified) > 0)
+        self.assertTrue((unclassified['lower'] == 0).all())
+        self.assertAlmostEqual(1 - quick_table['lower'].sum(), unclassified['upper'].iloc[0])
+        for category, lower, upper in zip(quick_table['category'], quick_table['lower'], quick_table['upper']):
+            self.assertTrue(lower - 1e-9 <= ungrouped_proportions.get(category, 0) <= upper + 1e-9)
+        quick_table, full_species = quick_classify(self.test_file, 1000, sample_size=100, group_categories='two')
+        self.assertEqual(['expected', 'other'], sorted(quick_table['category']))
+        # a full run starting with the parse cache of the quick run doesn't parse again
+        with tempfile.TemporaryDirectory() as output_directory:
+            parse_cache_file = os.path.join(output_directory, 'parse_cache.json')
+            parser.write_parse_cache(parse_cache_file)
+            cached_parser = VectorSubParser(VectorLexer())
+            cached_parser.read_parse_cache(parse_cache_file)
+            cached_result = classify(self.test_file, payload_size=1000, group_categories='five', parser=cached_parser)
+            self.assertEqual(0, cached_parser.parse_count)
+            self.assertEqual(list(summary_frame['proportion']), list(cached_result.summary_frame()['proportion']))
+            self.assertRaises(ValueError, VectorSubParser(VectorLexer(), parse_homopolymers=True).read_parse_cache, parse_cache_file)
+
+    def test_regression(self):
+        with tempfile.TemporaryDirectory() as output_directory:
+            reference = classify(self.test_file, payload_size=1000, group_categories='five', sample_name='AllSequences').write(output_directory, plot=False)
+            manifest_file = os.path.join(output_directory, 'manifest.json')
+            with open(manifest_file, 'w') as f:
+                json.dump([{'name': 'test', 'input_file': os.path.abspath(self.test_file).replace('AllSequences', '{sample}'), 'reference': '{sample}/{sample}.subparsed.tsv',
+                            'options': {'payload_size': 1000, 'group_categories': 'five'}}], f)
+            cases = read_manifest(manifest_file)
+            self.assertEqual(['test AllSequences'], [case['name'] for case in cases])
+            self.assertEqual(os.path.abspath(self.test_file), cases[0]['input_file'])
+            self.assertEqual('ok', run_case(cases[0])['status'])
+            # float noise is allowed, a changed count isn't
+            with open(reference, 'r') as f:
+                lines = f.read().splitlines()
+            fields = lines[1].split('\t')
+            for proportion, status in [(float(fields[2]) + 1e-9, 'ok'), (float(fields[2]) + 0.01, 'mismatch')]:
+                with open(reference, 'w') as f:
+                    f.write('\n'.join([lines[0], '\t'.join([fields[0], fields[1], str(proportion)] + fields[3:])] + lines[2:]) + '\n')
+                self.assertEqual(status, run_case(cases[0])['status'])
+            self.assertEqual('missing input', run_case(dict(cases[0], input_file=os.path.join(output_directory, 'missing.counts')))['status'])
+        # older reference outputs are read too
+        summary_rows, pattern_rows = read_subparsed_tsv(f'{os.path.dirname(__file__)}/../DataFiles/Outputs/IntegrationTests/AllSequences.counts.subparsed.tsv')
+        self.assertEqual(('Totals', 1711.0, 1.0, 58.0), summary_rows[-1])
+        self.assertEqual(58, len(pattern_rows))
+
+
+class TestClassificationService(unittest.TestCase):
+    test_file = f'{os.path.dirname(__file__)}/../DataFiles/Inputs/IntegrationTests/AllSequences.counts'
+
+    def post(self, port, request):
+        http_request = urllib.request.Request(f'http://127.0.0.1:{port}/classify', data=json.dumps(request).encode(), method='POST')
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    def test_classify_request(self):
+        Tile.expected_payload_size = 1000
+        test_bins = FileParser(self.test_file)
+        test_bins.group_categories(get_category_groups('five'))
+        test_bins.bin_tilelines()
+        result = classify_request({'input_file': self.test_file, 'payload_size': 1000, 'group_categories': 'five'})
+        self.assertEqual(test_bins.get_bin_summaries(), result['categories'])
+        with open(self.test_file, 'r') as f:
+            self.assertEqual(result['categories'], classify_request({'lines': f.readlines(), 'payload_size': 1000, 'group_categories': 'five'})['categories'])
+        self.assertRaises(ValueError, classify_request, {'input_file': self.test_file})
+        self.assertRaises(ValueError, classify_request, {'input_file': self.test_file, 'payload_size': 1000, 'payload': 1000})
+
+    def test_service(self):
+        server = make_service(port=0, workers=1)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            status, result = self.post(port, {'input_file': self.test_file, 'payload_size': 1000})
+            self.assertEqual(200, status)
+            self.assertAlmostEqual(1, sum([category['proportion'] for category in result['categories']]))
+            status, result = self.post(port, {'lines': ['5 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)'], 'payload_size': 1000})
+            self.assertEqual([('expected', 5)], [(category['category'], category['sequences']) for category in result['categories']])
+            status, result = self.post(port, {'lines': ['5 1 ITR-FLIP[1-145](t) Payload[1-1000](f) ITR-FLIP[1-145](t)']})
+            self.assertEqual(400, status)
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+                metrics = json.loads(response.read())
+            self.assertEqual(3, metrics['requests'])
+            self.assertEqual(1, metrics['errors'])
+            self.assertTrue(metrics['lines'] > 1)
+            self.assertTrue(metrics['latency_seconds']['p50'] <= metrics['latency_seconds']['max'])
+        finally:
+            shutdown_service(server)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,16 +1,23 @@
 import re
 import copy
+import heapq
+import tempfile
+
+# splits a tile string into its name, coordinates and orientation
+TILE_SPLIT_REGEX = re.compile(r'\[|\]|\(|\)')
 
 
 class Tile:
     coordinate_buffer = 6
     expected_payload_size = 1000
     symbol_usage = False
+    # every (expected_payload_size, coordinate_buffer) pair tile lines have been made with, see get_settings
+    shared_settings = dict()
 
-    def __init__(self, tile_string):
+    # settings is an (expected_payload_size, coordinate_buffer) pair from get_settings, by default the class variables of now
+    def __init__(self, tile_string, settings=None):
         # getting all ITR data as a list, and sorting out NONE to avoid error
-        tile_data = re.split(r'\[|\]|\(|\)', tile_string)
-        tile_data = list(filter(None, tile_data))
+        tile_data = [data for data in TILE_SPLIT_REGEX.split(tile_string) if data]
         # storing data as member variables
         self.name = tile_data[0]
         if '-' in tile_data[1]:
@@ -21,7 +28,13 @@ class Tile:
             self.coordinate_start = int(tile_data[1])
             self.coordinate_end = None
         self.orientation = Tile.reformat_symbol_orientations(tile_data[2])
-        self.set_is_full()
+        self.set_is_full(settings)
+
+    # the expected payload size and coordinate buffer tiles are made with now. Tile lines keep them to make their tiles with later, so the same tuple
+    # is returned for the same settings rather than one for every tile line
+    def get_settings():
+        settings = (Tile.expected_payload_size, Tile.coordinate_buffer)
+        return Tile.shared_settings.setdefault(settings, settings)
     
     # function to make tile counts files with +/- orientations compatable with the subparser, keeps t/f compatability
     def reformat_symbol_orientations(raw_orientation):
@@ -52,10 +65,12 @@ class Tile:
         else:
             return 'both_partial'
 
-    # helper to compare two tile coordinates with respect to the coordinate buffer
-    def coordinates_are_equal(first_coordinate, second_coordinate):
-        if first_coordinate in range(second_coordinate - Tile.coordinate_buffer,
-                                second_coordinate + Tile.coordinate_buffer + 1):
+    # helper to compare two tile coordinates with respect to the coordinate buffer, by default Tile.coordinate_buffer
+    def coordinates_are_equal(first_coordinate, second_coordinate, coordinate_buffer=None):
+        if coordinate_buffer is None:
+            coordinate_buffer = Tile.coordinate_buffer
+        if first_coordinate in range(second_coordinate - coordinate_buffer,
+                                second_coordinate + coordinate_buffer + 1):
             return True
         else:
             return False
@@ -63,11 +78,12 @@ class Tile:
     def name_matches(self, other):
         return self.name == other.name
     
-    def set_is_full(self):
+    def set_is_full(self, settings=None):
         # Payload sizing
+        expected_payload_size, coordinate_buffer = Tile.get_settings() if settings is None else settings
         self.is_full = True
         if 'Payload' in self.name and \
-            (not Tile.coordinates_are_equal(self.coordinate_start, 1) or not Tile.coordinates_are_equal(self.coordinate_end, Tile.expected_payload_size)):
+            (not Tile.coordinates_are_equal(self.coordinate_start, 1, coordinate_buffer) or not Tile.coordinates_are_equal(self.coordinate_end, expected_payload_size, coordinate_buffer)):
             self.is_full = False
 
     # equality operation used during testing
@@ -95,9 +111,10 @@ class Tile:
         return as_string
 
 
-# input is a single line from the input file as a string. If the input is a list, the overload emulation takes over
-# for IsSelfPriming function creating a TileLine with None values for all variables except the tile_list
-# expected_tile_line value default is None for creating the expected plasmid object. 
+# input is a single line from the input file as a string.
+# Only the line's text is kept when it's made: the Tile objects (tile_list) and the flags derived from them (linear_status and contains_full_payload)
+# are made the first time they're used, since most tile patterns are classified from their tile names alone. They're made with the payload size
+# and coordinate buffer the tile line was made with (see Tile.get_settings), so using them after the Tile class variables change gives the same results
 class TileLine:
     def __init__(self, raw_data):
         self.raw_data = raw_data.strip()
@@ -105,24 +122,71 @@ class TileLine:
         self.count = float(data.pop(0))
         self.proportion = 0
         data.pop(0) # not using the old proportion; it is stored in self.raw_data for writing bin files
-        self.tile_list = [Tile(tile) for tile in data]
-        self.linear_status = self.set_linearity()
+        self.tile_pattern = ' '.join(data)
+        # +/- orientations are found here rather than when the tiles are made, so the output uses them even if no tiles were made
+        if '(+)' in self.tile_pattern or '(-)' in self.tile_pattern:
+            Tile.symbol_usage = True
         self.category = None
         self.repeat_count = -1
         self.irregular_itrs = False
         self.contains_polymer = False
         self.snapback_pattern_with_same_strand_payloads = False
-        self.contains_full_payload = self.check_full_payload()
         self.tokenized = 'not lexed'
+        self.tile_settings = Tile.get_settings()
+        # made on first use by the properties below; set here so every tile line has the same attributes, which keeps their memory use down
+        self._tile_list = None
+        self._linear_status = None
+        self._contains_full_payload = None
+        self._full_payload_counts = None
+
+    @property
+    def tile_list(self):
+        if self._tile_list is None:
+            self._tile_list = [Tile(tile, self.tile_settings) for tile in self.tile_pattern.split()]
+        return self._tile_list
+
+    @property
+    def linear_status(self):
+        if self._linear_status is None:
+            self._linear_status = self.set_linearity()
+        return self._linear_status
+
+    # set directly by TileLineBin.from_aggregate
+    @property
+    def contains_full_payload(self):
+        if self._contains_full_payload is None:
+            self._contains_full_payload = self.check_full_payload()
+        return self._contains_full_payload
+
+    @contains_full_payload.setter
+    def contains_full_payload(self, contains_full_payload):
+        self._contains_full_payload = contains_full_payload
+
+    # the number of full payload tiles and the number of payload tiles, which is all that the full payload checks need
+    @property
+    def full_payload_counts(self):
+        if self._full_payload_counts is None:
+            payload_tiles = self.get_tiles('Payload')
+            self._full_payload_counts = (sum([tile.is_full for tile in payload_tiles]), len(payload_tiles))
+        return self._full_payload_counts
+
+    # the tiles, or only those whose names contain name_filter, without keeping them in tile_list if it hasn't been made.
+    # Used by checks that only run once per tile line, so their tiles don't stay in memory
+    def get_tiles(self, name_filter=None):
+        if self._tile_list is not None:
+            return [tile for tile in self._tile_list if name_filter is None or name_filter in tile.name]
+        return [Tile(tile, self.tile_settings) for tile in self.tile_pattern.split() if name_filter is None or name_filter in tile]
     
+    # read from the tile names and orientations in the tile pattern, so no tiles are made
     def set_linearity(self):
         linear_status = None
-        for t in self:
-            if t.name == 'ITR-FLIP':
+        for tile in self.tile_pattern.split():
+            if tile.split('[')[0] == 'ITR-FLIP':
                 continue
-            elif linear_status is None:
-                linear_status = t.orientation
-            elif t.orientation != linear_status:
+            orientation = Tile.reformat_symbol_orientations(tile[tile.rindex('(') + 1:-1])
+            if linear_status is None:
+                linear_status = orientation
+            elif orientation != linear_status:
                 return 'non_linear'
         if linear_status == 't':
             return 'forward_linear'
@@ -133,11 +197,7 @@ class TileLine:
     
     # Determines whether there is any full payload within the tile pattern, returns bool
     def check_full_payload(self):
-        for tile in self:
-            if 'Payload' in tile.name and tile.is_full:
-                return True
-        else:
-            return False
+        return self.full_payload_counts[0] > 0
     
     def __len__(self):
         return len(self.tile_list)
@@ -159,13 +219,22 @@ class TileLine:
             return True
         
     def __str__(self):
-        tile_list_string = ' '.join(str(tile) for tile in self.tile_list)
+        tile_list_string = ' '.join(str(tile) for tile in self.get_tiles())
         r_string = f'{self.category}\t{self.count}\t{self.repeat_count}\t{self.proportion}\t{self.linear_status}\t{self.irregular_itrs}\t{self.contains_polymer}\t{self.contains_full_payload}\t{self.tokenized}\t{tile_list_string}'
         return r_string
 
 
+# the fields of each tile pattern in a TileLineBin aggregate, in order. line_counts is the count of each input line with the tile pattern, highest first
+AGGREGATE_PATTERN_FIELDS = ['count', 'line_counts', 'repeat_count', 'irregular_itrs', 'contains_polymer', 'contains_full_payload', 'tokenized']
+
+
 class TileLineBin:
-    def __init__(self, tileline):
+    # the most tilelines kept in each bin, those with the highest counts; the rest are only counted in the bin's totals and its tail. None keeps all of them
+    top_k = None
+
+    # memory_budget is the most tilelines the bin keeps in memory before spilling them to a sorted temporary run file (see spill); None keeps all of them.
+    # Bins with a memory budget, or made with in_input_order, are filled while classifying (see FileParser.add_tileline), so their tilelines are added in input order
+    def __init__(self, tileline, memory_budget=None, in_input_order=False):
             if tileline.category is None:
                 raise ValueError('None category tileline added to a bin, miscellaneous cases should be marked as other')
             self.name = tileline.category
@@ -173,40 +242,174 @@ class TileLineBin:
             self.proportion = 0
             self.full_proportion = 0
             # don't add one if the tileline has no tiles (it was from untileable_seqeunces)
-            self.pattern_count = 1 if tileline.tile_list else 0
-            self.tile_line_list = [tileline]
+            self.pattern_count = 1 if tileline.tile_pattern else 0
+            # totals of the tilelines not kept when there are more than top_k
+            self.tail_tileline_count = 0
+            self.tail_pattern_count = 0
+            self.tail_sequence_count = 0
+            self.tail_full_count = 0
+            self.memory_budget = memory_budget
+            # the run files written by spill, and the sequences of their tilelines with a full payload
+            self.spill_runs = []
+            self.spilled_full_count = 0
+            # whether tile_line_list is still in the order its tilelines were added in, which sort() changes
+            self.in_input_order = in_input_order or memory_budget is not None
+            if TileLineBin.top_k is None:
+                self.tile_line_list = [tileline]
+                self.top_k_heap = None
+            else:
+                self.tile_line_list = []
+                self.top_k_heap = []
+                self.add_to_top_k(tileline)
 
     # input is a TileLine object; adds tileline to bin and increments sequence and pattern counts
     def add_tileline(self, tileline):
         self.sequence_count += tileline.count
         # don't add one if the tileline has no tiles (it was from untileable_seqeunces)
-        self.pattern_count =  self.pattern_count + 1 if tileline.tile_list else self.pattern_count
-        self.tile_line_list.append(tileline)
+        self.pattern_count =  self.pattern_count + 1 if tileline.tile_pattern else self.pattern_count
+        if self.top_k_heap is None:
+            self.tile_line_list.append(tileline)
+            if self.memory_budget is not None and len(self.tile_line_list) > self.memory_budget:
+                self.spill()
+        else:
+            self.add_to_top_k(tileline)
+
+    # keeps the top_k tilelines with the highest counts in a heap, and adds the one pushed out to the tail. Ties go to those added first as in sort(),
+    # or to those added last when in input order, which sort() reverses. Heap entries are unique by the order they were added in, so tilelines are never compared
+    def add_to_top_k(self, tileline):
+        order = len(self.top_k_heap) + self.tail_tileline_count
+        entry = (tileline.count, order if self.in_input_order else -order, tileline)
+        if len(self.top_k_heap) < TileLineBin.top_k:
+            heapq.heappush(self.top_k_heap, entry)
+            return
+        removed_tileline = heapq.heappushpop(self.top_k_heap, entry)[2]
+        self.tail_tileline_count += 1
+        self.tail_pattern_count += 1 if removed_tileline.tile_pattern else 0
+        self.tail_sequence_count += removed_tileline.count
+        if removed_tileline.contains_full_payload:
+            self.tail_full_count += removed_tileline.count
 
     # sort sequences in bin from highest to lowest sequence count
     def sort(self):
-        self.tile_line_list.sort(key=lambda x: x.count, reverse=True)
+        if self.top_k_heap is not None:
+            self.tile_line_list = [entry[2] for entry in sorted(self.top_k_heap, reverse=True)]
+            return
+        self.tile_line_list = self.get_sorted_tilelines()
+        self.in_input_order = False
+
+    # the tilelines in memory from highest to lowest sequence count. Tilelines with the same count are in the order bin_tilelines adds them in,
+    # the reverse of the input order, so those added in input order are reversed first
+    def get_sorted_tilelines(self):
+        tilelines = self.tile_line_list[::-1] if self.in_input_order else self.tile_line_list
+        return sorted(tilelines, key=lambda x: x.count, reverse=True)
 
-    # calculate proportions of sequences in bins to avoid rounding errors from *.counts file proportions
+    # writes the tilelines in memory to a temporary run file, sorted as sort() would, and empties tile_line_list. Each row has the classification
+    # results of one tileline; its tiles and linearity are made again from its tile pattern when it's read back by read_spill_run.
+    # Run files have no name and are removed when closed or when the process ends
+    def spill(self):
+        run_file = tempfile.TemporaryFile('w+', prefix=f'{self.name}.', suffix='.run')
+        for tileline in self.get_sorted_tilelines():
+            if tileline.contains_full_payload:
+                self.spilled_full_count += tileline.count
+            run_file.write('\t'.join([repr(tileline.count), str(tileline.repeat_count), str(tileline.irregular_itrs), str(tileline.contains_polymer), 
+                                      str(tileline.contains_full_payload), tileline.tokenized, tileline.tile_pattern, tileline.raw_data or '']) + '\n')
+        self.spill_runs.append(run_file)
+        self.tile_line_list = []
+
+    # the tilelines of a run file written by spill, with their proportions of the bin
+    def read_spill_run(self, run_file):
+        run_file.seek(0)
+        for row in run_file:
+            count, repeat_count, irregular_itrs, contains_polymer, contains_full_payload, tokenized, tile_pattern, raw_data = row.rstrip('\n').split('\t')
+            tileline = TileLine(f'{count} 0 {tile_pattern}')
+            tileline.raw_data = raw_data or None
+            tileline.category = self.name
+            tileline.repeat_count = int(repeat_count)
+            tileline.irregular_itrs = irregular_itrs == 'True'
+            tileline.contains_polymer = contains_polymer == 'True'
+            tileline.contains_full_payload = contains_full_payload == 'True'
+            tileline.tokenized = tokenized
+            tileline.proportion = tileline.count / self.sequence_count
+            yield tileline
+
+    # calculate proportions of sequences in bins to avoid rounding errors from *.counts file proportions. Spilled tilelines get theirs as they're read back
     def calculate_tileline_proportions(self):
-        for tileline in self:
+        for tileline in self.tile_line_list:
             tileline.proportion = tileline.count / self.sequence_count
     
     def calculate_full_payload_proportions(self):
-        full_tilelines = 0
-        for tileline in self:
+        full_tilelines = self.tail_full_count + self.spilled_full_count
+        for tileline in self.tile_line_list:
             if tileline.contains_full_payload:
                 full_tilelines += tileline.count
         self.full_proportion = full_tilelines / self.sequence_count
     
     def __getitem__(self, index):
         return self.tile_line_list[int(index)]
+
+    # the tilelines from highest to lowest sequence count. With spilled runs, they're merged with the tilelines in memory one at a time.
+    # On equal counts heapq.merge takes from the earlier iterable first, so the later tilelines come first as in sort()
+    def __iter__(self):
+        if not self.spill_runs:
+            return iter(self.tile_line_list)
+        return heapq.merge(self.tile_line_list, *[self.read_spill_run(run_file) for run_file in reversed(self.spill_runs)], key=lambda x: -x.count)
+
+    # the bin as a serializable partial aggregate: its sequence and full payload counts, and the count and classification results of each tile pattern
+    # keyed by the tile pattern as it was in the input (see AGGREGATE_PATTERN_FIELDS). A tile pattern in the bin more than once (e.g. from both halves
+    # of a U line) is one pattern with the sum of their counts, and the count of each line is kept so that the bin can be made again line for line
+    def to_aggregate(self):
+        if self.tail_tileline_count:
+            raise ValueError(f'the {self.name} bin only kept its top {len(self.tile_line_list)} tile patterns, so it cannot be made into an aggregate')
+        patterns = dict()
+        full_sequences = 0
+        for tileline in self:
+            if tileline.contains_full_payload:
+                full_sequences += tileline.count
+            if tileline.tile_pattern in patterns:
+                patterns[tileline.tile_pattern][0] += tileline.count
+                patterns[tileline.tile_pattern][1].append(tileline.count)
+            else:
+                patterns[tileline.tile_pattern] = [tileline.count, [tileline.count], tileline.repeat_count, tileline.irregular_itrs, tileline.contains_polymer, 
+                                          tileline.contains_full_payload, tileline.tokenized]
+        for pattern in patterns.values():
+            pattern[1].sort(reverse=True)
+        return {'sequences': self.sequence_count, 'full_sequences': full_sequences, 'patterns': patterns}
+
+    # makes a bin from an aggregate made by to_aggregate, without classifying its tile patterns again. Tile patterns are added in sorted order
+    # so the bin is the same however the aggregate was merged, with one tileline for each input line, so its pattern count is that of the lines merged.
+    # The proportions of the bin and its tile patterns still need to be calculated
+    def from_aggregate(name, aggregate, total_sequences):
+        bin = None
+        for tile_pattern in sorted(aggregate['patterns']):
+            count, line_counts, repeat_count, irregular_itrs, contains_polymer, contains_full_payload, tokenized = aggregate['patterns'][tile_pattern]
+            for line_count in line_counts:
+                printed_count = int(line_count) if line_count == int(line_count) else line_count
+                tileline = TileLine(f'{printed_count} {line_count / total_sequences} {tile_pattern}')
+                tileline.category = name
+                tileline.repeat_count = repeat_count
+                tileline.irregular_itrs = irregular_itrs
+                tileline.contains_polymer = contains_polymer
+                tileline.contains_full_payload = contains_full_payload
+                tileline.tokenized = tokenized
+                if bin is None:
+                    bin = TileLineBin(tileline)
+                else:
+                    bin.add_tileline(tileline)
+        return bin
     
+    # the lines of the bin in the output file, without line endings. Tilelines are written one at a time, so spilled runs are never all in memory
+    def get_output_lines(self):
+        printed_proportion = str(round(self.proportion, 5))
+        yield '\t'.join(['Subclassification', 'Sequences', 'Proportion of Sample', 'Tile Patterns', 'Proportion with a Full Payload'])
+        yield '\t'.join([f'{self.name}',f'{self.sequence_count}',f'{printed_proportion}',f'{self.pattern_count}', f'{self.full_proportion}'])
+        yield '\t'.join(['Subclassification','Sequence Count', 'Repeats', f'Proportion of {self.name}', 'Linearity', 'Contains Irregular ITRs', 'Contains Homopolymer', 'Contains a Full Payload', 'Tokenized', 'Tile Pattern'])
+        for tileline in self:
+            yield str(tileline)
+        # one row for all of the tilelines not kept, see top_k
+        if self.tail_tileline_count:
+            yield '\t'.join([self.name, f'{self.tail_sequence_count}', '', f'{self.tail_sequence_count / self.sequence_count}', '', '', '', '', '', 
+                              f'remaining {self.tail_pattern_count} patterns'])
+
     # output bin object to string for output file
     def __str__(self):
-        printed_proportion = str(round(self.proportion, 5))
-        r_string = '\t'.join(['Subclassification', 'Sequences', 'Proportion of Sample', 'Tile Patterns', 'Proportion with a Full Payload']) + '\n'
-        r_string += '\t'.join([f'{self.name}',f'{self.sequence_count}',f'{printed_proportion}',f'{self.pattern_count}', f'{self.full_proportion}']) + '\n'
-        r_string += '\t'.join(['Subclassification','Sequence Count', 'Repeats', f'Proportion of {self.name}', 'Linearity', 'Contains Irregular ITRs', 'Contains Homopolymer', 'Contains a Full Payload', 'Tokenized', 'Tile Pattern']) + '\n' 
-        r_string += '\n'.join([str(tileline) for tileline in self.tile_line_list])
-        return r_string
+        return '\n'.join(self.get_output_lines())
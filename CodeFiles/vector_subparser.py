@@ -1,16 +1,87 @@
 import ply.lex as lex
 import ply.yacc as yacc
 from tile_classes import *
+from collections import deque
+import json
+import os
+import random
+import re
 
+# every category the grammar and its checks classify tile patterns as, other than those of noncanonical rules
+CATEGORIES = ['expected', 'expected_selfprime', 'itr_only', 'payload_only', 'truncated_right', 'truncated_left', 'truncated_selfprime', 'snapback', 'snapback_selfprime',
+              'doubled_payload', 'truncated_sp_IPP', 'truncated_sp_PPI', 'truncated_sp_PIPI', 'truncated_snapback_selfprime', 'extended', 'irregular_payload', 'other']
 EXPECTED_SPECIES = ['expected', 'expected_selfprime']
 SNAPBACK_SPECIES = ['snapback', 'snapback_selfprime']
 TRUNCATED_SNAPBACK_SPECIES = ['truncated_sp_IPP', 'truncated_sp_PPI', 'truncated_snapback_selfprime']
+# the most tile name sequences whose parse results are kept by a VectorSubParser
+PARSE_CACHE_SIZE = 100000
+# the version of the parse cache files written by VectorSubParser.write_parse_cache; files of other versions aren't read
+PARSE_CACHE_VERSION = 1
+# The repeated (concatemer) token patterns of the recursive grammar rules, as (leading tokens, repeated unit, trailing tokens, category).
+# Tile patterns of two or more units are classified by counting their units instead of parsing them, which gives the same category and
+# repeat count (one less than the number of units) as the grammar in linear time without a parse stack as deep as the pattern
+REPEAT_PATTERNS = [('', 'PI', '', 'extended'), ('', 'PI', 'P', 'extended'), ('I', 'PI', '', 'expected_selfprime'), 
+                   ('', 'PPI', '', 'truncated_snapback_selfprime'), ('I', 'PPI', '', 'snapback_selfprime')]
+# the noncanonical rules used when none are given, see NoncanonicalRules
+NONCANONICAL_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'noncanonical_rules.json')
+
+
+# Classifies tile patterns containing noncanonical tiles (RepCap, Backbone, Helper, etc.) by rules read from a JSON file, before they are parsed.
+# The file is a list of rules, each with the tile it applies to and the category given, and optionally the conditions
+#     "with": [tile names that must also be in the tile pattern], "without": [tile names that must not be], 
+#     "flanked_by": a tile name that must be on both sides of the rule's tile
+# The first rule that matches a tile pattern gives its category. A tile name matches a rule's tile name if it's the same before any '_', as in VG_TILES.
+# The rules' tile names are compiled into one regular expression, so a tile pattern is scanned once however many rules there are, and only 
+# tile patterns with one of those tiles are checked against the conditions
+class NoncanonicalRules:
+    rule_keys = ['tile', 'category', 'with', 'without', 'flanked_by']
+
+    def __init__(self, rules_file=NONCANONICAL_RULES_FILE):
+        self.rules_file = rules_file
+        with open(rules_file, 'r') as f:
+            self.rules = json.load(f)
+        if type(self.rules) is not list:
+            raise ValueError(f'the noncanonical rules file {rules_file} must contain a list of rules')
+        for rule in self.rules:
+            if type(rule) is not dict or 'tile' not in rule or 'category' not in rule:
+                raise ValueError(f'noncanonical rule {rule} in {rules_file} must have a tile and a category')
+            if set(rule) - set(NoncanonicalRules.rule_keys):
+                raise ValueError(f'noncanonical rule {rule} in {rules_file} has unknown keys {sorted(set(rule) - set(NoncanonicalRules.rule_keys))}')
+            if not re.fullmatch(r'\w+', rule['category']):
+                raise ValueError(f'the category of noncanonical rule {rule} in {rules_file} must only contain letters, digits and underscores')
+        tile_names = sorted(set([rule['tile'] for rule in self.rules]))
+        self.regex = re.compile(r'(?:^|\s)(?:' + '|'.join([re.escape(tile_name) for tile_name in tile_names]) + r')[_\[]') if tile_names else None
+        self.categories = list(dict.fromkeys([rule['category'] for rule in self.rules]))
+
+    # the category of the first rule matching the tile pattern, or None if no rule matches
+    def match(self, tile_pattern):
+        if self.regex is None or not self.regex.search(tile_pattern):
+            return None
+        tile_names = [tile.split('[', 1)[0].split('_')[0] for tile in tile_pattern.split()]
+        for rule in self.rules:
+            if NoncanonicalRules.rule_matches(rule, tile_names):
+                return rule['category']
+        return None
+
+    def rule_matches(rule, tile_names):
+        if rule['tile'] not in tile_names:
+            return False
+        if any([tile_name not in tile_names for tile_name in rule.get('with', [])]):
+            return False
+        if any([tile_name in tile_names for tile_name in rule.get('without', [])]):
+            return False
+        if 'flanked_by' in rule:
+            return any([tile_name == rule['tile'] and rule['flanked_by'] in tile_names[:i] and rule['flanked_by'] in tile_names[i + 1:] 
+                        for i, tile_name in enumerate(tile_names)])
+        return True
 
 
 class VectorLexer:
-    def __init__(self):
+    # noncanonical_rules is a NoncanonicalRules object; the rules in NONCANONICAL_RULES_FILE are used by default
+    def __init__(self, noncanonical_rules=None):
         self.lexer = lex.lex(module=self)
         self.irregular_itrs = False
+        self.noncanonical_rules = noncanonical_rules if noncanonical_rules is not None else NoncanonicalRules()
     
     # return flag, reset it to false before since same lexer object used for all parsing
     def get_irreg_itr_flag(self):
@@ -22,41 +93,11 @@ class VectorLexer:
         'P',
         'AND',
         'I',
-    # These tokens are for RepCap Variants
-        'repcap_no_rAAV',
-        'repcap_with_payload',
-        'repcap_with_itr',
-        'itr_flanked_repcap'
     )
 
     t_P = r'(Payload)\S*'
     t_AND = r'\s'
     
-    # This token function is an example of how to classify tile patterns before parsing for noncanonical classifications. The same could be replicated for any tile such as Backbone, Helper, etc.
-    # By doing this, more classifications can be added without conflicting with the canonical grammar or requiring combinatorial explosion of grammar rules
-    # each token maps to a terminal token that goes right to the end state in the parser. 
-    # IMPORTANT: For classifications meant to essentially override the CFG, the lex function needs to be over the others as that is how PLY determines lex function priority
-    # For example, putting the t_I function above this one would result in itr_flanked_repcap never occurring as ITRs are tokenized already.
-    def t_RepCap(self, t):
-        r'.*(RepCap).*'
-        tilenames = [tile.split('[')[0] for tile in t.value.split()]
-        if 'ITR-FLIP' not in tilenames and 'Payload' not in tilenames:
-            t.type = 'repcap_no_rAAV'
-            t.value = 'repcap_no_rAAV'
-        elif 'ITR-FLIP' not in tilenames:
-            t.type = 'repcap_with_payload'
-            t.value = 'repcap_with_payload'
-        else:
-            for i, tilename in enumerate(tilenames):
-                if tilename == 'RepCap' and 'ITR-FLIP' in tilenames[0:i] and 'ITR-FLIP' in tilenames[i:]:
-                    t.type = 'itr_flanked_repcap'
-                    t.value = 'itr_flanked_repcap'
-                    break
-            else:
-                t.type = 'repcap_with_itr'
-                t.value = 'repcap_with_itr'
-        return t
-    
     # combine adjacent ITR tiles into one I token, raise irregular_itrs flag
     def t_I(self, t):
         r'(ITR-FLIP\S*)(\s+ITR-FLIP\S*)*'
@@ -85,12 +126,55 @@ class VectorLexer:
         return test_list
     
     # simplifies output of test() to only tokens used to output tokenized versions of tile patterns to the output data file. 
+    # Tile patterns matching a noncanonical rule are a single token, the rule's category
     def tokenize(self, data):
+        noncanonical_category = self.noncanonical_rules.match(data)
+        if noncanonical_category is not None:
+            return noncanonical_category
         output_detailed = self.test(data)
         return ' '.join([lex_dictionary['type'] for lex_dictionary in output_detailed]) # if lex_dictionary['type'] != 'AND'])
         
 
 
+# Keeps the parse derivations of selected tile patterns in a ring buffer of the last max_traces selected, to be written to a file
+# once parsing is done. Patterns are selected at sample_rate, optionally only those matching pattern_regex, and are only kept
+# if their final category is in categories (all categories if None). Unselected patterns are parsed without any tracing
+class DerivationTracer:
+    def __init__(self, max_traces=1000, sample_rate=1.0, categories=None, pattern_regex=None, seed=None):
+        if not 0 < sample_rate <= 1: raise ValueError('the trace sample rate must be greater than 0 and at most 1')
+        if max_traces < 1: raise ValueError('at least one trace must be kept')
+        self.traces = deque(maxlen=max_traces)
+        self.sample_rate = sample_rate
+        self.categories = set(categories) if categories else None
+        self.pattern_regex = re.compile(pattern_regex) if pattern_regex else None
+        self.random = random.Random(seed)
+        self.traced_count = 0
+
+    # decides, before parsing, whether a tile pattern's derivation is recorded
+    def select(self, tile_pattern):
+        if self.pattern_regex is not None and not self.pattern_regex.search(tile_pattern):
+            return False
+        return self.sample_rate == 1 or self.random.random() < self.sample_rate
+
+    def keeps_category(self, category):
+        return self.categories is None or category in self.categories
+
+    # keeps a recorded derivation if the tile line's category is selected
+    def add(self, tile_line, derivation):
+        if not self.keeps_category(tile_line.category):
+            return
+        self.traced_count += 1
+        self.traces.append((tile_line.raw_data, tile_line.tokenized, derivation, tile_line.category, tile_line.repeat_count))
+
+    def write(self, output_file):
+        with open(output_file, 'w') as f:
+            f.write(f'{self.traced_count} derivations traced, the last {len(self.traces)} are kept\n\n')
+            for tile_pattern, tokenized, derivation, category, repeat_count in self.traces:
+                f.write(f'{tile_pattern}\ntokens: {tokenized}\n')
+                f.write(''.join([f'    {step}\n' for step in derivation]))
+                f.write(f'result: {category} (repeats: {repeat_count})\n\n')
+
+
 class VectorSubParser:
     precedence = (('right', 'AND'),)
     expected_species_have_only_full_payloads = True
@@ -99,7 +183,7 @@ class VectorSubParser:
     _repeat_counter = -1
 
 	# initialize the parser with arguments. The lexer is also instantiated
-    def __init__(self, lexer, require_full_payloads_in_expected=True, debug=False, parse_homopolymers=False):
+    def __init__(self, lexer, require_full_payloads_in_expected=True, debug=False, parse_homopolymers=False, tracer=None):
         self.tokens = lexer.tokens
         self.lexer = lexer
         # doesn't write the parsetab.py file since the table is small, negligible time is added
@@ -109,6 +193,42 @@ class VectorSubParser:
         self.parse_homopolymers = parse_homopolymers
         # whether or not to print debug output for parsing
         self.debug = debug
+        # optional DerivationTracer; parsing steps are recorded by parsing_debug_message while _derivation is a list
+        self.tracer = tracer
+        self._derivation = None
+        self.trace_derivation = debug
+        # Parse results depend only on the sequence of tile names, so they're cached by it. Coordinate checks (check_snapback and check_expected)
+        # are still run for every tile line. The cache is unused when debugging so every parse is printed
+        self.parse_cache = dict()
+        # counters reported by parse_file.py's -profile option
+        self.parse_count = 0
+        self.reversed_parse_count = 0
+        self.error_count = 0
+        self.cache_hit_count = 0
+        self.repeat_pattern_count = 0
+        self.noncanonical_rule_count = 0
+
+    # the parse cache along with the settings its parse results depend on, so that a later run with the same settings (e.g. a full run after
+    # quick_qc.py) can start with the tile patterns already classified. Coordinate checks are still run on every tile line, so the payload size
+    # and coordinate buffer can differ
+    def get_parse_cache_settings(self):
+        return {'parse_cache_version': PARSE_CACHE_VERSION, 'parse_homopolymers': self.parse_homopolymers, 'noncanonical_rules': self.lexer.noncanonical_rules.rules}
+
+    def write_parse_cache(self, output_file):
+        with open(output_file, 'w') as f:
+            json.dump(dict(self.get_parse_cache_settings(), patterns=[[list(cache_key), list(parse_results)] for cache_key, parse_results in self.parse_cache.items()]), f)
+
+    # adds the parse results of a file written by write_parse_cache, which must have been made with the same settings
+    def read_parse_cache(self, input_file):
+        with open(input_file, 'r') as f:
+            parse_cache = json.load(f)
+        for setting, value in self.get_parse_cache_settings().items():
+            if parse_cache.get(setting) != value:
+                raise ValueError(f'the parse cache {input_file} was made with a different {setting} ({parse_cache.get(setting)}, not {value}), so it cannot be used')
+        for cache_key, parse_results in parse_cache['patterns']:
+            if len(self.parse_cache) >= PARSE_CACHE_SIZE:
+                break
+            self.parse_cache[tuple(cache_key)] = tuple(parse_results)
         
     # The main function of the subparser
     def run(self, tile_line):
@@ -121,25 +241,89 @@ class VectorSubParser:
         if not self.parse_homopolymers:
             if 'poly' in formatted_data: tile_line.contains_polymer = True
             formatted_data = ' '.join([tile for tile in formatted_data.split() if 'poly' not in tile])
-        if self.debug: print(f'data input into parser: |{self.lexer.tokenize(formatted_data)}|')
-        # running subparser
-        self.parser.parse(formatted_data)  # !! this line does the actual parsing
+        selected = self.tracer is not None and type(tile_line) is not str and self.tracer.select(formatted_data)
+        cache_key = None
+        if type(tile_line) is not str and not self.debug:
+            cache_key = tuple([tile.split('[')[0] for tile in tile_line.tile_pattern.split() if self.parse_homopolymers or 'poly' not in tile])
+            if cache_key in self.parse_cache:
+                self.cache_hit_count += 1
+                self.set_tile_line_results(tile_line, *self.parse_cache[cache_key])
+                # cached tile patterns are only parsed again if their derivation will be kept
+                if not selected or not self.tracer.keeps_category(tile_line.category):
+                    return
+                VectorSubParser._repeat_counter = 0
+        self._derivation = [] if selected else None
+        self.trace_derivation = self.debug or selected
+        tokenized = self.lexer.tokenize(formatted_data)
+        if self.debug: print(f'data input into parser: |{tokenized}|')
+        # tile patterns matching a noncanonical rule are given its category without being parsed
+        noncanonical_category = self.lexer.noncanonical_rules.match(formatted_data)
+        if noncanonical_category is not None:
+            self.noncanonical_rule_count += 1
+            self._end_state = noncanonical_category
+            if self.trace_derivation: self.parsing_debug_message(noncanonical_category, shortcut='noncanonical rule')
+        elif not self.run_repeat_pattern(tokenized):
+            # running subparser
+            self.parse_count += 1
+            self.parser.parse(formatted_data)  # !! this line does the actual parsing
         # if the category is other, try flipping it (to catch missing ITR on right end) (ex: ITR Payload Payload ITR Payload Payload)
         if self._end_state == 'other':
-            if self.debug: print(f'parsing failed for pattern:\n{formatted_data.split()}\nparsing the reverse:\n{self.lexer.tokenize(" ".join(formatted_data.strip().split()[::-1]))}')
+            reversed_data = ' '.join(formatted_data.strip().split()[::-1])
+            if self.debug: print(f'parsing failed for pattern:\n{formatted_data.split()}\nparsing the reverse:\n{self.lexer.tokenize(reversed_data)}')
+            if self._derivation is not None: self._derivation.append(f'parsing failed, parsing the reverse: {self.lexer.tokenize(reversed_data)}')
             VectorSubParser._repeat_counter = 0
-            self.parser.parse(' '.join(formatted_data.strip().split()[::-1]))  # !!this line does the actual parsing on the reverse of the tile pattern
+            self.reversed_parse_count += 1
+            if not self.run_repeat_pattern(' AND '.join(tokenized.split(' AND ')[::-1])):
+                self.parse_count += 1
+                self.parser.parse(reversed_data)  # !!this line does the actual parsing on the reverse of the tile pattern
         # do checks on patterns outside of the grammar's scope: full payloads in expecteds and reverse complementary adjacent payloads in snapbacks
         # then finally add the final classification from end_state to the tileline object as its category field along with the repeat_count for differentiation of recursive patterns
         if self.debug: print(f'parsing complete; result: {self._end_state}')
         if self.debug: print(f'repeat counter result: {VectorSubParser._repeat_counter}\n\n')
         if type(tile_line) is not str:  # if not a test
-            self.check_snapback(tile_line)
-            self.check_expected(tile_line)
-            tile_line.category = self.get_end_state()
-            tile_line.repeat_count = self.get_repeat_count()
-            tile_line.tokenized = self.lexer.tokenize(formatted_data)
-            tile_line.irregular_itrs = self.lexer.get_irreg_itr_flag()
+            parse_results = (self._end_state, VectorSubParser._repeat_counter, tokenized, self.lexer.get_irreg_itr_flag())
+            if cache_key is not None and len(self.parse_cache) < PARSE_CACHE_SIZE:
+                self.parse_cache[cache_key] = parse_results
+            self.set_tile_line_results(tile_line, *parse_results)
+            if self._derivation is not None:
+                self.tracer.add(tile_line, self._derivation)
+                self._derivation = None
+
+    # helper for run()
+    # sets the end state and repeat count of a tokenized tile pattern made of repeated units (see REPEAT_PATTERNS) without parsing it.
+    # Returns whether it was one, otherwise it's left to the parser
+    def run_repeat_pattern(self, tokenized):
+        repeat_pattern = VectorSubParser.match_repeat_pattern(tokenized)
+        if repeat_pattern is None:
+            return False
+        self.repeat_pattern_count += 1
+        self._end_state, VectorSubParser._repeat_counter = repeat_pattern
+        if self.trace_derivation: self.parsing_debug_message(self._end_state, shortcut=f'{VectorSubParser._repeat_counter + 1} repeated units')
+        return True
+
+    # the category and repeat count of a tokenized tile pattern (e.g. 'P AND I AND P AND I') made of two or more repeated units, or None if it isn't one
+    def match_repeat_pattern(tokenized):
+        tokens = tokenized.split(' AND ')
+        if any([token != 'I' and token != 'P' for token in tokens]):
+            return None
+        tokens = ''.join(tokens)
+        for leading_tokens, unit, trailing_tokens, category in REPEAT_PATTERNS:
+            units, remainder = divmod(len(tokens) - len(leading_tokens) - len(trailing_tokens), len(unit))
+            if units >= 2 and remainder == 0 and tokens == leading_tokens + unit * units + trailing_tokens:
+                return category, units - 1
+        return None
+
+    # helper for run()
+    # runs the coordinate checks on the parse results, then stores the results in the tileline
+    def set_tile_line_results(self, tile_line, end_state, repeat_count, tokenized, irregular_itrs):
+        self._end_state = end_state
+        VectorSubParser._repeat_counter = repeat_count
+        self.check_snapback(tile_line)
+        self.check_expected(tile_line)
+        tile_line.category = self.get_end_state()
+        tile_line.repeat_count = self.get_repeat_count()
+        tile_line.tokenized = tokenized
+        tile_line.irregular_itrs = irregular_itrs
 
     # The seperated lower rules are for noncannonical classifications. They map directly to a token from the lexer and override the normal CFG for cannonical classifications
     def p_end(self, p):
@@ -157,14 +341,9 @@ class VectorSubParser:
              | expected_selfprime
              | truncated_snapback_selfprime
              | snapback_selfprime
-             | other
-             
-             | repcap_no_rAAV
-             | repcap_with_payload
-             | repcap_with_itr
-             | itr_flanked_repcap'''
+             | other'''
         self._end_state = p[1]
-        if self.debug: self.parsing_debug_message(p, complete=True)
+        if self.trace_derivation: self.parsing_debug_message(p, complete=True)
     
     def p_other(self, p):
         '''other : error
@@ -174,47 +353,47 @@ class VectorSubParser:
     def p_payload_only(self, p):
         '''payload_only : P'''
         p[0] = 'payload_only'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     def p_itr_only(self, p):
         '''itr_only : I'''
         p[0] = 'itr_only'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
         
     def p_doubled_payload(self, p):
         '''doubled_payload : P AND P'''
         p[0] = 'doubled_payload'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     def p_truncated_right(self, p):
         '''truncated_right : I AND P'''
         p[0] = 'truncated_right'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     def p_truncated_left(self, p):
         '''truncated_left : P AND I'''
         p[0] = 'truncated_left'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
         
     def p_truncated_sp_PPI(self, p):
         '''truncated_sp_PPI : P AND P AND I'''
         p[0] = 'truncated_sp_PPI'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     def p_truncated_sp_IPP(self, p):
         '''truncated_sp_IPP : I AND P AND P'''
         p[0] = 'truncated_sp_IPP'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     def p_expected(self, p):
         '''expected : I AND truncated_left'''
         p[0] = 'expected'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
         
     def p_truncated_selfprime(self, p):
         '''truncated_selfprime : truncated_left AND P'''
         p[0] = 'truncated_selfprime'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
 
     def p_extended(self, p):
         '''extended : truncated_sp_PIPI
@@ -224,40 +403,41 @@ class VectorSubParser:
         if p[1] != 'truncated_sp_PIPI':
             VectorSubParser._repeat_counter += 1
         p[0] = 'extended'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     def p_truncated_sp_PIPI(self, p):
         '''truncated_sp_PIPI : truncated_left AND truncated_left
                              | truncated_sp_PIPI AND truncated_left'''
         VectorSubParser._repeat_counter += 1
         p[0] = 'truncated_sp_PIPI'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
 
     def p_snapback(self, p):
         '''snapback : I AND truncated_sp_PPI'''
         p[0] = 'snapback'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
 
     def p_expected_selfprime(self, p):
         '''expected_selfprime : I AND truncated_sp_PIPI'''
         p[0] = 'expected_selfprime'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
 
     def p_truncated_snapback_selfprime(self, p):
         '''truncated_snapback_selfprime : truncated_sp_PPI AND truncated_sp_PPI
                                         | truncated_sp_PPI AND truncated_snapback_selfprime'''
         VectorSubParser._repeat_counter += 1
         p[0] = 'truncated_snapback_selfprime'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
 
     def p_snapback_selfprime(self, p):
         '''snapback_selfprime : I AND truncated_snapback_selfprime'''
         p[0] = 'snapback_selfprime'
-        if self.debug: self.parsing_debug_message(p)
+        if self.trace_derivation: self.parsing_debug_message(p)
     
     # Anything tile pattern that doesn't fit the grammar will be classified as 'other'
     def p_error(self, p):
-        if self.debug: self.parsing_debug_message(p, error=True)
+        self.error_count += 1
+        if self.trace_derivation: self.parsing_debug_message(p, error=True)
         self.parser.restart()
         self.parser.parse('')
     
@@ -284,7 +464,7 @@ class VectorSubParser:
         if self._end_state not in SNAPBACK_SPECIES and self._end_state not in TRUNCATED_SNAPBACK_SPECIES:
             return
         is_snapbacks = []
-        tile_pattern = tile_line.tile_list
+        tile_pattern = tile_line.get_tiles()
         if not self.parse_homopolymers:
             tile_pattern = [tile for tile in tile_pattern if 'poly' not in tile.name]
         for i, tile in enumerate(tile_pattern):
@@ -313,22 +493,28 @@ class VectorSubParser:
     def check_expected(self, tile_line):
         if self._end_state not in EXPECTED_SPECIES or not VectorSubParser.expected_species_have_only_full_payloads:
             return
-        for tile in tile_line:
-            if tile.is_full == False:
-                self._end_state = 'irregular_payload'
-                return
+        # only payload tiles can be partial
+        full_payloads, payloads = tile_line.full_payload_counts
+        if full_payloads < payloads:
+            self._end_state = 'irregular_payload'
     
-    # message printed from parsing steps when debug is set to true
-    def parsing_debug_message(self, p, error=False, complete=False):
-        if complete:
-            print(f'END_STATE <- {p[1:]} repeats: {self._repeat_counter}')
+    # message printed from parsing steps when debug is set to true, and recorded when the derivation is being traced
+    def parsing_debug_message(self, p, error=False, complete=False, shortcut=None):
+        if shortcut is not None:
+            message = f'END_STATE <- {p} ({shortcut})'
+        elif complete:
+            message = f'END_STATE <- {p[1:]} repeats: {self._repeat_counter}'
         elif error:
-            print(f'error while parsing {p}, setting result to other')
+            message = f'error while parsing {p}, setting result to other'
         else:
             p = list(p)
             for i, item in enumerate(p):
                 if item == ' ': p[i] = 'AND'
-            print(f'{p[0]} <- {p[1:]} repeats: {self._repeat_counter}')
+            message = f'{p[0]} <- {p[1:]} repeats: {self._repeat_counter}'
+        if self._derivation is not None:
+            self._derivation.append(message)
+        if self.debug:
+            print(message)
 
 # use this block for debugging the vector subparsing module by setting sample to the desired input
 # accepts a list of tile names, a raw tile pattern string or a list of tileline objects
@@ -0,0 +1,225 @@
+from Subparser_In_Silico import *
+import numpy as np
+
+
+# Writes tile pattern counts files (the tiler's *.tile.zmw.counts output) straight from the subparser table, without generating
+# sequences or running the tiler, along with a labels file giving the category each line was generated as.
+# Every table row is built at the tile level with the same arguments the Vector class takes (repeatable, repeat_itrs, snapback,
+# irregular_payload), so millions of lines can be made in minutes for load testing parse_file.py
+
+LINES = 1000000
+# each chunk of lines gets its own seed; changing it changes the output lines
+LINES_PER_CHUNK = 50000
+OUTPUT_DIR = '../DataFiles/Inputs/InSilicoData/counts/'
+SAMPLE_NAME = 'synthetic'
+# the count of the first line; line i (from 1) has a count of TOP_COUNT / i^ZIPF_EXPONENT, at least 1, so counts descend like the tiler's
+TOP_COUNT = 10000
+ZIPF_EXPONENT = 1.0
+# tile coordinates are moved by up to this many bases, kept within the parser's default coordinate buffer (6)
+COORDINATE_JITTER = 3
+# the tiles the tiler gives the attributes of Inputs/InSilicoAAV.fasta, as (name, start, end, orientation) read from the forward strand.
+# The payload's end is the payload size
+ELEMENT_TILES = {'L': ('ITR-FLIP', 1, 145, '-'), 'R': ('ITR-FLIP', 21, 165, '-'), 'C': ('ITR-FLIP', 1, 165, '+'), 'P': ('Payload', 1, None, '+')}
+# table rows named after a species rather than a parser category
+ROW_CATEGORIES = {'extended_species_endITR': 'extended', 'extended_species_startITR': 'extended', 'extended_species_bothITR': 'extended'}
+# categories named by the order their tiles are read in, which swap when the molecule is read from its reverse strand
+REVERSE_STRAND_CATEGORIES = {'truncated_right': 'truncated_left', 'truncated_left': 'truncated_right', 
+                             'truncated_sp_IPP': 'truncated_sp_PPI', 'truncated_sp_PPI': 'truncated_sp_IPP'}
+
+
+def get_row_category(csv_row, reverse_strand=False):
+    category = ROW_CATEGORIES.get(csv_row[0], csv_row[0])
+    return REVERSE_STRAND_CATEGORIES.get(category, category) if reverse_strand else category
+
+
+# tile-level equivalent of Vector.generate_repeats
+def get_repeated_pattern(pattern, args):
+    if 'repeatable' not in args:
+        return pattern
+    repeat_arg_index = args.index('repeatable')
+    if len(args) < repeat_arg_index + 2 or not str(args[repeat_arg_index + 1]).isdigit():
+        raise ValueError('the argument after "repeatable" must contain the index of the attribute to repeat')
+    repeat_attribute_start = int(args[repeat_arg_index + 1])
+    repeat_attribute_end = len(pattern)
+    if len(args) >= repeat_arg_index + 3 and str(args[repeat_arg_index + 2]).isdigit():
+        repeat_attribute_end = int(args[repeat_arg_index + 2])
+    repeat_count = round(random.uniform(1, 5))
+    return pattern[:repeat_attribute_start] + (pattern[repeat_attribute_start:repeat_attribute_end] * repeat_count) + pattern[repeat_attribute_end:]
+
+
+# tile-level equivalent of Vector.generate_snapback: the two payload pieces, with the one nearer the payload's end reversed
+def get_snapback_tiles(payload_size):
+    snapback_sizes = Vector.get_random_snapback_sizes()
+    if snapback_sizes[0] == snapback_sizes[1]:
+        if snapback_sizes[1] == payload_size:
+            snapback_sizes[0] -= 1
+        else:
+            snapback_sizes[1] += 1
+    if snapback_sizes[2] == snapback_sizes[3]:
+        if snapback_sizes[3] == payload_size:
+            snapback_sizes[2] -= 1
+        else:
+            snapback_sizes[3] += 1
+    if abs(1 - snapback_sizes[0]) <= abs(payload_size - snapback_sizes[1]):
+        orientations = ('+', '-')
+    else:
+        orientations = ('-', '+')
+    return [('Payload', snapback_sizes[0] + 1, snapback_sizes[1], orientations[0]),
+            ('Payload', snapback_sizes[2] + 1, snapback_sizes[3], orientations[1])]
+
+
+# builds the tiles of one molecule of a table row, as read from its forward strand
+def generate_molecule_tiles(csv_row, payload_size=REF_PAYLOAD_SIZE):
+    args = csv_row[3:]
+    tiles = []
+    for c in get_repeated_pattern(csv_row[2], args):
+        if c == 'P':
+            payload_tile = ('Payload', 1, payload_size, '+')
+            if 'snapback' in args:
+                tiles += get_snapback_tiles(payload_size)
+            elif 'irregular_payload' in args:
+                tiles += [payload_tile, payload_tile]
+            else:
+                tiles.append(payload_tile)
+        elif c in ELEMENT_TILES:
+            # same copy count as Vector.generate_extra_itr
+            tiles += [ELEMENT_TILES[c]] * (random.randint(1, 3) if 'repeat_itrs' in args else 1)
+        else:
+            raise ValueError(f'{c} in the pattern of {csv_row[0]} has no tile; the pattern must only use {list(ELEMENT_TILES.keys())}')
+    return tiles
+
+
+# reads the molecule from one of its strands and moves every coordinate by up to <jitter> bases, then formats the tiles as in a counts file
+def read_molecule_tiles(tiles, reverse_strand=False, payload_size=REF_PAYLOAD_SIZE, jitter=COORDINATE_JITTER):
+    if reverse_strand:
+        tiles = [(name, start, end, '-' if orientation == '+' else '+') for name, start, end, orientation in tiles[::-1]]
+    if jitter:
+        shifts = random.randint(-jitter, jitter + 1, (len(tiles), 2))
+    tile_strings = []
+    for i, (name, start, end, orientation) in enumerate(tiles):
+        if jitter:
+            reference_end = payload_size if name == 'Payload' else ELEMENT_TILES['C'][2]
+            start = min(max(1, start + shifts[i][0]), reference_end - 1)
+            end = min(max(start + 1, end + shifts[i][1]), reference_end)
+        tile_strings.append(f'{name}[{start}-{end}]({orientation})')
+    return ' '.join(tile_strings)
+
+
+# the count of every line, from its rank. The total is summed in blocks so it never needs every count in memory at once
+def get_line_counts(line_start, line_end, top_count=TOP_COUNT, zipf_exponent=ZIPF_EXPONENT):
+    ranks = np.arange(line_start + 1, line_end + 1, dtype=np.float64)
+    return np.maximum(1, np.round(top_count / ranks ** zipf_exponent)).astype(np.int64)
+
+
+def get_total_count(lines, top_count=TOP_COUNT, zipf_exponent=ZIPF_EXPONENT, block_size=10000000):
+    return sum(int(get_line_counts(start, min(lines, start + block_size), top_count, zipf_exponent).sum()) for start in range(0, lines, block_size))
+
+
+# splits the lines into chunks of at most lines_per_chunk lines, each with a child of the run's SeedSequence
+def get_counts_chunk_tasks(lines, seed=SEED, lines_per_chunk=LINES_PER_CHUNK, **line_arguments):
+    chunk_starts = range(0, lines, lines_per_chunk)
+    return [(chunk_start, min(lines_per_chunk, lines - chunk_start), chunk_seed, line_arguments)
+            for chunk_start, chunk_seed in zip(chunk_starts, SeedSequence(seed).spawn(len(chunk_starts)))]
+
+
+# generates the lines of one chunk, returning the counts file text and the labels file text. Each line is a molecule of a random table row,
+# read from a random strand, or with odds of <zmw_mismatch_odds> a ZMW mismatch: both strands of the molecule tiled separately ('U') or one strand tiled twice ('x 2')
+def write_chunk_counts(chunk_start, chunk_size, chunk_seed, table, total_count, payload_size=REF_PAYLOAD_SIZE, jitter=COORDINATE_JITTER,
+                       zmw_mismatch_odds=ZMW_ODDS, top_count=TOP_COUNT, zipf_exponent=ZIPF_EXPONENT):
+    random.seed(chunk_seed.generate_state(4))
+    counts = get_line_counts(chunk_start, chunk_start + chunk_size, top_count, zipf_exponent)
+    rows = random.randint(0, len(table), chunk_size)
+    reverse_strands = random.binomial(1, 0.5, chunk_size).astype(bool)
+    # 0 for no mismatch, 1 for 'U' and 2 for 'x 2'
+    mismatches = random.binomial(1, zmw_mismatch_odds, chunk_size) * random.randint(1, 3, chunk_size)
+    counts_lines, label_lines = [], []
+    for i in range(chunk_size):
+        csv_row = table[rows[i]]
+        tiles = generate_molecule_tiles(csv_row, payload_size)
+        tile_pattern = read_molecule_tiles(tiles, reverse_strands[i], payload_size, jitter)
+        u_category = ''
+        if mismatches[i] == 1:
+            tile_pattern += ' U ' + read_molecule_tiles(tiles, not reverse_strands[i], payload_size, jitter)
+            u_category = get_row_category(csv_row, not reverse_strands[i])
+        elif mismatches[i] == 2:
+            tile_pattern += ' x 2'
+        counts_lines.append(f'{counts[i]:7d} {counts[i] / total_count:.7f} {tile_pattern}\n')
+        label_lines.append(f'{chunk_start + i + 1}\t{counts[i]}\t{get_row_category(csv_row, reverse_strands[i])}\t{u_category}\t{csv_row[0]}\n')
+    return ''.join(counts_lines), ''.join(label_lines)
+
+
+def write_chunk_counts_task(task):
+    chunk_start, chunk_size, chunk_seed, line_arguments = task
+    return write_chunk_counts(chunk_start, chunk_size, chunk_seed, **line_arguments)
+
+
+# writes <sample_name>.tile.zmw.counts and <sample_name>.labels.tsv to the output directory, returning their paths.
+# The labels give each line's category, and for 'U' lines the category of the pattern after the 'U'.
+# Chunks come back from imap in order, so the files are identical for any worker count
+def write_counts_files(table, snapback_frequencies, lines=LINES, output_directory=OUTPUT_DIR, sample_name=SAMPLE_NAME, seed=SEED, workers=WORKERS,
+                       lines_per_chunk=LINES_PER_CHUNK, top_count=TOP_COUNT, zipf_exponent=ZIPF_EXPONENT, **line_arguments):
+    if lines < 1: raise ValueError('at least one line must be generated')
+    total_count = get_total_count(lines, top_count, zipf_exponent)
+    tasks = get_counts_chunk_tasks(lines, seed, lines_per_chunk, table=table, total_count=total_count, top_count=top_count, zipf_exponent=zipf_exponent, **line_arguments)
+    counts_filename = os.path.join(output_directory, f'{sample_name}.tile.zmw.counts')
+    labels_filename = os.path.join(output_directory, f'{sample_name}.labels.tsv')
+    if workers > 1:
+        pool = Pool(workers, initializer=set_snapback_frequencies, initargs=[snapback_frequencies])
+        chunks = pool.imap(write_chunk_counts_task, tasks)
+    else:
+        pool = None
+        set_snapback_frequencies(snapback_frequencies)
+        chunks = map(write_chunk_counts_task, tasks)
+    try:
+        with open(counts_filename, 'w', buffering=WRITE_BUFFER_SIZE) as counts_file, open(labels_filename, 'w', buffering=WRITE_BUFFER_SIZE) as labels_file:
+            labels_file.write('Line\tCount\tCategory\tU Category\tTable Row\n')
+            for counts_text, labels_text in chunks:
+                counts_file.write(counts_text)
+                labels_file.write(labels_text)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return counts_filename, labels_filename
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='CountsInSilico',
+                                    description='Writes a synthetic tile pattern counts file, with ground truth categories, directly from the subparser table')
+    parser.add_argument('-lines', type=int, default=LINES,
+                        help=f'the number of lines in the counts file. The default is {LINES}')
+    parser.add_argument('-output_directory', type=str, default=OUTPUT_DIR,
+                        help=f'the directory to place the counts and labels files in. The default is {OUTPUT_DIR}')
+    parser.add_argument('-sample_name', type=str, default=SAMPLE_NAME,
+                        help=f'the root filename of the output files. The default is {SAMPLE_NAME}')
+    parser.add_argument('-input_file', type=str, default=INPUT_FILE,
+                        help=f'the subparser table to draw molecules from, each row equally often. The default is {INPUT_FILE}')
+    parser.add_argument('-payload_size', type=int, default=REF_PAYLOAD_SIZE,
+                        help=f'the payload size of the generated tiles; use the same -payload_size with parse_file.py. The default is {REF_PAYLOAD_SIZE}')
+    parser.add_argument('-jitter', type=int, default=COORDINATE_JITTER,
+                        help=f'the most bases any tile coordinate is moved by. The default is {COORDINATE_JITTER}')
+    parser.add_argument('-top_count', type=int, default=TOP_COUNT,
+                        help=f'the count of the first line, later lines have counts of top_count / line^zipf_exponent. The default is {TOP_COUNT}')
+    parser.add_argument('-zipf_exponent', type=float, default=ZIPF_EXPONENT,
+                        help=f'how quickly the line counts fall off. The default is {ZIPF_EXPONENT}')
+    parser.add_argument('-workers', type=int, default=WORKERS,
+                        help=f'the number of processes generating lines. The output is identical for any worker count. The default is {WORKERS}')
+    parser.add_argument('-seed', type=int, default=SEED,
+                        help=f"the seed that every chunk's seed is spawned from. The default is {SEED}")
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = GetArguments().parse_args()
+    if arguments.workers < 1: raise ValueError('the worker count must be at least 1')
+    start_time = time.time()
+    snapback_frequencies = get_snapback_freq_dist(SNAPBACK_FREQ_FILE, arguments.payload_size)
+    with open(arguments.input_file, 'r', encoding='utf-8-sig') as table_file:
+        table = [type_cast_parameters_vector(line.strip().split(',')) for line in table_file if line.strip()]
+    os.makedirs(arguments.output_directory, exist_ok=True)
+    counts_filename, labels_filename = write_counts_files(table, snapback_frequencies, lines=arguments.lines, output_directory=arguments.output_directory,
+                                                          sample_name=arguments.sample_name, seed=arguments.seed, workers=arguments.workers,
+                                                          payload_size=arguments.payload_size, jitter=arguments.jitter, top_count=arguments.top_count,
+                                                          zipf_exponent=arguments.zipf_exponent)
+    print(f'wrote {arguments.lines} lines to {counts_filename} with labels in {labels_filename}')
+    print(f'run time: {time.time() - start_time} seconds')
@@ -0,0 +1,200 @@
+from Subparser_In_Silico import *
+import re
+import numpy as np
+
+
+# Scales a real tile pattern counts file (the tiler's *.tile.zmw.counts output) up by N times for load testing parse_file.py.
+# Each kind of line (normal, 'U' and 'x 2') is replayed N times as often as in the input, drawing input lines of that kind in proportion
+# to their counts and giving them counts drawn from that kind's counts. Their breakpoints are moved by a few bases so most lines are
+# new patterns, while coordinates at the ends of a tile's observed range (full payloads, full ITRs) are kept. The ZMW mismatch mix is
+# kept exactly, and the category and count distributions follow the input's
+
+SCALE = 10
+# each chunk of lines gets its own seed; changing it changes the output lines
+LINES_PER_CHUNK = 50000
+# breakpoint coordinates are moved by up to this many bases, kept inside the coordinates seen for the tile in the input
+BREAKPOINT_JITTER = 5
+TILE_REGEX = re.compile(r'^(.+)\[(\d+)-(\d+)\]\((.)\)$')
+
+
+# reads the counts file as a list of (count, tile pattern) tuples, the tile pattern being everything after the proportion
+def read_counts_file(input_file):
+    source_lines = []
+    with open(input_file, 'r') as f:
+        for line in f:
+            data = line.split(maxsplit=2)
+            if len(data) < 3:
+                continue
+            source_lines.append((int(float(data[0])), data[2].strip()))
+    if not source_lines:
+        raise ValueError(f'no tile patterns were found in {input_file}; make sure that it is a valid counts file')
+    return source_lines
+
+
+# the lowest start and highest end coordinate seen for each tile name, which breakpoints are jittered within
+def get_coordinate_ranges(source_lines):
+    coordinate_ranges = {}
+    for _, tile_pattern in source_lines:
+        for tile in tile_pattern.split():
+            match = TILE_REGEX.match(tile)
+            if not match:
+                continue
+            name, start, end = match.group(1), int(match.group(2)), int(match.group(3))
+            if name in coordinate_ranges:
+                coordinate_ranges[name] = (min(start, coordinate_ranges[name][0]), max(end, coordinate_ranges[name][1]))
+            else:
+                coordinate_ranges[name] = (start, end)
+    return coordinate_ranges
+
+
+# moves every breakpoint of the tile pattern by up to <jitter> bases. 'U', 'x 2' and single coordinate (homopolymer) tiles are unchanged
+def jitter_tile_pattern(tile_pattern, coordinate_ranges, jitter=BREAKPOINT_JITTER):
+    tiles = tile_pattern.split()
+    shifts = random.randint(-jitter, jitter + 1, (len(tiles), 2))
+    for i, tile in enumerate(tiles):
+        match = TILE_REGEX.match(tile)
+        if not match:
+            continue
+        name, start, end = match.group(1), int(match.group(2)), int(match.group(3))
+        range_start, range_end = coordinate_ranges[name]
+        if start != range_start:
+            start = min(max(range_start + 1, start + shifts[i][0]), range_end - 1)
+        if end != range_end:
+            end = min(max(start + 1, end + shifts[i][1]), range_end - 1)
+        tiles[i] = f'{name}[{start}-{end}]({match.group(4)})'
+    return ' '.join(tiles)
+
+
+# 0 for a normal line, 1 for a 'U' line and 2 for an 'x 2' line
+def get_line_kind(tile_pattern):
+    if ' U ' in tile_pattern:
+        return 1
+    elif tile_pattern.endswith(' x 2'):
+        return 2
+    return 0
+
+
+# the kind and count of every output line. Each kind has <scale> times as many lines as in the input, with counts drawn from
+# the input's counts of that kind, and the lines are sorted highest count first like the tiler's output
+def get_replay_lines(source_lines, scale, seed_sequence):
+    rng = np.random.default_rng(seed_sequence)
+    source_kinds = np.array([get_line_kind(tile_pattern) for _, tile_pattern in source_lines], dtype=np.int8)
+    source_counts = np.array([count for count, _ in source_lines], dtype=np.int64)
+    kinds = np.repeat(source_kinds, scale)
+    counts = np.empty(len(kinds), dtype=np.int64)
+    for kind in np.unique(source_kinds):
+        counts[kinds == kind] = rng.choice(source_counts[source_kinds == kind], np.count_nonzero(kinds == kind))
+    order = np.argsort(-counts, kind='stable')
+    return kinds[order], counts[order]
+
+
+# splits the lines into chunks of at most lines_per_chunk lines, each with a child of the given SeedSequence
+def get_replay_chunk_tasks(lines, seed_sequence, lines_per_chunk=LINES_PER_CHUNK):
+    chunk_starts = range(0, lines, lines_per_chunk)
+    return [(chunk_start, min(lines_per_chunk, lines - chunk_start), chunk_seed)
+            for chunk_start, chunk_seed in zip(chunk_starts, seed_sequence.spawn(len(chunk_starts)))]
+
+
+# worker-side state, set once per process by set_replay_source
+_replay_source = {}
+
+
+# keeps, for each line kind, the indices of the input lines of that kind and a sampler over them weighted by their counts
+def set_replay_source(source_lines, coordinate_ranges, kinds, counts, jitter):
+    source_kinds = np.array([get_line_kind(tile_pattern) for _, tile_pattern in source_lines], dtype=np.int8)
+    source_counts = np.array([count for count, _ in source_lines], dtype=np.float64)
+    source_samplers = {}
+    for kind in np.unique(source_kinds):
+        kind_indices = np.flatnonzero(source_kinds == kind)
+        source_samplers[kind] = DistributionSampler(kind_indices, source_counts[kind_indices])
+    _replay_source.update(tile_patterns=[tile_pattern for _, tile_pattern in source_lines], coordinate_ranges=coordinate_ranges, source_samplers=source_samplers,
+                          kinds=kinds, counts=counts, total_count=int(counts.sum()), jitter=jitter)
+
+
+# generates the lines of one chunk as counts file text. Each line replays an input line of its kind chosen in proportion to its count
+def write_chunk_replay(task):
+    chunk_start, chunk_size, chunk_seed = task
+    random.seed(chunk_seed.generate_state(4))
+    kinds = _replay_source['kinds'][chunk_start:chunk_start + chunk_size]
+    source_indices = np.empty(chunk_size, dtype=np.int64)
+    for kind, source_sampler in _replay_source['source_samplers'].items():
+        kind_lines = kinds == kind
+        if kind_lines.any():
+            source_indices[kind_lines] = source_sampler.draw(np.count_nonzero(kind_lines))
+    counts, total_count = _replay_source['counts'], _replay_source['total_count']
+    lines = []
+    for i, source_index in zip(range(chunk_start, chunk_start + chunk_size), source_indices):
+        tile_pattern = jitter_tile_pattern(_replay_source['tile_patterns'][source_index], _replay_source['coordinate_ranges'], _replay_source['jitter'])
+        lines.append(f'{counts[i]:7d} {counts[i] / total_count:.7f} {tile_pattern}\n')
+    return ''.join(lines)
+
+
+# the proportion of lines that are 'U' lines and 'x 2' lines
+def get_zmw_mismatch_mix(tile_patterns):
+    kinds = [get_line_kind(tile_pattern) for tile_pattern in tile_patterns]
+    return kinds.count(1) / len(kinds), kinds.count(2) / len(kinds)
+
+
+# writes <sample_name>.tile.zmw.counts, with <scale> times as many lines as the input file, to the output directory and returns its path.
+# Chunks come back from imap in order, so the file is identical for any worker count
+def write_replay_file(input_file, output_directory, sample_name=None, scale=SCALE, jitter=BREAKPOINT_JITTER, seed=SEED, workers=WORKERS,
+                      lines_per_chunk=LINES_PER_CHUNK):
+    if scale < 1: raise ValueError('the scale must be at least 1')
+    source_lines = read_counts_file(input_file)
+    lines = len(source_lines) * scale
+    if sample_name is None:
+        sample_name = os.path.basename(input_file).split('.')[0] + f'_x{scale}'
+    counts_seed, lines_seed = SeedSequence(seed).spawn(2)
+    source_arguments = [source_lines, get_coordinate_ranges(source_lines), *get_replay_lines(source_lines, scale, counts_seed), jitter]
+    tasks = get_replay_chunk_tasks(lines, lines_seed, lines_per_chunk)
+    output_filename = os.path.join(output_directory, f'{sample_name}.tile.zmw.counts')
+    if workers > 1:
+        pool = Pool(workers, initializer=set_replay_source, initargs=source_arguments)
+        chunks = pool.imap(write_chunk_replay, tasks)
+    else:
+        pool = None
+        set_replay_source(*source_arguments)
+        chunks = map(write_chunk_replay, tasks)
+    try:
+        with open(output_filename, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+            for chunk_text in chunks:
+                f.write(chunk_text)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return output_filename
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='CountsReplay',
+                                    description='Scales a real tile pattern counts file up by resampling its patterns and jittering their breakpoints')
+    parser.add_argument('-input_file', required=True, type=str,
+                        help='the *.tile.zmw.counts file to replay')
+    parser.add_argument('-output_directory', required=True, type=str,
+                        help='the directory to place the scaled counts file in')
+    parser.add_argument('-scale', type=int, default=SCALE,
+                        help=f'how many times more lines than the input file the output has. The default is {SCALE}')
+    parser.add_argument('-sample_name', type=str, default=None,
+                        help='the root filename of the output file. The default is the input root filename followed by _x<scale>')
+    parser.add_argument('-jitter', type=int, default=BREAKPOINT_JITTER,
+                        help=f'the most bases any breakpoint coordinate is moved by. The default is {BREAKPOINT_JITTER}')
+    parser.add_argument('-workers', type=int, default=WORKERS,
+                        help=f'the number of processes generating lines. The output is identical for any worker count. The default is {WORKERS}')
+    parser.add_argument('-seed', type=int, default=SEED,
+                        help=f"the seed that the line counts and every chunk's seed are spawned from. The default is {SEED}")
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = GetArguments().parse_args()
+    if arguments.workers < 1: raise ValueError('the worker count must be at least 1')
+    start_time = time.time()
+    os.makedirs(arguments.output_directory, exist_ok=True)
+    output_filename = write_replay_file(arguments.input_file, arguments.output_directory, arguments.sample_name, scale=arguments.scale,
+                                        jitter=arguments.jitter, seed=arguments.seed, workers=arguments.workers)
+    input_mix = get_zmw_mismatch_mix([tile_pattern for _, tile_pattern in read_counts_file(arguments.input_file)])
+    output_mix = get_zmw_mismatch_mix([tile_pattern for _, tile_pattern in read_counts_file(output_filename)])
+    print(f'wrote {output_filename}')
+    print(f'U lines: {input_mix[0]:.4f} of the input, {output_mix[0]:.4f} of the output; x 2 lines: {input_mix[1]:.4f} of the input, {output_mix[1]:.4f} of the output')
+    print(f'run time: {time.time() - start_time} seconds')
@@ -1,10 +1,23 @@
 from sequence_classes import *
+from numpy.random import SeedSequence
+import argparse
 import datetime
+import gzip
+import io
 from multiprocessing import Pool
 import time
 
 
 SEQS_PER_FILE = 10000
+# each file is generated in chunks of this many sequences, each with its own seed; changing it changes the output sequences
+SEQS_PER_CHUNK = 250
+WORKERS = 17
+SEED = 1997
+# the parent writes each output file through a buffer of this many bytes
+WRITE_BUFFER_SIZE = 1 << 22
+# each worker prints its running total of generated sequences every time it crosses another multiple of this
+PROGRESS_INTERVAL = 10000
+OUTPUT_FORMATS = ['fasta', 'fastq']
 INPUT_FILE = 'Inputs/SubparserTable.csv'
 OUTPUT_DIR = '../DataFiles/Inputs/InSilicoData/raw/'
 MUTATION_RATES = [0.00, 0.001, 0.01, 0.05]
@@ -50,7 +63,7 @@ def type_cast_parameters_vector(csv_row):
 
 # take normalized snapback frequency data, scale all sizes to the reference payload size, keep for use in sequence_classes as a list of tuples:
 # [('payload_1_start payload_1_end payload_2_start payload_2_end', frequency), ('payload_1_start payload_1_end payload_2_start payload_2_end', frequency), ...]
-def get_snapback_freq_dist(snapback_data_file):
+def get_snapback_freq_dist(snapback_data_file, payload_size=REF_PAYLOAD_SIZE):
 	snapback_frequency_data = []
 	with open(snapback_data_file, 'r') as f:
 		for line in f:
@@ -58,7 +71,7 @@ def get_snapback_freq_dist(snapback_data_file):
 			if not line:
 				continue
 			halves = line.split(':')
-			rescaled_sized_from_normalized = [str(min(REF_PAYLOAD_SIZE, round(REF_PAYLOAD_SIZE * float(x)))) for x in halves[0].split()]
+			rescaled_sized_from_normalized = [str(min(payload_size, round(payload_size * float(x)))) for x in halves[0].split()]
 			snapback_frequency_data.append((' '.join(rescaled_sized_from_normalized), float(halves[1])))
 	return snapback_frequency_data
 
@@ -84,46 +97,141 @@ def generate_zmw_mismatch(vector, mismatch_pattern=False):
         return Vector(new_vector_name, new_attributes, ''.join(new_pattern))
 
 
-def write_file_vector(csv_row, mutation_rate=0, zmw_mismatch_odds=0.1, output_directory=OUTPUT_DIR, seqs_per_file=SEQS_PER_FILE,  homopolymer_indel_rates=HOMOPOLYMER_INDEL_INCIDENCE_RATES, homopolymer_indel_size_dist_table=HOMOPOLYMER_DIST_FILE):
-    output_filename = os.path.join(output_directory, csv_row[0].replace(' ', '_') + f'_m_{str(mutation_rate).split(".")[1]}.fasta')
-    with open(output_filename, 'w') as fh:
-        for i in range(seqs_per_file):
-            formatted_time = datetime.datetime.now().strftime("%y%m%d")
-            sequence_name = f'{csv_row[0]}_{formatted_time}_{i}/{i}/ccs'
-            vectors = [Vector(sequence_name, Vector.attributes_from_file(csv_row[1]), csv_row[2], *csv_row[3:])]
-            # randomly decide whether or not to write a zmw mismatch with a rate of <zmw_mismatch_odds>
-            if random.binomial(1, zmw_mismatch_odds):
-                vectors.append(generate_zmw_mismatch(vectors[0], random.choice([False, True])))
-            for vector in vectors:
-                if homopolymer_indel_rates:
-                    vector.generate_homopolymer_mutations(homopolymer_indel_rates, Sequence.generate_size_distribution_dictionary(homopolymer_indel_size_dist_table))
-                if mutation_rate:
-                    vector.modify_sequence(vector.mutate_sequence, 1.0, False, mutation_rate)
-                print(f'printing {vector.name} with pattern {vector.pattern} and mutation rate {mutation_rate} to {output_filename}')
-                vector.write_seq_to_fasta(fh)
+def get_output_filename(csv_row, mutation_rate, output_directory=OUTPUT_DIR, output_format='fasta', compress=False):
+    extension = f'.{output_format}.gz' if compress else f'.{output_format}'
+    return os.path.join(output_directory, csv_row[0].replace(' ', '_') + f'_m_{str(mutation_rate).split(".")[1]}' + extension)
+
+
+# opens an output file behind a large write buffer. Compressed files are gzipped with a zeroed header timestamp,
+# so the same seed still gives byte-identical files
+def open_output_file(output_filename):
+    if output_filename.endswith('.gz'):
+        return io.TextIOWrapper(gzip.GzipFile(output_filename, 'wb', mtime=0), write_through=False)
+    return open(output_filename, 'w', buffering=WRITE_BUFFER_SIZE)
+
+
+# splits every output file (one per csv row and mutation rate) into chunks of at most seqs_per_chunk sequences.
+# Each file gets a child of the run's SeedSequence, and each chunk a child of its file's seed, spawned in a fixed order,
+# so every chunk's sequences depend only on the seed and never on which worker generates it or when
+def get_chunk_tasks(table, mutation_rates, formatted_time, seed=SEED, zmw_mismatch_odds=ZMW_ODDS, output_directory=OUTPUT_DIR, 
+                    seqs_per_file=SEQS_PER_FILE, seqs_per_chunk=SEQS_PER_CHUNK, output_format='fasta', compress=False, progress_interval=PROGRESS_INTERVAL):
+    if output_format not in OUTPUT_FORMATS: raise ValueError(f'output format must be one of {OUTPUT_FORMATS}, not {output_format}')
+    chunk_starts = range(0, seqs_per_file, seqs_per_chunk)
+    file_seeds = iter(SeedSequence(seed).spawn(len(table) * len(mutation_rates)))
+    tasks = []
+    for csv_row in table:
+        for mutation_rate in mutation_rates:
+            output_filename = get_output_filename(csv_row, mutation_rate, output_directory, output_format, compress)
+            for chunk_start, chunk_seed in zip(chunk_starts, next(file_seeds).spawn(len(chunk_starts))):
+                tasks.append((output_filename, csv_row, mutation_rate, zmw_mismatch_odds, chunk_start, 
+                              min(seqs_per_chunk, seqs_per_file - chunk_start), chunk_seed, formatted_time, output_format, progress_interval))
+    return tasks
+
+
+# worker-side caches so each process reads the attribute fasta files and homopolymer size distributions only once
+_attributes_cache = {}
+_size_samplers_cache = {}
+# the number of sequences this process has generated, reported every progress_interval sequences
+_sequences_generated = 0
+
+
+def report_progress(chunk_size, progress_interval):
+    global _sequences_generated
+    previous_count, _sequences_generated = _sequences_generated, _sequences_generated + chunk_size
+    if progress_interval and previous_count // progress_interval != _sequences_generated // progress_interval:
+        print(f'process {os.getpid()}: {_sequences_generated} sequences generated', flush=True)
+
+
+# generates the sequences of one chunk and returns them as fasta or fastq text along with the file they belong to
+def write_chunk_vector(output_filename, csv_row, mutation_rate, zmw_mismatch_odds, chunk_start, chunk_size, chunk_seed, formatted_time, 
+                       output_format='fasta', progress_interval=PROGRESS_INTERVAL, 
+                       homopolymer_indel_rates=HOMOPOLYMER_INDEL_INCIDENCE_RATES, homopolymer_indel_size_dist_table=HOMOPOLYMER_DIST_FILE):
+    # sequence_classes draws from numpy's global generator, so it is reseeded from the chunk's own seed
+    random.seed(chunk_seed.generate_state(4))
+    if csv_row[1] not in _attributes_cache:
+        _attributes_cache[csv_row[1]] = Vector.attributes_from_file(csv_row[1])
+    if homopolymer_indel_rates and homopolymer_indel_size_dist_table not in _size_samplers_cache:
+        _size_samplers_cache[homopolymer_indel_size_dist_table] = Sequence.generate_size_distribution_samplers(homopolymer_indel_size_dist_table)
+    fh = io.StringIO()
+    write_record = Vector.write_seq_to_fastq if output_format == 'fastq' else Vector.write_seq_to_fasta
+    for i in range(chunk_start, chunk_start + chunk_size):
+        sequence_name = f'{csv_row[0]}_{formatted_time}_{i}/{i}/ccs'
+        vectors = [Vector(sequence_name, _attributes_cache[csv_row[1]], csv_row[2], *csv_row[3:])]
+        # randomly decide whether or not to write a zmw mismatch with a rate of <zmw_mismatch_odds>
+        if random.binomial(1, zmw_mismatch_odds):
+            vectors.append(generate_zmw_mismatch(vectors[0], random.choice([False, True])))
+        for vector in vectors:
+            if homopolymer_indel_rates:
+                vector.generate_homopolymer_mutations(homopolymer_indel_rates, _size_samplers_cache[homopolymer_indel_size_dist_table])
+            if mutation_rate:
+                vector.modify_sequence(vector.mutate_sequence, 1.0, False, mutation_rate)
+            write_record(vector, fh)
+    report_progress(chunk_size, progress_interval)
+    return output_filename, fh.getvalue()
+
+
+def write_chunk_vector_task(task):
+    return write_chunk_vector(*task)
+
+
+# generates every file in the table. Chunks are handed out to the workers one at a time so a slow category (long repeatable
+# concatemers) is spread over all workers, and imap returns them in task order so files are written identically for any worker count
+def write_files_vector(table, snapback_frequencies, mutation_rates=MUTATION_RATES, seed=SEED, workers=WORKERS, **task_arguments):
+    formatted_time = datetime.datetime.now().strftime("%y%m%d")  # resolved once so a run crossing midnight names sequences consistently
+    tasks = get_chunk_tasks(table, mutation_rates, formatted_time, seed=seed, **task_arguments)
+    fh, current_filename = None, None
+    if workers > 1:
+        pool = Pool(workers, initializer=set_snapback_frequencies, initargs=[snapback_frequencies])
+        chunks = pool.imap(write_chunk_vector_task, tasks)
+    else:
+        pool = None
+        set_snapback_frequencies(snapback_frequencies)
+        chunks = map(write_chunk_vector_task, tasks)
+    try:
+        for output_filename, chunk_text in chunks:
+            if output_filename != current_filename:
+                if fh: fh.close()
+                fh, current_filename = open_output_file(output_filename), output_filename
+            fh.write(chunk_text)
+    finally:
+        if fh: fh.close()
+        if pool:
+            pool.close()
+            pool.join()
+
 
 # multiprocess initializer to avoid needing to rerun SnapbackAnalysis for each file
-# sets the size frequency as a class variable with the cumulative distribution
+# sets the size frequency as a class variable with a sampler built once over the cumulative distribution
 def set_snapback_frequencies(snapback_frequencies):
-    # frequency to cumulative probability distribution: [0.3, 0.3, 0.1, 0.2] -> [0.3, 0.6, 0.7, 1.0]
-    snapback_sizes = [val[0] for val in snapback_frequencies]
+    snapback_sizes = [[int(val) for val in sizes.split()] for sizes, _ in snapback_frequencies]
     snapback_probabilities = [val[1] for val in snapback_frequencies]
-    cumulative_probabilities = [sum(snapback_probabilities[:i+1]) for i in range(len(snapback_probabilities))]
-    Vector.snapback_frequencies = list(zip(snapback_sizes, cumulative_probabilities))
+    Vector.snapback_sampler = DistributionSampler(snapback_sizes, snapback_probabilities)
+
+
+def GetArguments():
+    parser = argparse.ArgumentParser(prog='SubparserInSilico',
+                                    description='Generates in silico AAV sequences for each row of the subparser table and mutation rate')
+    parser.add_argument('-workers', type=int, default=WORKERS,
+                        help=f'the number of processes generating sequences. The output is identical for any worker count. The default is {WORKERS}')
+    parser.add_argument('-seed', type=int, default=SEED,
+                        help=f"the seed that every sequence chunk's seed is spawned from. The default is {SEED}")
+    parser.add_argument('-output_format', choices=OUTPUT_FORMATS, default='fasta',
+                        help='write the sequences as fasta or as fastq with simulated quality scores. The default is fasta')
+    parser.add_argument('-gzip', action='store_true',
+                        help='gzip the output files, adding .gz to their names')
+    parser.add_argument('-quiet', action='store_true',
+                        help=f'do not print the per-process progress counters (printed every {PROGRESS_INTERVAL} sequences)')
+    return parser
+
 
 if __name__ == '__main__':
     # MULTI-PROCESS
+    arguments = GetArguments().parse_args()
+    if arguments.workers < 1: raise ValueError('the worker count must be at least 1')
     start_time = time.time()
-    random.seed(1997)
     snapback_frequencies = get_snapback_freq_dist(SNAPBACK_FREQ_FILE)
     with open(INPUT_FILE, 'r', encoding='utf-8-sig') as table_file:
-        table = table_file.readlines()
-    all_lines = []
-    for line in table:
-        line = line.strip().split(',')
-        line = type_cast_parameters_vector(line)
-        for m in MUTATION_RATES:
-            all_lines.append([line, m, ZMW_ODDS])
-    with Pool(17, initializer=set_snapback_frequencies, initargs=[snapback_frequencies]) as pool:
-        pool.starmap(write_file_vector, all_lines)
+        table = [type_cast_parameters_vector(line.strip().split(',')) for line in table_file if line.strip()]
+    write_files_vector(table, snapback_frequencies, seed=arguments.seed, workers=arguments.workers, zmw_mismatch_odds=ZMW_ODDS, 
+                       output_format=arguments.output_format, compress=arguments.gzip, progress_interval=0 if arguments.quiet else PROGRESS_INTERVAL)
     print(f'run time: {time.time() - start_time} seconds')
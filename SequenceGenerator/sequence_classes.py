@@ -3,6 +3,7 @@ from Bio import Restriction
 from Bio.Seq import Seq
 from numpy import random
 from copy import deepcopy
+import numpy as np
 import string
 import os
 import csv
@@ -12,6 +13,35 @@ BASES_DEL = 'ACGT-'
 BASES = 'ACGT'
 
 
+# Draws outcomes from a discrete distribution in O(log n) using a cumulative probability array built once.
+# Draws use the same single uniform value per sample as the roulette wheel scans it replaces, so seeded runs are unchanged.
+# Passing size to draw() returns a list of that many samples from one vectorized call.
+class DistributionSampler:
+    def __init__(self, outcomes, probabilities):
+        if len(outcomes) != len(probabilities) or len(outcomes) == 0:
+            raise ValueError(f'a sampler needs one probability per outcome, got {len(outcomes)} outcomes and {len(probabilities)} probabilities')
+        self.outcomes = list(outcomes)
+        # probability to cumulative probability: [0.3, 0.3, 0.1, 0.2] -> [0.3, 0.6, 0.7, 1.0]
+        self.cumulative_probabilities = np.cumsum(np.asarray(probabilities, dtype=float))
+        self.total = self.cumulative_probabilities[-1]
+        self.last_index = len(self.outcomes) - 1
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    # builds a sampler from a {outcome: probability} dictionary, keeping the dictionary's order
+    def from_dictionary(distribution):
+        return DistributionSampler(list(distribution.keys()), list(distribution.values()))
+
+    # rng can be numpy's global random module (the default) or a numpy Generator
+    def draw(self, size=None, rng=random):
+        random_values = rng.uniform(0, self.total, size)  # easiest way to account for slight rounding error from proportions
+        indices = np.minimum(np.searchsorted(self.cumulative_probabilities, random_values, side='right'), self.last_index)
+        if size is None:
+            return self.outcomes[int(indices)]
+        return [self.outcomes[i] for i in indices]
+
+
 class Sequence:
     def __init__(self, name, sequence):
         self.name = name
@@ -111,35 +141,31 @@ class Sequence:
         # generate a score based on poisson distribution with mean 30 (based on PacBio data)
         if len(self.sequence) == 0:
             return
-        scores = []
-        for _ in range(len(self.sequence)):
-            score = 1000
-            while score > 42 or score < 20:
-                score = random.poisson(30, 1)[0]
-            scores.append(score)
-        phred33 = [chr(score + 33) for score in scores]
-        quality = (''.join(phred33))
+        # scores outside 20-42 are redrawn, all at once, until every base has one
+        scores = random.poisson(30, len(self.sequence))
+        redraw = (scores > 42) | (scores < 20)
+        while redraw.any():
+            scores[redraw] = random.poisson(30, redraw.sum())
+            redraw = (scores > 42) | (scores < 20)
+        quality = (scores + 33).astype(np.uint8).tobytes().decode('ascii')
         output_file_handle.write(f'@{self.name}\n{self.sequence}\n+\n{quality}\n')
 
-    # Helper for generate_homopolymer_mutations, uses size distribution as weighted roulette wheel to determine which indel
-    # to do, uses a cumulative probability list and rng to simulate weighted probabilities
+    # Helper for generate_homopolymer_mutations, draws an InDel from the size distribution
+    # size_distribution is either a {'+3': 0.2, '-1': 0.8, ...} dictionary or a DistributionSampler of (type, size) tuples
+    # from generate_size_distribution_samplers; passing samplers avoids rebuilding the cumulative distribution on every call
     # returns the InDel type (Insertion or Deletion) from set [+, -] and size
     def random_indel(size_distribution):
+        if type(size_distribution) is dict:
+            size_distribution = Sequence.indel_sampler_from_dictionary(size_distribution)
+        return size_distribution.draw()
+
+    # Helper for random_indel and generate_size_distribution_samplers, checks the distribution sums to nearly 1
+    # and builds a sampler whose outcomes are already split into (type, size) tuples
+    def indel_sampler_from_dictionary(size_distribution):
         if round(sum(size_distribution.values()), 3) != 1:
             raise ValueError(f'The sum of probabilities for size distribution {size_distribution} was not nearly 1\n It was: {sum(size_distribution.values())}')
-
-        # probability to cumulative probability: [0.3, 0.3, 0.1, 0.2] -> [0.3, 0.6, 0.7, 1.0]
-        indels = list(size_distribution.keys())
-        probabilities = list(size_distribution.values())
-        cumulative_probabilities = [sum(probabilities[:i+1]) for i in range(len(probabilities))]
-
-        random_value = random.uniform(0, max(cumulative_probabilities))  # easiest way to account for slight rounding error from proportions
-        for i, cumulative_probability in enumerate(cumulative_probabilities):
-            if random_value < cumulative_probability:
-                indel = indels[i]
-                break
-        
-        return indel[0], int(indel[1:])
+        indels = [(indel[0], int(indel[1:])) for indel in size_distribution.keys()]
+        return DistributionSampler(indels, list(size_distribution.values()))
     
     # iterates through the current sequence, generating a new sequence via a concatenation method
     # if a base is not at the start of a homopolymer, it is added to the new string.
@@ -213,6 +239,13 @@ class Sequence:
 
         return homopolymer_size_dists_dict
 
+    # same as generate_size_distribution_dictionary, but each homopolymer size maps to a prebuilt DistributionSampler
+    # so that the file is read and the cumulative distributions are computed only once per run
+    def generate_size_distribution_samplers(csv_file):
+        size_distributions = Sequence.generate_size_distribution_dictionary(csv_file)
+        return {homopolymer_size: Sequence.indel_sampler_from_dictionary(size_distribution) 
+                for homopolymer_size, size_distribution in size_distributions.items()}
+
 
 class Plasmid(Sequence):
     def __init__(self, name, sequence, restriction_enzyme):
@@ -241,7 +274,8 @@ class Plasmid(Sequence):
 
 
 class Vector(Sequence):
-    snapback_frequencies = []
+    # DistributionSampler of [payload_1_start, payload_1_end, payload_2_start, payload_2_end] lists, set by set_snapback_frequencies
+    snapback_sampler = None
 
     def __init__(self, name, attributes, pattern, *args):
         self.name = name
@@ -287,13 +321,8 @@ class Vector(Sequence):
         self.pattern = ''.join(pattern)
 
     def get_random_snapback_sizes():
-        # getting random snapback size set based on cumulative distribution
-        random_value = random.uniform(0, Vector.snapback_frequencies[-1][1])  # easiest way to account for slight rounding error from proportions
-        for snapback_size_set, cumulative_probability in Vector.snapback_frequencies:
-            if random_value < cumulative_probability:
-                snapback_sizes_to_use = snapback_size_set
-                break
-        return [int(val) for val in snapback_sizes_to_use.split()]
+        # getting random snapback size set based on the cumulative distribution; copied since generate_snapback edits it
+        return list(Vector.snapback_sampler.draw())
 
     def generate_snapback(self):
         # converting all payloads in pattern to snapbacks
@@ -1,7 +1,11 @@
 import unittest
 from sequence_classes import *
-from Subparser_In_Silico import generate_zmw_mismatch, set_snapback_frequencies
+from Subparser_In_Silico import generate_zmw_mismatch, set_snapback_frequencies, write_files_vector, get_snapback_freq_dist, get_chunk_tasks, SNAPBACK_FREQ_FILE
 import os
+from Counts_In_Silico import generate_molecule_tiles, read_molecule_tiles, get_row_category, write_counts_files
+from Counts_Replay import get_coordinate_ranges, get_line_kind, jitter_tile_pattern, write_replay_file, get_zmw_mismatch_mix
+import tempfile
+import gzip
 
 class Test_Sequence(unittest.TestCase):
     def test_mutate_sequence(self):
@@ -209,12 +213,66 @@ class Test_Sequence(unittest.TestCase):
             self.assertTrue(key[0] in result_types, f'{key[0]} is missing')
             self.assertTrue(int(key[1:]) in result_sizes, f'{key[1:]} is missing')
 
+    def test_random_indel_sampler(self):
+        test_distribution = {'+100': 0.01, '-2': 0.79, '-1': 0.1, '+3': 0.1}
+        random.seed(10)
+        dictionary_results = [Sequence.random_indel(test_distribution) for _ in range(100)]
+        random.seed(10)
+        test_sampler = Sequence.indel_sampler_from_dictionary(test_distribution)
+        sampler_results = [Sequence.random_indel(test_sampler) for _ in range(100)]
+        self.assertEqual(dictionary_results, sampler_results)
+        with self.assertRaises(ValueError):
+            Sequence.indel_sampler_from_dictionary({'+1': 0.5, '-1': 0.2})
+
+    def test_generate_size_distribution_samplers(self):
+        test_samplers = Sequence.generate_size_distribution_samplers('test_files/test_file.csv')
+        self.assertEqual(list(range(2, 9)), sorted(test_samplers.keys()))
+        self.assertEqual([('-', 3)], test_samplers[4].outcomes)
+        self.assertEqual(('-', 3), Sequence.random_indel(test_samplers[5]))
+
     def test_generate_size_distribution_dictionary(self):
         test_file = 'test_files/test_file.csv'
         test_dict = Sequence.generate_size_distribution_dictionary(test_file)
         expected_dict = {2: {'-10': 0.05, '-1': 0.5, '+1': 0.4, '+2': 0.05}, 3: {'-5': 0.1, '-1': 0.4, '+1':0.5}, 4: {'-3': 1.0}, 5: {'-3': 1.0}, 6: {'-2': 0.5, '+2': 0.5}, 7: {'-2': 0.5, '+2': 0.5}, 8: {'-2': 0.5, '+2': 0.5}}
         self.assertEqual(expected_dict, test_dict)
 
+class Test_DistributionSampler(unittest.TestCase):
+    def test_draw(self):
+        test_sampler = DistributionSampler(['a', 'b', 'c', 'd'], [0.3, 0.3, 0.1, 0.3])
+        self.assertEqual(4, len(test_sampler))
+        random.seed(903)
+        test_results = [test_sampler.draw() for _ in range(1000)]
+        for outcome in 'abcd':
+            self.assertTrue(outcome in test_results)
+        self.assertTrue(test_results.count('c') < test_results.count('a'))
+        # outcomes with no probability are never drawn
+        test_sampler = DistributionSampler(['a', 'b', 'c'], [0.5, 0, 0.5])
+        self.assertFalse('b' in test_sampler.draw(1000))
+        with self.assertRaises(ValueError):
+            DistributionSampler(['a', 'b'], [1.0])
+
+    def test_batched_draw(self):
+        test_sampler = DistributionSampler.from_dictionary({'a': 0.25, 'b': 0.5, 'c': 0.25})
+        random.seed(904)
+        single_draws = [test_sampler.draw() for _ in range(500)]
+        random.seed(904)
+        batched_draws = test_sampler.draw(500)
+        self.assertEqual(single_draws, batched_draws)
+        # numpy Generators can be passed in place of the global random module
+        generator_draws = test_sampler.draw(20000, rng=np.random.default_rng(904))
+        self.assertAlmostEqual(0.5, generator_draws.count('b') / 20000, places=1)
+
+    def test_snapback_sampler(self):
+        random.seed(905)
+        set_snapback_frequencies([('1 10 20 30', 0.5), ('5 15 25 35', 0.5)])
+        test_sizes = [Vector.get_random_snapback_sizes() for _ in range(100)]
+        self.assertTrue([1, 10, 20, 30] in test_sizes)
+        self.assertTrue([5, 15, 25, 35] in test_sizes)
+        # editing returned sizes doesn't change the sampler's outcomes
+        test_sizes[0][0] = 1000
+        self.assertFalse(any(outcome[0] == 1000 for outcome in Vector.snapback_sampler.outcomes))
+
+
 class Test_Vector(unittest.TestCase):
     test_attributes = {'L': 'CCC', 'P': 'TTT', 'R': 'GGG', 'C': 'AAA'}
 
@@ -338,6 +396,165 @@ class Test_Subparser_In_Silico(unittest.TestCase):
         self.assertEqual(new_test_vector.pattern, 'P')
         self.assertEqual(new_test_vector.sequence, 'GG')
     
+    def test_get_chunk_tasks(self):
+        test_table = [['foo', 'Inputs/InSilicoAAV.fasta', 'LPR'], ['bar', 'Inputs/InSilicoAAV.fasta', 'LP']]
+        test_tasks = get_chunk_tasks(test_table, [0.0, 0.01], '010101', seed=7, output_directory='out', seqs_per_file=10, seqs_per_chunk=4)
+        self.assertEqual(12, len(test_tasks))
+        self.assertEqual([0, 4, 8], [task[4] for task in test_tasks[:3]])
+        self.assertEqual([4, 4, 2], [task[5] for task in test_tasks[:3]])
+        self.assertEqual(os.path.join('out', 'bar_m_01.fasta'), test_tasks[-1][0])
+        # every chunk gets a different seed, and the same seeds are spawned again for the same run seed
+        test_states = [tuple(task[6].generate_state(4)) for task in test_tasks]
+        self.assertEqual(len(test_states), len(set(test_states)))
+        repeat_tasks = get_chunk_tasks(test_table, [0.0, 0.01], '010101', seed=7, output_directory='out', seqs_per_file=10, seqs_per_chunk=4)
+        self.assertEqual(test_states, [tuple(task[6].generate_state(4)) for task in repeat_tasks])
+
+    def test_write_files_vector_reproducible(self):
+        test_table = [['snapback', 'Inputs/InSilicoAAV.fasta', 'LPR', 'repeat_itrs', 'snapback'], ['truncated_right', 'Inputs/InSilicoAAV.fasta', 'LP', 'repeat_itrs']]
+        snapback_frequencies = get_snapback_freq_dist(SNAPBACK_FREQ_FILE)
+        outputs = []
+        for workers, seed in ((1, 11), (3, 11), (1, 12)):
+            with tempfile.TemporaryDirectory() as output_directory:
+                write_files_vector(test_table, snapback_frequencies, mutation_rates=[0.01], seed=seed, workers=workers, 
+                                   output_directory=output_directory, seqs_per_file=12, seqs_per_chunk=5)
+                file_contents = {}
+                for file in sorted(os.listdir(output_directory)):
+                    with open(os.path.join(output_directory, file), 'rb') as f:
+                        file_contents[file] = f.read()
+                outputs.append(file_contents)
+        self.assertEqual(['snapback_m_01.fasta', 'truncated_right_m_01.fasta'], list(outputs[0].keys()))
+        self.assertTrue(outputs[0]['snapback_m_01.fasta'].count(b'>') >= 12)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertNotEqual(outputs[0], outputs[2])
+
+    def test_write_files_vector_compressed_fastq(self):
+        test_table = [['truncated_right', 'Inputs/InSilicoAAV.fasta', 'LP', 'repeat_itrs']]
+        snapback_frequencies = get_snapback_freq_dist(SNAPBACK_FREQ_FILE)
+        outputs = []
+        for workers in (1, 2):
+            with tempfile.TemporaryDirectory() as output_directory:
+                write_files_vector(test_table, snapback_frequencies, mutation_rates=[0.01], seed=5, workers=workers, output_directory=output_directory, 
+                                   seqs_per_file=6, seqs_per_chunk=4, output_format='fastq', compress=True, progress_interval=0)
+                self.assertEqual(['truncated_right_m_01.fastq.gz'], os.listdir(output_directory))
+                with open(os.path.join(output_directory, 'truncated_right_m_01.fastq.gz'), 'rb') as f:
+                    outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        records = gzip.decompress(outputs[0]).decode().splitlines()
+        self.assertEqual(0, len(records) % 4)
+        for name, sequence, separator, quality in zip(records[::4], records[1::4], records[2::4], records[3::4]):
+            self.assertTrue(name.startswith('@truncated_right_'))
+            self.assertEqual('+', separator)
+            self.assertEqual(len(sequence), len(quality))
+            self.assertTrue(all(20 <= ord(score) - 33 <= 42 for score in quality))
+
+
+
+class Test_Counts_In_Silico(unittest.TestCase):
+    test_table = [['expected', 'Inputs/InSilicoAAV.fasta', 'LPR', 'repeat_itrs'], ['truncated_sp_IPP', 'Inputs/InSilicoAAV.fasta', 'LP', 'snapback'], 
+                  ['extended_species_bothITR', 'Inputs/InSilicoAAV.fasta', 'PCPCP', 'repeatable', 2, 4]]
+
+    def test_generate_molecule_tiles(self):
+        random.seed(3)
+        set_snapback_frequencies(get_snapback_freq_dist(SNAPBACK_FREQ_FILE))
+        self.assertEqual([('ITR-FLIP', 1, 145, '-'), ('Payload', 1, 2865, '+'), ('ITR-FLIP', 21, 165, '-')], 
+                         generate_molecule_tiles(['expected', 'Inputs/InSilicoAAV.fasta', 'LPR']))
+        self.assertEqual([('Payload', 1, 1000, '+'), ('Payload', 1, 1000, '+')], generate_molecule_tiles(['irregular', 'Inputs/InSilicoAAV.fasta', 'P', 'irregular_payload'], 1000))
+        tiles = generate_molecule_tiles(self.test_table[1])
+        self.assertEqual(3, len(tiles))
+        self.assertEqual({'+', '-'}, {tiles[1][3], tiles[2][3]})
+        tiles = generate_molecule_tiles(self.test_table[2])
+        self.assertTrue(len(tiles) >= 5 and (len(tiles) - 3) % 2 == 0)
+        self.assertEqual('Payload', tiles[-1][0])
+
+    def test_read_molecule_tiles(self):
+        random.seed(3)
+        tiles = [('ITR-FLIP', 1, 145, '-'), ('Payload', 1, 2865, '+'), ('ITR-FLIP', 21, 165, '-')]
+        self.assertEqual('ITR-FLIP[1-145](-) Payload[1-2865](+) ITR-FLIP[21-165](-)', read_molecule_tiles(tiles, jitter=0))
+        self.assertEqual('ITR-FLIP[21-165](+) Payload[1-2865](-) ITR-FLIP[1-145](+)', read_molecule_tiles(tiles, reverse_strand=True, jitter=0))
+        for _ in range(20):
+            jittered_tiles = [tile.split('[')[1].split(']')[0].split('-') for tile in read_molecule_tiles(tiles, jitter=3).split()]
+            for (start, end), tile in zip(jittered_tiles, tiles):
+                self.assertTrue(abs(int(start) - tile[1]) <= 3 and abs(int(end) - tile[2]) <= 3)
+                self.assertTrue(int(end) <= (2865 if tile[0] == 'Payload' else 165))
+
+    def test_get_row_category(self):
+        self.assertEqual('extended', get_row_category(self.test_table[2]))
+        self.assertEqual('truncated_sp_IPP', get_row_category(self.test_table[1]))
+        self.assertEqual('truncated_sp_PPI', get_row_category(self.test_table[1], reverse_strand=True))
+        self.assertEqual('expected', get_row_category(self.test_table[0], reverse_strand=True))
+
+    def test_write_counts_files(self):
+        snapback_frequencies = get_snapback_freq_dist(SNAPBACK_FREQ_FILE)
+        outputs = []
+        for workers in (1, 3):
+            with tempfile.TemporaryDirectory() as output_directory:
+                counts_filename, labels_filename = write_counts_files(self.test_table, snapback_frequencies, lines=250, output_directory=output_directory, 
+                                                                      seed=4, workers=workers, lines_per_chunk=60, zmw_mismatch_odds=0.5)
+                with open(counts_filename) as counts_file, open(labels_filename) as labels_file:
+                    outputs.append((counts_file.read(), labels_file.read()))
+        self.assertEqual(outputs[0], outputs[1])
+        counts_lines, label_lines = outputs[0][0].splitlines(), outputs[0][1].splitlines()[1:]
+        self.assertEqual(250, len(counts_lines))
+        self.assertEqual(250, len(label_lines))
+        counts = [int(line.split()[0]) for line in counts_lines]
+        self.assertEqual(10000, counts[0])
+        self.assertEqual(sorted(counts, reverse=True), counts)
+        self.assertAlmostEqual(1, sum(float(line.split()[1]) for line in counts_lines), 3)
+        self.assertTrue(any(' U ' in line for line in counts_lines) and any(line.endswith(' x 2') for line in counts_lines))
+        for counts_line, label_line in zip(counts_lines, label_lines):
+            labels = label_line.split('\t')
+            self.assertEqual(counts_line.split()[0], labels[1])
+            self.assertEqual(' U ' in counts_line, labels[3] != '')
+
+
+
+class Test_Counts_Replay(unittest.TestCase):
+    test_lines = ['    100 0.5 ITR-FLIP[1-145](-) Payload[1-1872](+) ITR-FLIP[21-165](-)', 
+                  '     50 0.25 ITR-FLIP[1-145](-) Payload[1-900](+) polyC[60](+) Payload[880-1872](-) ITR-FLIP[1-144](+) U ITR-FLIP[21-165](+) Payload[1-1872](-)', 
+                  '     30 0.15 ITR-FLIP[1-145](-) Payload[1-1872](-) ITR-FLIP[1-165](+) Payload[1-1872](+) ITR-FLIP[1-145](+) x 2', 
+                  '     20 0.1 Payload[12-1800](+)']
+
+    def test_get_coordinate_ranges(self):
+        source_lines = [(int(line.split()[0]), line.split(maxsplit=2)[2]) for line in self.test_lines]
+        self.assertEqual({'ITR-FLIP': (1, 165), 'Payload': (1, 1872)}, get_coordinate_ranges(source_lines))
+        self.assertEqual([0, 1, 2, 0], [get_line_kind(tile_pattern) for _, tile_pattern in source_lines])
+
+    def test_jitter_tile_pattern(self):
+        random.seed(8)
+        coordinate_ranges = {'ITR-FLIP': (1, 165), 'Payload': (1, 1872)}
+        tile_pattern = self.test_lines[1].split(maxsplit=2)[2]
+        for _ in range(20):
+            jittered_tiles = jitter_tile_pattern(tile_pattern, coordinate_ranges, jitter=5).split()
+            self.assertEqual(len(tile_pattern.split()), len(jittered_tiles))
+            # homopolymer tiles, U and coordinates at the ends of a tile's range are kept
+            self.assertEqual(['polyC[60](+)', 'U', 'Payload[1-1872](-)'], [jittered_tiles[2], jittered_tiles[5], jittered_tiles[7]])
+            self.assertTrue(jittered_tiles[1].startswith('Payload[1-') and jittered_tiles[6].endswith('-165](+)'))
+            for original_tile, jittered_tile in zip(tile_pattern.split(), jittered_tiles):
+                if '-' not in original_tile.split('(')[0]:
+                    continue
+                original_coordinates = [int(c) for c in original_tile.split('[')[1].split(']')[0].split('-')]
+                jittered_coordinates = [int(c) for c in jittered_tile.split('[')[1].split(']')[0].split('-')]
+                self.assertTrue(all(abs(o - j) <= 5 for o, j in zip(original_coordinates, jittered_coordinates)))
+                self.assertTrue(1 <= jittered_coordinates[0] < jittered_coordinates[1] <= 1872)
+
+    def test_write_replay_file(self):
+        outputs = []
+        with tempfile.TemporaryDirectory() as output_directory:
+            input_file = os.path.join(output_directory, 'sample.tile.zmw.counts')
+            with open(input_file, 'w') as f:
+                f.write('\n'.join(self.test_lines) + '\n')
+            for workers in (1, 2):
+                output_filename = write_replay_file(input_file, output_directory, f'replay_{workers}', scale=25, seed=6, workers=workers, lines_per_chunk=30)
+                with open(output_filename) as f:
+                    outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        replay_lines = outputs[0].splitlines()
+        self.assertEqual(100, len(replay_lines))
+        self.assertEqual((0.25, 0.25), get_zmw_mismatch_mix([line.split(maxsplit=2)[2] for line in replay_lines]))
+        counts = [int(line.split()[0]) for line in replay_lines]
+        self.assertEqual(sorted(counts, reverse=True), counts)
+        self.assertTrue(set(counts) <= {100, 50, 30, 20})
+
 
 if __name__ == '__main__':
     unittest.main()